@@ -2,6 +2,7 @@ import csv
 import io
 import random
 import string
+from datetime import timedelta
 from typing import List, Optional, Tuple, Union
 
 from fastapi import HTTPException, status
@@ -821,22 +822,31 @@ class CRUDApplication(
             )
 
     def get_distinct_emails_no_products(
-        self, db: Session, popup_city_id: int, exclude_emails: List[str] = []
+        self,
+        db: Session,
+        popup_city_id: int,
+        *,
+        exclude_event: Optional[str] = None,
+        exclude_within: Optional[timedelta] = None,
     ) -> list[models.Application]:
-        rows = (
-            db.query(models.Application)
-            .join(Attendee, Attendee.application_id == models.Application.id)
-            .outerjoin(AttendeeProduct, AttendeeProduct.attendee_id == Attendee.id)
-            .filter(
-                models.Application.email.notin_(exclude_emails),
-                models.Application.popup_city_id == popup_city_id,
-                models.Application.status == schemas.ApplicationStatus.ACCEPTED.value,
-                AttendeeProduct.attendee_id.is_(None),
-            )
-            .distinct()
-            .all()
+        # Correlated EXISTS instead of join + DISTINCT over every application
+        # column: any attendee of the application without products
+        attendee_without_products = exists().where(
+            Attendee.application_id == models.Application.id,
+            ~exists().where(AttendeeProduct.attendee_id == Attendee.id),
+        )
+        query = db.query(models.Application).filter(
+            models.Application.popup_city_id == popup_city_id,
+            models.Application.status == schemas.ApplicationStatus.ACCEPTED.value,
+            attendee_without_products,
         )
-        return rows
+        if exclude_event:
+            query = query.filter(
+                ~email_log.sent_since(
+                    models.Application.email, exclude_event, exclude_within
+                )
+            )
+        return query.all()
 
 
 application = CRUDApplication(models.Application)
@@ -1,11 +1,23 @@
+import hashlib
+from datetime import timedelta
 from typing import Optional
 
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from app.api.authorized_third_party_apps import models, schemas
 from app.api.base_crud import CRUDBase
+from app.core.cache import TTLCache
 from app.core.security import TokenData
 
+# Each worker keeps its own cache, so a deactivated key may still be accepted
+# by other workers for up to this long.
+API_KEY_CACHE_TTL = timedelta(seconds=60)
+
+
+def _api_key_fingerprint(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
 
 class CRUDAuthorizedThirdPartyApp(
     CRUDBase[
@@ -14,6 +26,10 @@ class CRUDAuthorizedThirdPartyApp(
         schemas.AuthorizedThirdPartyAppUpdate,
     ]
 ):
+    def __init__(self, model):
+        super().__init__(model)
+        self._api_key_cache = TTLCache(expiry=API_KEY_CACHE_TTL)
+
     def _check_permission(
         self, db_obj: models.AuthorizedThirdPartyApp, user: TokenData
     ) -> bool:
@@ -21,14 +37,41 @@ class CRUDAuthorizedThirdPartyApp(
 
     def get_by_api_key(
         self, db: Session, api_key: str
-    ) -> Optional[models.AuthorizedThirdPartyApp]:
-        """Get a third party app by API key"""
-        return (
-            db.query(self.model)
-            .filter(self.model.api_key == api_key)
-            .filter(self.model.active.is_(True))
-            .first()
-        )
+    ) -> Optional[schemas.AuthorizedThirdPartyApp]:
+        """Get an active third party app by API key, cached for a short TTL"""
+        fingerprint = _api_key_fingerprint(api_key)
+        if cached := self._api_key_cache.get(fingerprint):
+            return cached
+
+        db_obj = db.execute(
+            select(self.model)
+            .where(self.model.api_key == api_key, self.model.active.is_(True))
+            .limit(1)
+        ).scalar_one_or_none()
+        if not db_obj:
+            return None
+
+        third_party_app = schemas.AuthorizedThirdPartyApp.model_validate(db_obj)
+        self._api_key_cache.set(fingerprint, third_party_app)
+        return third_party_app
+
+    def update(
+        self,
+        db: Session,
+        id: int,
+        obj: schemas.AuthorizedThirdPartyAppUpdate,
+        user: TokenData,
+    ) -> models.AuthorizedThirdPartyApp:
+        db_obj = super().update(db, id, obj, user)
+        self._api_key_cache.pop(_api_key_fingerprint(db_obj.api_key))
+        return db_obj
+
+    def delete(
+        self, db: Session, id: int, user: TokenData
+    ) -> models.AuthorizedThirdPartyApp:
+        db_obj = super().delete(db, id, user)
+        self._api_key_cache.pop(_api_key_fingerprint(db_obj.api_key))
+        return db_obj
 
 
 authorized_third_party_app = CRUDAuthorizedThirdPartyApp(models.AuthorizedThirdPartyApp)
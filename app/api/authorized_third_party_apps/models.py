@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, DateTime, Integer, String
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, String
 
 from app.core.database import Base
 from app.core.utils import current_time
@@ -20,3 +20,13 @@ class AuthorizedThirdPartyApp(Base):
 
     created_at = Column(DateTime, default=current_time)
     updated_at = Column(DateTime, default=current_time, onupdate=current_time)
+
+    __table_args__ = (
+        # get_by_api_key runs on every third-party authentication request
+        Index(
+            'ix_authorized_third_party_apps_api_key_active',
+            api_key,
+            active,
+            postgresql_where=active.is_(True),
+        ),
+    )
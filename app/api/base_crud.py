@@ -1,4 +1,4 @@
-from typing import Generic, List, Optional, Type, TypeVar
+from typing import Generic, List, Optional, Sequence, Type, TypeVar
 
 import psycopg2
 from fastapi import HTTPException, status
@@ -6,6 +6,7 @@ from pydantic import BaseModel
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.orm import Query, Session
+from sqlalchemy.orm.interfaces import ORMOption
 
 from app.core.logger import logger
 from app.core.security import SYSTEM_TOKEN, TokenData
@@ -81,9 +82,18 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             db.rollback()
             raise e
 
-    def get(self, db: Session, id: int, user: TokenData) -> ModelType:
-        """Get a single record by id with permission check."""
-        obj = db.query(self.model).filter(self.model.id == id).first()
+    def get(
+        self,
+        db: Session,
+        id: int,
+        user: TokenData,
+        options: Sequence[ORMOption] = (),
+    ) -> ModelType:
+        """Get a single record by id with permission check.
+
+        `options` are passed to the query, e.g. eager loads for the caller.
+        """
+        obj = db.query(self.model).options(*options).filter(self.model.id == id).first()
         if not obj:
             logger.error('Record not found')
             raise HTTPException(
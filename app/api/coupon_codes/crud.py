@@ -45,10 +45,10 @@ class CRUDCouponCode(
         return coupon_code
 
     def use_coupon_code(self, db: Session, coupon_code_id: int):
+        """Count a use of the coupon; the caller commits it with the payment."""
         coupon_code = self.get(db, coupon_code_id, user=SYSTEM_TOKEN)
         current_uses = coupon_code.current_uses or 0
         coupon_code.current_uses = current_uses + 1
-        db.commit()
 
 
 coupon_code = CRUDCouponCode(models.CouponCode)
@@ -1,10 +1,11 @@
 import json
 import urllib.parse
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
-import requests
+import httpx
 from fastapi import HTTPException, status
+from sqlalchemy import exists
 from sqlalchemy.orm import Session
 
 from app.api.applications.models import Application
@@ -20,7 +21,7 @@ from app.api.popup_city.models import PopUpCity
 from app.core.config import get_popup_email_config, get_popup_frontend_url, settings
 from app.core.database import SessionLocal
 from app.core.logger import logger
-from app.core.mail import send_mail
+from app.core.mail import build_message, send_batch, send_mail
 from app.core.utils import create_spice, current_time, encode
 
 
@@ -52,6 +53,29 @@ def _generate_authenticate_url(
     return auth_url
 
 
+def _render_popup_email(
+    event: str, popup_city: Optional[PopUpCity], params: dict
+) -> Tuple[str, dict]:
+    """Resolve the template for an event and add the popup params in place."""
+    template = event
+    if popup_city:
+        template = popup_city.get_email_template(event)
+        params.update(
+            {
+                'popup_name': popup_city.name,
+                'web_url': popup_city.web_url,
+                'email_image': popup_city.email_image,
+                'contact_email': popup_city.contact_email,
+                'blog_url': popup_city.blog_url,
+                'twitter_url': popup_city.twitter_url,
+            }
+        )
+
+    popup_slug = popup_city.slug if popup_city else None
+    params['portal_url'] = get_popup_frontend_url(popup_slug)
+    return template, get_popup_email_config(popup_slug)
+
+
 class CRUDEmailLog(
     CRUDBase[models.EmailLog, schemas.EmailLogCreate, schemas.EmailLogCreate]
 ):
@@ -81,17 +105,14 @@ class CRUDEmailLog(
         entity_id: int,
         event: str,
     ) -> bool:
-        return (
-            db.query(self.model)
-            .filter(
+        return db.query(
+            exists().where(
                 self.model.entity_type == entity_type,
                 self.model.entity_id == entity_id,
                 self.model.event == event,
                 self.model.status.in_([EmailStatus.SUCCESS, EmailStatus.SCHEDULED]),
             )
-            .first()
-            is not None
-        )
+        ).scalar()
 
     def send_mail(
         self,
@@ -126,25 +147,7 @@ class CRUDEmailLog(
         error_message = None
         template = event
         try:
-            if popup_city:
-                template = popup_city.get_email_template(event)
-                params.update(
-                    {
-                        'popup_name': popup_city.name,
-                        'web_url': popup_city.web_url,
-                        'email_image': popup_city.email_image,
-                        'contact_email': popup_city.contact_email,
-                        'blog_url': popup_city.blog_url,
-                        'twitter_url': popup_city.twitter_url,
-                    }
-                )
-
-            params['portal_url'] = get_popup_frontend_url(
-                popup_city.slug if popup_city else None
-            )
-            email_config = get_popup_email_config(
-                popup_city.slug if popup_city else None
-            )
+            template, email_config = _render_popup_email(event, popup_city, params)
 
             if send_at is not None:
                 logger.info('Scheduled email to be sent at %s', send_at)
@@ -190,6 +193,95 @@ class CRUDEmailLog(
                 if own_session:
                     db.close()
 
+    def send_mail_batch(
+        self,
+        db: Session,
+        emails: List[dict],
+        *,
+        send_at: Optional[datetime] = None,
+    ) -> List[dict]:
+        """Send several emails with a single Postmark request.
+
+        Each item takes the same keyword arguments as send_mail. Emails with
+        send_at are only logged as scheduled, like send_mail does.
+        """
+        logs = []
+        messages = []
+        for email in emails:
+            params = email.get('params') or {}
+            popup_city = email.get('popup_city')
+            log = EmailLogCreate(
+                receiver_email=email['receiver_mail'],
+                popup_city_id=popup_city.id if popup_city else None,
+                template=email['event'],
+                event=email['event'],
+                params=params,
+                status=EmailStatus.FAILED,
+                send_at=send_at,
+                entity_type=email.get('entity_type'),
+                entity_id=email.get('entity_id'),
+                attachments=email.get('attachments'),
+            )
+            logs.append(log)
+            try:
+                log.template, email_config = _render_popup_email(
+                    email['event'], popup_city, params
+                )
+            except Exception as e:
+                log.error_message = str(e)
+                logger.error(
+                    'Failed to render email %s for event %s: %s',
+                    log.receiver_email,
+                    log.event,
+                    str(e),
+                )
+                continue
+
+            if send_at is not None:
+                log.status = EmailStatus.SCHEDULED
+                continue
+
+            message = build_message(
+                log.receiver_email,
+                template=log.template,
+                params=params,
+                attachments=log.attachments,
+                from_address=email_config['from_address'],
+                from_name=email_config['from_name'],
+                reply_to=email_config['reply_to'],
+            )
+            messages.append((log, message))
+
+        if send_at is not None:
+            logger.info('Scheduled %s emails to be sent at %s', len(logs), send_at)
+
+        if messages:
+            # End the read transaction so the connection goes back to the pool
+            # while Postmark is called
+            db.commit()
+            results = send_batch([message for _, message in messages])
+            for (log, _), result in zip(messages, results):
+                log.status = result['status']
+                log.error_message = result.get('error')
+
+        try:
+            self._create_logs(db, logs)
+        except Exception as db_error:
+            logger.error('Failed to log emails: %s', str(db_error))
+            db.rollback()
+
+        return [{'status': log.status, 'error': log.error_message} for log in logs]
+
+    def _create_logs(self, db: Session, logs: List[EmailLogCreate]) -> None:
+        model_columns = self.model.__table__.columns.keys()
+        db.add_all(
+            self.model(
+                **{k: v for k, v in log.model_dump().items() if k in model_columns}
+            )
+            for log in logs
+        )
+        db.commit()
+
     def send_login_mail(
         self,
         receiver_mail: str,
@@ -246,7 +338,7 @@ class CRUDEmailLog(
             )
             email_status = response_data['status']
             return response_data
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPError as e:
             error_message = str(e)
             logger.error('Failed to send email %s: %s', receiver_mail, str(e))
             raise HTTPException(
@@ -282,6 +374,8 @@ class CRUDEmailLog(
         )
         logger.info('Found %s scheduled emails', len(scheduled_emails))
 
+        due_emails = []
+        messages = []
         for email in scheduled_emails:
             logger.info('Processing email %s, send_at: %s', email.id, email.send_at)
             if email.send_at > current_time():
@@ -290,44 +384,55 @@ class CRUDEmailLog(
 
             try:
                 params = json.loads(email.params)
-                send_mail(
-                    receiver_mail=email.receiver_email,
-                    template=email.template,
-                    params=params,
-                )
-                email.status = EmailStatus.SUCCESS
-                email.error_message = None
             except Exception as e:
                 logger.error('Failed to send email %s: %s', email.id, str(e))
                 email.status = EmailStatus.FAILED
                 email.error_message = str(e)
-            finally:
-                # Commit changes for each email individually
-                try:
-                    db.commit()
-                except Exception as db_error:
-                    logger.error(
-                        'Failed to update email log %s: %s', email.id, str(db_error)
-                    )
-                    db.rollback()
+                continue
+            due_emails.append(email)
+            messages.append(
+                build_message(
+                    email.receiver_email, template=email.template, params=params
+                )
+            )
+
+        if messages:
+            results = send_batch(messages)
+            for email, result in zip(due_emails, results):
+                email.status = result['status']
+                email.error_message = result.get('error')
+
+        try:
+            db.commit()
+        except Exception as db_error:
+            logger.error('Failed to update scheduled email logs: %s', str(db_error))
+            db.rollback()
 
     def cancel_scheduled_emails(self, db: Session, entity_type: str, entity_id: int):
+        return self.cancel_scheduled_emails_bulk(db, entity_type, [entity_id])
+
+    def cancel_scheduled_emails_bulk(
+        self, db: Session, entity_type: str, entity_ids: List[int]
+    ):
+        """Cancel the scheduled emails of several entities with one UPDATE."""
         db.query(self.model).filter(
             self.model.entity_type == entity_type,
-            self.model.entity_id == entity_id,
+            self.model.entity_id.in_(entity_ids),
             self.model.status == EmailStatus.SCHEDULED,
-        ).update({'status': EmailStatus.CANCELLED})
+        ).update({'status': EmailStatus.CANCELLED}, synchronize_session=False)
         db.commit()
         return {'message': 'Scheduled emails cancelled successfully'}
 
-    def get_email_logs(
-        self, db: Session, event: str, delta: timedelta
-    ) -> List[models.EmailLog]:
-        return (
-            db.query(self.model)
-            .filter(self.model.event == event)
-            .filter(self.model.created_at > current_time() - delta)
-            .all()
+    def sent_since(self, email, event: str, delta: timedelta):
+        """EXISTS clause for an `event` email sent to `email` within `delta`.
+
+        Lets callers exclude recent recipients in the database instead of
+        loading their addresses and sending them back in a NOT IN list.
+        """
+        return exists().where(
+            self.model.receiver_email == email,
+            self.model.event == event,
+            self.model.created_at > current_time() - delta,
         )
 
 
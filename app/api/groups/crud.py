@@ -537,24 +537,24 @@ class CRUDGroup(CRUDBase[models.Group, schemas.GroupBase, schemas.GroupBase]):
         description = 'You\'re invited to skip the application process and proceed directly to checkout. Provide your information below to secure your ticket(s) to <a href="https://www.edgecity.live/patagonia" target="_blank" style="color: #3366FF;">Edge Patagonia 2025</a>!'
         welcome_message = f'This is a personal invite link from {application.first_name} {application.last_name}.'
 
-        group = self.create(
-            db,
-            schemas.GroupBase(
-                name=f'{application.first_name} {application.last_name} Invite List',
-                slug=slug,
-                description=description,
-                discount_percentage=0,
-                popup_city_id=application.popup_city_id,
-                max_members=None,
-                welcome_message=welcome_message,
-                is_ambassador_group=True,
-                ambassador_id=application.citizen_id,
-                ambassador_email=application.email,
-            ),
-            user=SYSTEM_TOKEN,
+        # Flushed, not committed: callers commit the group together with the
+        # payment approval that created it
+        group = self.model(
+            name=f'{application.first_name} {application.last_name} Invite List',
+            slug=slug,
+            description=description,
+            discount_percentage=0,
+            popup_city_id=application.popup_city_id,
+            max_members=None,
+            welcome_message=welcome_message,
+            is_ambassador_group=True,
+            ambassador_id=application.citizen_id,
+            ambassador_email=application.email,
         )
-        logger.info('Ambassador group created: %s %s', group.id, group.slug)
         group.leaders.append(application.citizen)
+        db.add(group)
+        db.flush()
+        logger.info('Ambassador group created: %s %s', group.id, group.slug)
         return group
 
 
@@ -1,8 +1,11 @@
 import base64
-from typing import List, Optional
+from typing import Iterable, List, Optional, Sequence, Tuple
 
-from fastapi import HTTPException
-from sqlalchemy.orm import Query, Session
+from fastapi import BackgroundTasks, HTTPException, status
+from sqlalchemy import bindparam, case, delete, func, insert, select, tuple_, update
+from sqlalchemy.orm import Query, Session, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.interfaces import ORMOption
 
 from app.api.applications.models import Application
 from app.api.attendees.models import Attendee, AttendeeProduct
@@ -14,27 +17,68 @@ from app.api.payments import schemas
 from app.api.payments.schemas import PaymentSource
 from app.api.products.models import Product
 from app.core import models, payments_utils, segment
+from app.core.database import SessionLocal
 from app.core.invoice import generate_invoice_pdf
 from app.core.logger import logger
 from app.core.security import TokenData
 from app.core.utils import current_time
 
+# Built once so each call only binds parameters; the expanding IN keeps a
+# single cached compilation regardless of how many ids are passed.
+COUNT_APPLICATION_ATTENDEES = select(func.count(Attendee.id)).where(
+    Attendee.id.in_(bindparam('ids', expanding=True)),
+    Attendee.application_id == bindparam('application_id'),
+)
+DELETE_APPLICATION_PRODUCTS = (
+    delete(AttendeeProduct)
+    .where(
+        AttendeeProduct.attendee_id.in_(
+            select(Attendee.id).where(
+                Attendee.application_id == bindparam('application_id')
+            )
+        )
+    )
+    .returning(AttendeeProduct.product_id, AttendeeProduct.quantity)
+)
+
 
 class CRUDPayment(
     CRUDBase[models.Payment, schemas.PaymentCreate, schemas.PaymentUpdate]
 ):
-    def _check_permission(self, db_obj: models.Payment, user: TokenData) -> bool:
-        return db_obj.application.citizen_id == user.citizen_id
+    def get(
+        self,
+        db: Session,
+        id: int,
+        user: TokenData,
+        options: Sequence[ORMOption] = (),
+    ) -> models.Payment:
+        """Get a payment owned by the user, filtering ownership in SQL."""
+        payment = db.scalars(
+            select(self.model)
+            .options(*options)
+            .join(self.model.application)
+            .where(self.model.id == id, Application.citizen_id == user.citizen_id)
+        ).one_or_none()
+        if payment:
+            return payment
+
+        # Only the error path pays for telling "missing" apart from "forbidden"
+        if db.scalar(select(self.model.id).where(self.model.id == id)) is None:
+            logger.error('Record not found')
+            raise HTTPException(
+                status_code=404, detail=f'{self.model.__name__} not found'
+            )
+        err_msg = f'Not authorized to access this {self.model.__name__}: {id}'
+        logger.error(err_msg)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=err_msg)
 
     def _apply_filters(
         self, query: Query, filters: Optional[schemas.BaseModel] = None
     ) -> Query:
         query = super()._apply_filters(query, filters)
 
-        filter_data = filters.model_dump(exclude_none=True)
-
-        if 'citizen_id' in filter_data:
-            citizen_id = filter_data.pop('citizen_id')
+        citizen_id = getattr(filters, 'citizen_id', None)
+        if citizen_id is not None:
             query = query.join(models.Payment.application).filter(
                 Application.citizen_id == citizen_id
             )
@@ -53,6 +97,58 @@ class CRUDPayment(
             filters.citizen_id = user.citizen_id
         return super().find(db, skip, limit, filters)
 
+    def get_by_external_id(
+        self, db: Session, external_id: str
+    ) -> Optional[models.Payment]:
+        """Get the latest payment for a SimpleFi payment request or plan id."""
+        return db.scalars(
+            select(self.model)
+            .options(joinedload(self.model.application))
+            .where(self.model.external_id == external_id)
+            .order_by(self.model.created_at.desc())
+            .limit(1)
+        ).first()
+
+    def record_installment(self, db: Session, payment: models.Payment) -> int:
+        """Increment installments_paid in the database and return the new count.
+
+        The increment happens in the UPDATE itself, so two installment webhooks
+        for the same plan cannot both read the old count and number their
+        installments the same. The version is bumped as well, so a worker still
+        holding the previous version fails its next flush as stale.
+        """
+        installments_paid, version = db.execute(
+            update(self.model)
+            .where(self.model.id == payment.id)
+            .values(
+                installments_paid=func.coalesce(self.model.installments_paid, 0) + 1,
+                version=self.model.version + 1,
+            )
+            .returning(self.model.installments_paid, self.model.version)
+            .execution_options(synchronize_session=False)
+        ).one()
+        # Record the new row as the loaded state, so the payment's next flush
+        # neither rewrites the count nor fails its own version check
+        set_committed_value(payment, 'installments_paid', installments_paid)
+        set_committed_value(payment, 'version', version)
+        return installments_paid
+
+    def _load_payment_graph(self, db: Session, payment_id: int) -> models.Payment:
+        """Reload a payment with every relationship the approval flow walks."""
+        return db.scalars(
+            select(self.model)
+            .options(
+                selectinload(self.model.products_snapshot)
+                .selectinload(models.PaymentProduct.attendee)
+                .selectinload(Attendee.attendee_products),
+                selectinload(self.model.application).selectinload(
+                    Application.attendees
+                ),
+            )
+            .where(self.model.id == payment_id)
+            .execution_options(populate_existing=True)
+        ).one()
+
     def preview(
         self,
         db: Session,
@@ -66,8 +162,9 @@ class CRUDPayment(
         db: Session,
         obj: schemas.PaymentCreate,
         user: Optional[TokenData] = None,
+        background_tasks: Optional[BackgroundTasks] = None,
     ) -> models.Payment:
-        payment_data = payments_utils.create_payment(db, obj, user)
+        payment_data, valid_products = payments_utils.create_payment(db, obj, user)
 
         payment_dict = payment_data.model_dump(exclude={'products', 'original_amount'})
         payment_dict['edit_passes'] = obj.edit_passes
@@ -80,22 +177,18 @@ class CRUDPayment(
         if obj.products:
             # validate that the attendees correspond to the application
             attendees_ids = {p.attendee_id for p in obj.products}
-            attendees = db.query(Attendee).filter(Attendee.id.in_(attendees_ids)).all()
-            if len(attendees) != len(attendees_ids):
+            valid_attendees = db.scalar(
+                COUNT_APPLICATION_ATTENDEES,
+                {'ids': list(attendees_ids), 'application_id': obj.application_id},
+            )
+            if valid_attendees != len(attendees_ids):
                 raise HTTPException(status_code=400, detail='Invalid attendees')
-            for attendee in attendees:
-                if attendee.application_id != obj.application_id:
-                    raise HTTPException(status_code=400, detail='Invalid attendees')
 
-            product_ids = [p.product_id for p in obj.products]
-            products_data = {
-                p.id: p
-                for p in db.query(Product).filter(Product.id.in_(product_ids)).all()
-            }
+            products_data = {p.id: p for p in valid_products}
 
+            snapshot_rows = []
             for product in obj.products:
-                product_id = product.product_id
-                product_data = products_data[product_id]
+                product_data = products_data[product.product_id]
 
                 # Use custom_price for donations, otherwise use product's base price
                 if product_data.category == 'donation' and product.custom_price:
@@ -103,39 +196,42 @@ class CRUDPayment(
                 else:
                     price = product_data.price
 
-                payment_product = models.PaymentProduct(
-                    payment_id=db_payment.id,
-                    product_id=product_id,
-                    attendee_id=product.attendee_id,
-                    quantity=product.quantity,
-                    product_name=product_data.name,
-                    product_description=product_data.description,
-                    product_price=price,
-                    product_category=product_data.category,
+                snapshot_rows.append(
+                    {
+                        'payment_id': db_payment.id,
+                        'product_id': product.product_id,
+                        'attendee_id': product.attendee_id,
+                        'quantity': product.quantity,
+                        'product_name': product_data.name,
+                        'product_description': product_data.description,
+                        'product_price': price,
+                        'product_category': product_data.category,
+                    }
                 )
-                db.add(payment_product)
-
-            db.flush()
-            db.refresh(db_payment)
+            db.execute(insert(models.PaymentProduct), snapshot_rows)
 
+        group = None
         if db_payment.status == 'approved':
             if db_payment.edit_passes:
                 self._clear_application_products(db, db_payment)
 
+            db_payment = self._load_payment_graph(db, db_payment.id)
+
             if db_payment.coupon_code_id is not None:
                 coupon_code_crud.use_coupon_code(db, db_payment.coupon_code_id)
 
             self._decrement_inventory(db, db_payment)
-            self._add_products_to_attendees(db_payment)
+            self._add_products_to_attendees(db, db_payment)
             group = self._create_ambassador_group(db, db_payment)
-            if not db_payment.is_installment_plan:
-                self._send_payment_confirmed_email(db_payment, group)
 
         db.commit()
         db.refresh(db_payment)
 
+        if db_payment.status == 'approved' and not db_payment.is_installment_plan:
+            self._queue_payment_confirmed_email(db_payment, group, background_tasks)
+
         if db_payment.status == 'approved' and not db_payment.is_application_fee:
-            self._track_order_completed(db_payment)
+            self._track_order_completed(db_payment, background_tasks)
 
         return db_payment
 
@@ -165,7 +261,10 @@ class CRUDPayment(
         return db_payment
 
     def _handle_fee_approved(self, db: Session, payment: models.Payment) -> None:
-        """Handle application fee approval: submit the application."""
+        """Handle application fee approval: submit the application.
+
+        Changes are left pending; the caller flushes them on commit.
+        """
         from app.api.applications.crud import (
             _send_application_received_mail,
             calculate_status,
@@ -183,24 +282,33 @@ class CRUDPayment(
         if application.status == 'in review':
             _send_application_received_mail(application)
 
-        db.flush()
-
-    def _add_products_to_attendees(self, payment: models.Payment) -> None:
+    def _add_products_to_attendees(self, db: Session, payment: models.Payment) -> None:
         if not payment.products_snapshot:
             return
 
         logger.info('Adding products to attendees')
+        attendees = {ps.attendee_id: ps.attendee for ps in payment.products_snapshot}
+        existing = {
+            (ap.attendee_id, ap.product_id)
+            for attendee in attendees.values()
+            for ap in attendee.attendee_products
+        }
+        rows = []
         for product_snapshot in payment.products_snapshot:
-            attendee = product_snapshot.attendee
-            product_id = product_snapshot.product_id
-            if product_id not in [p.id for p in attendee.products]:
-                attendee.attendee_products.append(
-                    AttendeeProduct(
-                        attendee_id=attendee.id,
-                        product_id=product_id,
-                        quantity=product_snapshot.quantity,
-                    )
-                )
+            key = (product_snapshot.attendee_id, product_snapshot.product_id)
+            if key in existing:
+                continue
+            existing.add(key)
+            rows.append(
+                {
+                    'attendee_id': product_snapshot.attendee_id,
+                    'product_id': product_snapshot.product_id,
+                    'quantity': product_snapshot.quantity,
+                }
+            )
+
+        if rows:
+            db.execute(insert(AttendeeProduct), rows)
 
     def _remove_products_from_attendees(
         self, db: Session, payment: models.Payment
@@ -210,19 +318,44 @@ class CRUDPayment(
             return
 
         logger.info('Removing products from attendees for payment %s', payment.id)
-        for product_snapshot in payment.products_snapshot:
-            # Find and remove the AttendeeProduct record matching this payment's snapshot
-            attendee_product = (
-                db.query(AttendeeProduct)
-                .filter(
-                    AttendeeProduct.attendee_id == product_snapshot.attendee.id,
-                    AttendeeProduct.product_id == product_snapshot.product_id,
-                    AttendeeProduct.quantity == product_snapshot.quantity,
-                )
-                .first()
+        snapshot_rows = [
+            (ps.attendee_id, ps.product_id, ps.quantity)
+            for ps in payment.products_snapshot
+        ]
+        db.execute(
+            delete(AttendeeProduct)
+            .where(
+                tuple_(
+                    AttendeeProduct.attendee_id,
+                    AttendeeProduct.product_id,
+                    AttendeeProduct.quantity,
+                ).in_(snapshot_rows)
             )
-            if attendee_product:
-                db.delete(attendee_product)
+            .execution_options(synchronize_session='fetch')
+        )
+
+    def _adjust_inventory(
+        self, db: Session, quantities: Iterable[Tuple[int, int]], direction: int
+    ) -> None:
+        """Add (direction=1) or return (direction=-1) (product_id, quantity)
+        pairs to the sold count in a single UPDATE. Products without
+        max_inventory are not tracked."""
+        qty_by_product: dict[int, int] = {}
+        for product_id, quantity in quantities:
+            qty_by_product[product_id] = qty_by_product.get(product_id, 0) + quantity
+
+        current_sold = func.coalesce(Product.current_sold, 0) + direction * case(
+            qty_by_product, value=Product.id, else_=0
+        )
+        db.execute(
+            update(Product)
+            .where(Product.id.in_(qty_by_product), Product.max_inventory.is_not(None))
+            .values(current_sold=case((current_sold < 0, 0), else_=current_sold))
+            .execution_options(synchronize_session='fetch')
+        )
+
+    def _snapshot_quantities(self, payment: models.Payment) -> List[Tuple[int, int]]:
+        return [(ps.product_id, ps.quantity) for ps in payment.products_snapshot]
 
     def _decrement_inventory(self, db: Session, payment: models.Payment) -> None:
         """Decrement inventory for purchased products."""
@@ -230,15 +363,7 @@ class CRUDPayment(
             return
 
         logger.info('Decrementing inventory for payment %s', payment.id)
-        product_ids = {ps.product_id for ps in payment.products_snapshot}
-        products = {
-            p.id: p for p in db.query(Product).filter(Product.id.in_(product_ids)).all()
-        }
-
-        for ps in payment.products_snapshot:
-            product = products.get(ps.product_id)
-            if product and product.max_inventory is not None:
-                product.current_sold = (product.current_sold or 0) + ps.quantity
+        self._adjust_inventory(db, self._snapshot_quantities(payment), 1)
 
     def _increment_inventory(self, db: Session, payment: models.Payment) -> None:
         """Increment inventory for products (reverse of decrement)."""
@@ -246,51 +371,20 @@ class CRUDPayment(
             return
 
         logger.info('Incrementing inventory for payment %s', payment.id)
-        product_ids = {ps.product_id for ps in payment.products_snapshot}
-        products = {
-            p.id: p for p in db.query(Product).filter(Product.id.in_(product_ids)).all()
-        }
-
-        for ps in payment.products_snapshot:
-            product = products.get(ps.product_id)
-            if product and product.max_inventory is not None:
-                product.current_sold = max(0, (product.current_sold or 0) - ps.quantity)
+        self._adjust_inventory(db, self._snapshot_quantities(payment), -1)
 
     def _clear_application_products(self, db: Session, payment: models.Payment) -> None:
         logger.info('Removing products from attendees')
-        application = payment.application
-        attendees_ids = {a.id for a in application.attendees}
 
-        # Return inventory before clearing products
-        existing_products = (
-            db.query(AttendeeProduct)
-            .filter(AttendeeProduct.attendee_id.in_(attendees_ids))
-            .all()
-        )
-
-        if existing_products:
-            product_ids = {ap.product_id for ap in existing_products}
-            products = {
-                p.id: p
-                for p in db.query(Product).filter(Product.id.in_(product_ids)).all()
-            }
-
-            for ap in existing_products:
-                product = products.get(ap.product_id)
-                if product and product.max_inventory is not None:
-                    product.current_sold = max(
-                        0, (product.current_sold or 0) - ap.quantity
-                    )
-                    logger.info(
-                        'Returned %s of product %s to inventory',
-                        ap.quantity,
-                        product.id,
-                    )
-
-        # Delete the products
-        db.query(AttendeeProduct).filter(
-            AttendeeProduct.attendee_id.in_(attendees_ids)
-        ).delete(synchronize_session=False)
+        # Delete the products and return their quantities to inventory
+        deleted = db.execute(
+            DELETE_APPLICATION_PRODUCTS,
+            {'application_id': payment.application_id},
+            execution_options={'synchronize_session': False},
+        ).all()
+        if deleted:
+            logger.info('Returning %s attendee products to inventory', len(deleted))
+            self._adjust_inventory(db, deleted, -1)
 
     def _send_payment_confirmed_email(
         self, payment: models.Payment, group: Optional[models.Group]
@@ -339,6 +433,26 @@ class CRUDPayment(
             attachments=attachments,
         )
 
+    def _queue_payment_confirmed_email(
+        self,
+        payment: models.Payment,
+        group: Optional[models.Group],
+        background_tasks: Optional[BackgroundTasks] = None,
+    ) -> None:
+        """Send the confirmation email after the response when possible.
+
+        Rendering the invoice PDF and calling the mail provider are slow, so
+        request handlers pass their BackgroundTasks and the work runs after the
+        response with its own session. Other callers send it inline.
+        """
+        if background_tasks is None:
+            self._send_payment_confirmed_email(payment, group)
+            return
+
+        background_tasks.add_task(
+            send_payment_confirmed_email, payment.id, group.id if group else None
+        )
+
     def _create_ambassador_group(
         self, db: Session, payment: models.Payment
     ) -> Optional[models.Group]:
@@ -351,71 +465,99 @@ class CRUDPayment(
         db: Session,
         payment: models.Payment,
         *,
-        user: TokenData,
         currency: Optional[str] = None,
         rate: Optional[float] = None,
+        background_tasks: Optional[BackgroundTasks] = None,
     ) -> models.Payment:
-        """Handle payment approval and related operations."""
+        """Handle payment approval and related operations.
+
+        All changes, including any the caller left pending on the session, are
+        committed together once the approval is complete.
+        """
         if payment.status == 'approved':
             logger.info('Payment %s already approved', payment.id)
             return payment
 
-        source = PaymentSource.STRIPE if currency == 'USD' else PaymentSource.SIMPLEFI
-        payment_update = schemas.PaymentUpdate(
-            status='approved',
-            currency=currency,
-            rate=rate,
-            source=source,
+        payment.status = 'approved'
+        payment.currency = currency
+        payment.rate = rate
+        payment.source = (
+            PaymentSource.STRIPE if currency == 'USD' else PaymentSource.SIMPLEFI
         )
-        updated_payment = self.update(db, payment.id, payment_update, user)
 
         if payment.is_application_fee:
             self._handle_fee_approved(db, payment)
             logger.info('Application fee payment %s approved', payment.id)
             db.commit()
-            return updated_payment
+            return payment
 
         if payment.edit_passes:
             self._clear_application_products(db, payment)
+
+        # Flush first: the reload below overwrites unflushed attribute changes
+        db.flush()
+        payment = self._load_payment_graph(db, payment.id)
+        if payment.edit_passes:
             payment.application.credit = 0
-            db.flush()
-            db.refresh(payment.application)
 
         if payment.coupon_code_id is not None:
             coupon_code_crud.use_coupon_code(db, payment.coupon_code_id)
 
         self._decrement_inventory(db, payment)
-        self._add_products_to_attendees(payment)
+        self._add_products_to_attendees(db, payment)
         group = self._create_ambassador_group(db, payment)
-        if not payment.is_installment_plan:
-            self._send_payment_confirmed_email(payment, group)
 
         logger.info('Payment %s approved', payment.id)
         db.commit()
 
-        self._track_order_completed(payment)
+        if not payment.is_installment_plan:
+            self._queue_payment_confirmed_email(payment, group, background_tasks)
+
+        self._track_order_completed(payment, background_tasks)
 
-        return updated_payment
+        return payment
 
-    def _track_order_completed(self, payment: models.Payment) -> None:
+    def _track_order_completed(
+        self,
+        payment: models.Payment,
+        background_tasks: Optional[BackgroundTasks] = None,
+    ) -> None:
         app = payment.application
         user_id = app.email.lower()
         products = []
         if payment.products_snapshot:
             for ps in payment.products_snapshot:
-                products.append({
-                    'product_id': ps.product_id,
-                    'name': ps.product_name,
-                    'price': ps.product_price or 0,
-                    'quantity': ps.quantity or 1,
-                })
-
-        segment.track(user_id, 'Order Completed', {
+                products.append(
+                    {
+                        'product_id': ps.product_id,
+                        'name': ps.product_name,
+                        'price': ps.product_price or 0,
+                        'quantity': ps.quantity or 1,
+                    }
+                )
+
+        properties = {
             'order_id': payment.id,
             'total': payment.amount or 0,
             'currency': payment.currency or 'USD',
             'products': products,
-        })
+        }
+        # The payload is built here while the session is open; the HTTP call
+        # itself runs after the response so it doesn't hold a DB connection
+        if background_tasks is None:
+            segment.track(user_id, 'Order Completed', properties)
+        else:
+            background_tasks.add_task(
+                segment.track, user_id, 'Order Completed', properties
+            )
 
 
 payment = CRUDPayment(models.Payment)
+
+
+def send_payment_confirmed_email(payment_id: int, group_id: Optional[int]) -> None:
+    """Background task: load the payment in a fresh session and email it."""
+    with SessionLocal() as db:
+        db_payment = db.get(models.Payment, payment_id)
+        group = db.get(models.Group, group_id) if group_id else None
+        payment._send_payment_confirmed_email(db_payment, group)
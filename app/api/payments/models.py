@@ -1,6 +1,15 @@
 from typing import TYPE_CHECKING, List
 
-from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, String
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Integer,
+    String,
+    UniqueConstraint,
+)
 from sqlalchemy.orm import Mapped, relationship
 
 from app.core.database import Base
@@ -15,9 +24,12 @@ if TYPE_CHECKING:
 class PaymentProduct(Base):
     __tablename__ = 'payment_products'
 
-    payment_id = Column(Integer, ForeignKey('payments.id'), primary_key=True)
-    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
-    attendee_id = Column(Integer, ForeignKey('attendees.id'), primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    payment_id = Column(Integer, ForeignKey('payments.id'), nullable=False)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    attendee_id = Column(
+        Integer, ForeignKey('attendees.id'), nullable=False, index=True
+    )
     quantity = Column(Integer, default=1)
 
     product_name = Column(String)
@@ -26,6 +38,12 @@ class PaymentProduct(Base):
     product_category = Column(String)
     created_at = Column(DateTime, default=current_time)
 
+    __table_args__ = (
+        UniqueConstraint(
+            'payment_id', 'product_id', 'attendee_id', name='uix_payment_product'
+        ),
+    )
+
     attendee: Mapped['Attendee'] = relationship(
         'Attendee', back_populates='payment_products'
     )
@@ -67,8 +85,10 @@ class Payment(Base):
         unique=True,
         index=True,
     )
-    application_id = Column(Integer, ForeignKey('applications.id'), nullable=False)
-    external_id = Column(String)
+    application_id = Column(
+        Integer, ForeignKey('applications.id'), index=True, nullable=False
+    )
+    external_id = Column(String, index=True)
     status = Column(String)
     amount = Column(Float)
     currency = Column(String)
@@ -86,6 +106,9 @@ class Payment(Base):
     is_application_fee = Column(
         Boolean, default=False, nullable=False, server_default='false'
     )
+    # Concurrent webhooks updating the same payment fail with StaleDataError
+    # instead of silently overwriting each other
+    version = Column(Integer, nullable=False, default=1, server_default='1')
 
     application: Mapped['Application'] = relationship(
         'Application', back_populates='payments'
@@ -99,3 +122,5 @@ class Payment(Base):
 
     created_at = Column(DateTime, default=current_time)
     updated_at = Column(DateTime, default=current_time, onupdate=current_time)
+
+    __mapper_args__ = {'version_id_col': version}
@@ -1,13 +1,14 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, Query
 from sqlalchemy.orm import Session
 
 from app.api.payments import schemas
 from app.api.payments.crud import payment as payment_crud
 from app.core.database import get_db
 from app.core.logger import logger
+from app.core.routing import ORJSONRoute
 from app.core.security import TokenData, get_current_user
 
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
 
 
 @router.get('/', response_model=list[schemas.Payment])
@@ -39,11 +40,14 @@ def get_payment(
 @router.post('/', response_model=schemas.Payment)
 def create_payment(
     payment: schemas.PaymentCreate,
+    background_tasks: BackgroundTasks,
     current_user: TokenData = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     logger.info('%s Creating payment: %s', current_user.email, payment)
-    return payment_crud.create(db=db, obj=payment, user=current_user)
+    return payment_crud.create(
+        db=db, obj=payment, user=current_user, background_tasks=background_tasks
+    )
 
 
 @router.post('/application-fee', response_model=schemas.Payment)
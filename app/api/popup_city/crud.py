@@ -62,18 +62,12 @@ class CRUDPopUpCity(
         if not popup:
             raise ValueError(f'Popup city {popup_city_id} not found')
 
-        email_logs = email_log_crud.get_email_logs(
-            db,
-            EmailEvent.INCREASE_REMINDER,
-            timedelta(days=4),
-        )
-        to_exclude = list({email_log.receiver_email for email_log in email_logs})
-        logger.info('Excluding %s emails', len(to_exclude))
-
+        # Applications reminded in the last 4 days are excluded in the query
         results = application_crud.get_distinct_emails_no_products(
             db,
             popup_city_id,
-            exclude_emails=to_exclude,
+            exclude_event=EmailEvent.INCREASE_REMINDER,
+            exclude_within=timedelta(days=4),
         )
         logger.info('Found %s emails to send reminder emails to', len(results))
         ticketing_url = urllib.parse.urljoin(
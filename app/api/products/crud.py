@@ -1,6 +1,7 @@
 from typing import List, Optional
 
 from pydantic import BaseModel
+from sqlalchemy import exists
 from sqlalchemy.orm import Session
 
 from app.api.base_crud import CRUDBase
@@ -27,15 +28,13 @@ class CRUDProduct(
         query = self._apply_filters(query, filters)
 
         if product_segment_ids:
-            query = (
-                query.join(
-                    ProductSegmentProduct,
+            # EXISTS keeps one row per product without a DISTINCT over every
+            # product column when it belongs to several of the segments
+            query = query.filter(
+                exists().where(
                     ProductSegmentProduct.product_id == self.model.id,
+                    ProductSegmentProduct.product_segment_id.in_(product_segment_ids),
                 )
-                .filter(
-                    ProductSegmentProduct.product_segment_id.in_(product_segment_ids)
-                )
-                .distinct()
             )
 
         if not hasattr(self.model, sort_by):
@@ -1,9 +1,44 @@
 from datetime import timedelta
 from functools import lru_cache
 
+from fastapi import Depends, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from app.api.webhooks import schemas
 from app.core.cache import WebhookCache
+from app.core.database import get_db
 
 
 @lru_cache()
 def get_webhook_cache() -> WebhookCache:
     return WebhookCache(expiry=timedelta(seconds=2))
+
+
+def get_webhook_db(db: Session = Depends(get_db)):
+    """Request session that keeps loaded objects populated across commits.
+
+    Payment webhooks commit and then read the same payment, its application
+    and snapshot to queue emails and analytics. Everything they read was
+    written or loaded by this session, so reloading it after the commit would
+    only repeat SELECTs. Rollbacks still expire the session.
+    """
+    db.expire_on_commit = False
+    try:
+        yield db
+    finally:
+        db.expire_on_commit = True
+
+
+async def nocodb_webhook_payload(request: Request) -> schemas.WebhookPayload:
+    """Validate a NocoDB webhook straight from the raw body.
+
+    pydantic-core parses and validates the JSON in one pass instead of first
+    building the dict tree a body parameter goes through, which matters for
+    the large row batches NocoDB sends.
+    """
+    try:
+        return schemas.WebhookPayload.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, DateTime, String
+
+from app.core.database import Base
+from app.core.utils import current_time
+
+
+class ProcessedWebhook(Base):
+    """Fingerprints of SimpleFi webhooks whose handling has been committed."""
+
+    __tablename__ = 'processed_webhooks'
+
+    fingerprint = Column(String, primary_key=True)
+    processed_at = Column(DateTime, default=current_time, nullable=False)
@@ -1,8 +1,24 @@
-from datetime import timedelta
-
-import requests
-from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+import hmac
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    status,
+)
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 
 from app.api.applications.crud import calculate_status
 from app.api.applications.models import Application
@@ -12,24 +28,47 @@ from app.api.email_logs.models import EmailLog
 from app.api.email_logs.schemas import EmailEvent, EmailStatus
 from app.api.payments.crud import payment as payment_crud
 from app.api.payments.models import PaymentInstallment
-from app.api.payments.schemas import PaymentFilter, PaymentUpdate
 from app.api.webhooks import schemas
-from app.api.webhooks.dependencies import get_webhook_cache
+from app.api.webhooks.dependencies import (
+    get_webhook_cache,
+    get_webhook_db,
+    nocodb_webhook_payload,
+)
+from app.api.webhooks.models import ProcessedWebhook
+from app.core import nocodb
 from app.core.cache import WebhookCache
 from app.core.config import settings
-from app.core.database import get_db
+from app.core.database import SessionLocal
+from app.core.http import http_client
 from app.core.logger import logger
-from app.core.security import TokenData
 from app.core.utils import current_time
 
 router = APIRouter()
 
+SimplefiHandledEvent = Union[
+    schemas.SimplefiWebhookPayload, schemas.InstallmentPlanCompletedPayload
+]
+
+APPROVED_EMAIL_EVENTS = frozenset(
+    {
+        EmailEvent.APPLICATION_APPROVED.value,
+        EmailEvent.APPLICATION_APPROVED_SCHOLARSHIP.value,
+        EmailEvent.APPLICATION_APPROVED_NON_SCHOLARSHIP.value,
+    }
+)
+
+# A SimpleFi webhook that keeps losing races for the same payment is left to be
+# redelivered after this many attempts
+SIMPLEFI_STALE_PAYMENT_ATTEMPTS = 3
 
+
+# Handlers that talk to the database or external APIs synchronously are plain
+# functions so FastAPI runs them in its threadpool instead of the event loop.
 @router.post('/update_status', status_code=status.HTTP_200_OK)
-async def update_status_webhook(
-    webhook_payload: schemas.WebhookPayload,
+def update_status_webhook(
+    background_tasks: BackgroundTasks,
+    webhook_payload: schemas.WebhookPayload = Depends(nocodb_webhook_payload),
     secret: str = Header(..., description='Secret'),
-    db: Session = Depends(get_db),
     webhook_cache: WebhookCache = Depends(get_webhook_cache),
 ):
     logger.info('POST /update_status')
@@ -39,7 +78,10 @@ async def update_status_webhook(
         logger.info('Webhook already processed. Skipping...')
         return {'message': 'Webhook already processed'}
 
-    if secret != settings.NOCODB_WEBHOOK_SECRET:
+    expected_secret = settings.NOCODB_WEBHOOK_SECRET
+    if not expected_secret or not hmac.compare_digest(
+        secret.encode(), expected_secret.encode()
+    ):
         logger.info('Secret is not valid. Skipping...')
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -53,227 +95,390 @@ async def update_status_webhook(
             detail='Table name is not applications',
         )
 
-    table_id = webhook_payload.data.table_id
-    url = f'{settings.NOCODB_URL}/api/v2/tables/{table_id}/records'
-    headers = {
-        'accept': 'application/json',
-        'xc-token': settings.NOCODB_TOKEN,
-        'Content-Type': 'application/json',
-    }
-    for row in webhook_payload.data.rows:
-        application = db.get(Application, row.id)
-        email = application.email
-        logger.info('Processing webhook for application %s %s', row.id, email)
-
-        row_dict = row.model_dump()
-        reviews_status = row_dict.get('calculated_status')
-        current_status = row_dict.get('status')
-
-        if application.group:
-            logger.info(
-                'Application is in group %s. Skipping...', application.group.slug
-            )
-            calculated_status = ApplicationStatus.ACCEPTED
-            if reviews_status == ApplicationStatus.WITHDRAWN.value:
-                calculated_status = ApplicationStatus.WITHDRAWN
-            requested_discount = False
-        else:
-            calculated_status, requested_discount = calculate_status(
-                application,
-                popup_city=application.popup_city,
-                reviews_status=reviews_status,
-            )
+    # Respond right away so NocoDB does not time out and retry large batches
+    background_tasks.add_task(
+        update_application_statuses,
+        webhook_payload.data.rows,
+        webhook_payload.data.table_id,
+    )
+    return {'message': 'Status update scheduled'}
+
+
+def _load_applications(
+    db: Session, rows: List[schemas.WebhookRow]
+) -> Dict[int, Application]:
+    """Load every application referenced by the rows in a single query.
+
+    group, popup_city and citizen are joined-eager relationships, so they come
+    back with the same statement instead of once per row.
+    """
+    ids = {int(row['id']) for row in rows}
+    applications = db.scalars(select(Application).where(Application.id.in_(ids)))
+    return {a.id: a for a in applications.unique()}
+
+
+def _group_status(reviews_status: Optional[str]) -> ApplicationStatus:
+    if reviews_status == ApplicationStatus.WITHDRAWN.value:
+        return ApplicationStatus.WITHDRAWN
+    return ApplicationStatus.ACCEPTED
+
+
+def update_application_statuses(
+    rows: List[schemas.WebhookRow],
+    table_id: str,
+) -> None:
+    updates = []
+    with SessionLocal() as db:
+        applications = _load_applications(db, rows)
+        for row in rows:
+            application = applications.get(int(row['id']))
+            if not application:
+                logger.error('Application %s not found. Skipping...', row['id'])
+                continue
+            try:
+                if data := _application_status_update(application, row):
+                    updates.append(data)
+            except Exception as e:
+                # Nothing is written here, so there is nothing to roll back
+                logger.error(
+                    'Failed to update status for application %s: %s', row['id'], e
+                )
 
-        if current_status == calculated_status:
-            logger.info(
-                'Status is the same as calculated status (%s). ID: %s, Email: %s. Skipping...',
-                calculated_status,
-                row.id,
-                email,
+        if updates:
+            email_log.cancel_scheduled_emails_bulk(
+                db,
+                entity_type='application',
+                entity_ids=[data['id'] for data in updates],
             )
-            continue
 
-        email_log.cancel_scheduled_emails(
-            db,
-            entity_type='application',
-            entity_id=row.id,
+    if updates:
+        # NocoDB's v2 records endpoint accepts a list for bulk updates
+        logger.info('update_status data: %s', updates)
+        response = http_client.patch(
+            nocodb.records_url(table_id), headers=nocodb.NOCODB_HEADERS, json=updates
         )
-
-        data = {
-            'id': row.id,
-            'status': calculated_status,
-            'requested_discount': requested_discount,
-        }
-        if (
-            calculated_status == ApplicationStatus.ACCEPTED
-            and application.accepted_at is None
-        ):
-            data['accepted_at'] = current_time().isoformat()
-
-        logger.info('update_status data: %s', data)
-        response = requests.patch(url, headers=headers, json=data)
         logger.info('update_status status code: %s', response.status_code)
         logger.info('update_status response: %s', response.json())
 
     logger.info('update_status finished')
-    return {'message': 'Status updated successfully'}
+
+
+def _application_status_update(
+    application: Application,
+    row: schemas.WebhookRow,
+) -> Optional[dict]:
+    """Return the NocoDB record update for the row, or None if unchanged."""
+    email = application.email
+    logger.info('Processing webhook for application %s %s', row['id'], email)
+
+    reviews_status = row.get('calculated_status')
+    current_status = row.get('status')
+
+    if application.group:
+        logger.info('Application is in group %s. Skipping...', application.group.slug)
+        calculated_status = _group_status(reviews_status)
+        requested_discount = False
+    else:
+        calculated_status, requested_discount = calculate_status(
+            application,
+            popup_city=application.popup_city,
+            reviews_status=reviews_status,
+        )
+
+    if current_status == calculated_status:
+        logger.info(
+            'Status is the same as calculated status (%s). ID: %s, Email: %s. Skipping...',
+            calculated_status,
+            row['id'],
+            email,
+        )
+        return None
+
+    data = {
+        'id': row['id'],
+        'status': calculated_status,
+        'requested_discount': requested_discount,
+    }
+    if (
+        calculated_status == ApplicationStatus.ACCEPTED
+        and application.accepted_at is None
+    ):
+        data['accepted_at'] = current_time().isoformat()
+
+    return data
 
 
 @router.post('/send_email', status_code=status.HTTP_200_OK)
-async def send_email_webhook(
-    webhook_payload: schemas.WebhookPayload,
+def send_email_webhook(
+    background_tasks: BackgroundTasks,
+    webhook_payload: schemas.WebhookPayload = Depends(nocodb_webhook_payload),
     event: str = Query(..., description='Email event'),
     fields: str = Query(..., description='Template fields'),
     unique: bool = Query(True, description='Verify if the email is unique'),
     delay: int = Query(0, description='Delay in minutes'),
-    db: Session = Depends(get_db),
 ):
     if not webhook_payload.data.rows:
         logger.info('No rows to send email')
         return {'message': 'No rows to send email'}
 
-    fields = [f.strip() for f in fields.split(',')]
-    processed_ids = []
+    fields = _parse_fields(fields)
 
     logger.info('Sending email %s to %s rows', event, len(webhook_payload.data.rows))
     logger.info('Fields: %s', fields)
     send_at = current_time() + timedelta(minutes=delay) if delay else None
 
-    for row in webhook_payload.data.rows:
-        row = row.model_dump()
-        if not row.get('email'):
-            logger.info('No email to send email. Skipping...')
-            continue
-
-        params = {k: v for k, v in row.items() if k in fields}
-        if 'ticketing_url' not in params:
-            params['ticketing_url'] = settings.FRONTEND_URL
-
-        application = db.get(Application, row['id'])
-
+    background_tasks.add_task(
+        send_application_emails,
+        webhook_payload.data.rows,
+        event=event,
+        fields=fields,
+        unique=unique,
+        send_at=send_at,
+    )
+    return {'message': 'Emails scheduled'}
+
+
+@lru_cache(maxsize=64)
+def _parse_fields(fields: str) -> Tuple[str, ...]:
+    # Returned as a tuple so the cached value cannot be mutated by callers
+    return tuple(f.strip() for f in fields.split(','))
+
+
+def send_application_emails(
+    rows: List[schemas.WebhookRow],
+    *,
+    event: str,
+    fields: Tuple[str, ...],
+    unique: bool,
+    send_at: Optional[datetime],
+) -> None:
+    with SessionLocal() as db:
+        applications = _load_applications(db, rows)
+        already_sent = set()
         if unique:
-            exists_email_log = (
-                db.query(EmailLog)
-                .filter(
-                    EmailLog.entity_id == application.id,
-                    EmailLog.entity_type == 'application',
-                    EmailLog.event == event,
-                    EmailLog.status == EmailStatus.SUCCESS,
+            already_sent = set(
+                db.scalars(
+                    select(EmailLog.entity_id).where(
+                        EmailLog.entity_id.in_(list(applications)),
+                        EmailLog.entity_type == 'application',
+                        EmailLog.event == event,
+                        EmailLog.status == EmailStatus.SUCCESS,
+                    )
                 )
-                .first()
             )
-            if exists_email_log:
+
+        # Messages are collected and sent to Postmark in a single batch request
+        emails = []
+        for row in rows:
+            if not row.get('email'):
+                logger.info('No email to send email. Skipping...')
+                continue
+
+            application = applications.get(int(row['id']))
+            if not application:
+                logger.error('Application %s not found. Skipping...', row['id'])
+                continue
+
+            if application.id in already_sent:
                 logger.info('Email already sent')
                 continue
 
+            try:
+                emails.extend(
+                    _application_emails(db, application, row, event, fields, send_at)
+                )
+            except Exception as e:
+                db.rollback()
+                logger.error(
+                    'Failed to prepare %s email for row %s: %s', event, row['id'], e
+                )
+                continue
+            if unique:
+                already_sent.add(application.id)
+
+        if not emails:
+            return
+
         if send_at:
-            # Cancel any existing scheduled emails since only one can be active per application
+            # Only one scheduled email can be active per application
             logger.info('Cancelling scheduled emails')
-            email_log.cancel_scheduled_emails(
+            email_log.cancel_scheduled_emails_bulk(
                 db,
                 entity_type='application',
-                entity_id=application.id,
+                entity_ids=list({email['entity_id'] for email in emails}),
             )
+        email_log.send_mail_batch(db, emails, send_at=send_at)
 
-        params['ticketing_url'] = email_log.generate_authenticate_url(db, application)
-        params['first_name'] = application.first_name
-        email_log.send_mail(
-            receiver_mail=row['email'],
-            event=event,
-            popup_city=application.popup_city,
-            params=params,
-            send_at=send_at,
-            entity_type='application',
-            entity_id=application.id,
-        )
-
-        processed_ids.append(row['id'])
-
-        is_approved_event = event in [
-            EmailEvent.APPLICATION_APPROVED.value,
-            EmailEvent.APPLICATION_APPROVED_SCHOLARSHIP.value,
-            EmailEvent.APPLICATION_APPROVED_NON_SCHOLARSHIP.value,
-        ]
-        is_patagonia = application.popup_city.slug == 'edge-patagonia'
-
-        if is_approved_event and is_patagonia and application.brings_kids:
-            email_log.send_mail(
-                receiver_mail=row['email'],
-                event=EmailEvent.WELCOME_FAMILIES.value,
-                popup_city=application.popup_city,
-                params=params,
-                send_at=send_at,
-                entity_type='application',
-                entity_id=application.id,
-            )
 
-    return {'message': 'Email sent successfully'}
+def _application_emails(
+    db: Session,
+    application: Application,
+    row: schemas.WebhookRow,
+    event: str,
+    fields: Tuple[str, ...],
+    send_at: Optional[datetime],
+) -> List[dict]:
+    params = {k: row.get(k) for k in fields if k in row}
+    if 'ticketing_url' not in params:
+        params['ticketing_url'] = settings.FRONTEND_URL
+
+    params['ticketing_url'] = email_log.generate_authenticate_url(db, application)
+    params['first_name'] = application.first_name
+    email = {
+        'receiver_mail': row.get('email'),
+        'event': event,
+        'popup_city': application.popup_city,
+        'params': params,
+        'entity_type': 'application',
+        'entity_id': application.id,
+    }
+    emails = [email]
+
+    is_approved_event = event in APPROVED_EMAIL_EVENTS
+    is_patagonia = application.popup_city.slug == 'edge-patagonia'
+
+    if is_approved_event and is_patagonia and application.brings_kids:
+        emails.append(
+            {
+                **email,
+                'event': EmailEvent.WELCOME_FAMILIES.value,
+                'params': dict(params),
+            }
+        )
+    return emails
 
 
 @router.post('/simplefi', status_code=status.HTTP_200_OK)
 async def simplefi_webhook(
     request: Request,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_webhook_db),
     webhook_cache: WebhookCache = Depends(get_webhook_cache),
 ):
-    raw_body = await request.json()
-    event_type = raw_body.get('event_type')
+    try:
+        webhook_payload = schemas.simplefi_event_adapter.validate_json(
+            await request.body()
+        )
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+    event_type = webhook_payload.event_type
     logger.info('POST /simplefi webhook received, event_type: %s', event_type)
 
-    if event_type == 'installment_plan_completed':
-        return await _handle_installment_plan_completed(raw_body, db, webhook_cache)
+    if isinstance(webhook_payload, schemas.UnhandledSimplefiEvent):
+        logger.info('Unhandled event type: %s. Ignoring.', event_type)
+        return {'message': f'Event type {event_type} not handled'}
 
-    if event_type == 'installment_plan_activated':
-        return await _handle_installment_plan_activated(raw_body, db, webhook_cache)
+    fingerprint = _simplefi_fingerprint(webhook_payload)
+    if not webhook_cache.add(fingerprint):
+        logger.info('Webhook already processed. Skipping...')
+        return {'message': 'Webhook already processed'}
 
-    if event_type == 'installment_plan_cancelled':
-        return await _handle_installment_plan_cancelled(raw_body, db, webhook_cache)
+    # Payment is optimistically locked through its version column. A delivery
+    # that loses a race with another worker is rolled back and handled again
+    # against the committed row.
+    for attempt in range(1, SIMPLEFI_STALE_PAYMENT_ATTEMPTS + 1):
+        try:
+            if not _claim_webhook(db, fingerprint):
+                logger.info('Webhook already processed by another worker. Skipping...')
+                return {'message': 'Webhook already processed'}
+            response = await _dispatch_simplefi_event(
+                webhook_payload, db, background_tasks
+            )
+            # Handlers that find nothing to change return without committing;
+            # commit the claim for those deliveries too
+            if db.in_transaction():
+                db.commit()
+            return response
+        except StaleDataError:
+            db.rollback()
+            logger.warning(
+                'Payment changed concurrently while handling %s (attempt %s)',
+                fingerprint,
+                attempt,
+            )
+
+    # Let SimpleFi redeliver the webhook instead of reporting it as processed
+    webhook_cache.discard(fingerprint)
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail='Payment was updated concurrently',
+    )
 
-    if event_type not in ('new_payment', 'new_card_payment'):
-        logger.info('Unhandled event type: %s. Ignoring.', event_type)
-        return {'message': f'Event type {event_type} not handled'}
 
-    # Handle payment-related events (new_payment, new_card_payment)
-    webhook_payload = schemas.SimplefiWebhookPayload(**raw_body)
+def _claim_webhook(db: Session, fingerprint: str) -> bool:
+    """Record the webhook as processed in the handler's transaction.
+
+    WebhookCache only dedupes within one process. The row makes the claim
+    visible to every worker once the handler commits, and a handler that fails
+    rolls it back so SimpleFi's redelivery is processed. A concurrent insert of
+    the same fingerprint waits for that outcome instead of racing it.
+    """
+    db.add(ProcessedWebhook(fingerprint=fingerprint))
+    try:
+        db.flush()
+    except IntegrityError:
+        # The claim is the first write of the transaction, so nothing else is lost
+        db.rollback()
+        return False
+    return True
+
+
+def _simplefi_fingerprint(webhook_payload: SimplefiHandledEvent) -> str:
+    """Key a delivery on its SimpleFi event id.
+
+    Several events can arrive for the same payment request, e.g. a pending
+    new_payment and then the approving one, so the payment request alone
+    would skip real changes. Only installment plan events may lack an id.
+    """
+    if webhook_payload.id is not None:
+        return f'simplefi:{webhook_payload.id}'
+    event_type = webhook_payload.event_type
+    return f'simplefi:installment:{webhook_payload.entity_id}:{event_type}'
+
 
-    # Check if this is an installment payment
-    installment_plan_id = webhook_payload.data.payment_request.installment_plan_id
-    if installment_plan_id:
-        return await _handle_installment_payment(webhook_payload, db, webhook_cache)
+async def _dispatch_simplefi_event(
+    webhook_payload: SimplefiHandledEvent,
+    db: Session,
+    background_tasks: BackgroundTasks,
+):
+    # The event adapter only lets handled event types through
+    handler = SIMPLEFI_HANDLERS[webhook_payload.event_type]
+    return await handler(webhook_payload, db, background_tasks)
 
-    # Otherwise continue with regular payment flow
-    return await _handle_regular_payment(webhook_payload, db, webhook_cache)
+
+async def _handle_payment(
+    webhook_payload: schemas.SimplefiWebhookPayload,
+    db: Session,
+    background_tasks: Optional[BackgroundTasks] = None,
+):
+    """Handle new_payment/new_card_payment, for installments or a one-off payment."""
+    if webhook_payload.data.payment_request.installment_plan_id:
+        return await _handle_installment_payment(webhook_payload, db, background_tasks)
+    return await _handle_regular_payment(webhook_payload, db, background_tasks)
 
 
 async def _handle_regular_payment(
     webhook_payload: schemas.SimplefiWebhookPayload,
     db: Session,
-    webhook_cache: WebhookCache,
+    background_tasks: Optional[BackgroundTasks] = None,
 ):
     """Handle new_payment/new_card_payment for regular (non-installment) payments."""
     event_type = webhook_payload.event_type
     payment_request_id = webhook_payload.data.payment_request.id
 
-    fingerprint = f'simplefi:{payment_request_id}:{event_type}'
-    if not webhook_cache.add(fingerprint):
-        logger.info('Webhook already processed. Skipping...')
-        return {'message': 'Webhook already processed'}
-
     logger.info(
         'Payment request id: %s, event type: %s', payment_request_id, event_type
     )
 
-    payments = payment_crud.find(
-        db, filters=PaymentFilter(external_id=payment_request_id)
-    )
-    if not payments:
+    payment = payment_crud.get_by_external_id(db, payment_request_id)
+    if not payment:
         logger.info('Payment not found')
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Payment not found',
         )
 
-    payment = payments[0]
     payment_request_status = webhook_payload.data.payment_request.status
 
     if payment.status == payment_request_status:
@@ -289,14 +494,19 @@ async def _handle_regular_payment(
                 rate = t.price_details.rate
                 break
 
-    user = TokenData(citizen_id=payment.application.citizen_id, email='')
-
     if payment_request_status == 'approved':
         payment_crud.approve_payment(
-            db, payment, currency=currency, rate=rate, user=user
+            db,
+            payment,
+            currency=currency,
+            rate=rate,
+            background_tasks=background_tasks,
         )
     else:
-        payment_crud.update(db, payment.id, PaymentUpdate(status='expired'), user)
+        # The payment is already loaded, so set the status directly instead of
+        # going through update(), which re-fetches it with an ownership check
+        payment.status = 'expired'
+        db.commit()
 
     return {'message': 'Payment status updated successfully'}
 
@@ -304,7 +514,7 @@ async def _handle_regular_payment(
 async def _handle_installment_payment(
     webhook_payload: schemas.SimplefiWebhookPayload,
     db: Session,
-    webhook_cache: WebhookCache,
+    background_tasks: Optional[BackgroundTasks] = None,
 ):
     """Handle new_payment/new_card_payment for installment plans."""
     payment_request = webhook_payload.data.payment_request
@@ -312,12 +522,6 @@ async def _handle_installment_payment(
     new_payment = webhook_payload.data.new_payment
     payment_request_id = payment_request.id  # Unique per installment
 
-    # Idempotency: use payment_request.id (unique per installment)
-    fingerprint = f'simplefi:installment:{installment_plan_id}:{payment_request_id}'
-    if not webhook_cache.add(fingerprint):
-        logger.info('Webhook already processed. Skipping...')
-        return {'message': 'Webhook already processed'}
-
     logger.info(
         'Installment payment: plan_id=%s, payment_request_id=%s',
         installment_plan_id,
@@ -325,18 +529,14 @@ async def _handle_installment_payment(
     )
 
     # Look up Payment by installment_plan_id (stored in external_id)
-    payments = payment_crud.find(
-        db, filters=PaymentFilter(external_id=installment_plan_id)
-    )
-    if not payments:
+    payment = payment_crud.get_by_external_id(db, installment_plan_id)
+    if not payment:
         logger.info('Payment not found for installment plan %s', installment_plan_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Payment not found',
         )
 
-    payment = payments[0]
-
     # Extract payment details
     if isinstance(new_payment, schemas.PaymentInfo):
         amount = new_payment.amount
@@ -347,8 +547,9 @@ async def _handle_installment_payment(
         currency = new_payment.coin if new_payment else 'USD'
         paid_at = current_time()
 
-    # Create PaymentInstallment record
-    installment_number = len(payment.installments) + 1
+    # Create PaymentInstallment record. installments_paid counts the recorded
+    # installments, so there is no need to load them all to number this one.
+    installment_number = payment_crud.record_installment(db, payment)
     installment = PaymentInstallment(
         payment_id=payment.id,
         external_payment_id=payment_request_id,
@@ -360,15 +561,20 @@ async def _handle_installment_payment(
     db.add(installment)
 
     # Check if this is the first installment - approve payment to assign products
-    is_first_installment = (payment.installments_paid or 0) == 0
+    is_first_installment = installment_number == 1
+
     if is_first_installment and payment.status != 'approved':
-        user = TokenData(citizen_id=payment.application.citizen_id, email='')
-        payment_crud.approve_payment(db, payment, currency=currency, rate=1, user=user)
+        # Commits the installment record and count together with the approval
+        payment_crud.approve_payment(
+            db,
+            payment,
+            currency=currency,
+            rate=1,
+            background_tasks=background_tasks,
+        )
         logger.info('First installment received - payment %s approved', payment.id)
-
-    # Increment installments_paid
-    payment.installments_paid = (payment.installments_paid or 0) + 1
-    db.commit()
+    else:
+        db.commit()
 
     logger.info(
         'Installment %s recorded for payment %s (paid: %s/%s)',
@@ -382,33 +588,25 @@ async def _handle_installment_payment(
 
 
 async def _handle_installment_plan_completed(
-    raw_body: dict,
+    webhook_payload: schemas.InstallmentPlanCompletedPayload,
     db: Session,
-    webhook_cache: WebhookCache,
+    background_tasks: Optional[BackgroundTasks] = None,
 ):
     """Handle the installment_plan_completed webhook event."""
-    webhook_payload = schemas.InstallmentPlanCompletedPayload(**raw_body)
     entity_id = webhook_payload.entity_id
     event_type = webhook_payload.event_type
 
-    fingerprint = f'simplefi:installment:{entity_id}:{event_type}'
-    if not webhook_cache.add(fingerprint):
-        logger.info('Webhook already processed. Skipping...')
-        return {'message': 'Webhook already processed'}
-
     logger.info('Installment plan id: %s, event type: %s', entity_id, event_type)
 
     # Find payment by external_id matching the installment plan ID
-    payments = payment_crud.find(db, filters=PaymentFilter(external_id=entity_id))
-    if not payments:
+    payment = payment_crud.get_by_external_id(db, entity_id)
+    if not payment:
         logger.info('Payment not found for installment plan %s', entity_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Payment not found',
         )
 
-    payment = payments[0]
-
     # Log warning if payment is not marked as an installment plan
     if not payment.is_installment_plan:
         logger.warning(
@@ -425,8 +623,8 @@ async def _handle_installment_plan_completed(
         installment_plan = webhook_payload.data.installment_plan
         payment.installments_paid = installment_plan.paid_installments_count
         group = payment_crud._create_ambassador_group(db, payment)
-        payment_crud._send_payment_confirmed_email(payment, group)
         db.commit()
+        payment_crud._queue_payment_confirmed_email(payment, group, background_tasks)
         return {'message': 'Installment plan completed - count synced'}
 
     # Edge case: plan completed but payment not approved (shouldn't happen normally)
@@ -437,41 +635,38 @@ async def _handle_installment_plan_completed(
     installment_plan = webhook_payload.data.installment_plan
     payment.installments_paid = installment_plan.paid_installments_count
 
-    user = TokenData(citizen_id=payment.application.citizen_id, email='')
-    payment_crud.approve_payment(db, payment, currency='USD', rate=1, user=user)
+    payment_crud.approve_payment(
+        db,
+        payment,
+        currency='USD',
+        rate=1,
+        background_tasks=background_tasks,
+    )
     group = payment_crud._create_ambassador_group(db, payment)
-    payment_crud._send_payment_confirmed_email(payment, group)
+    payment_crud._queue_payment_confirmed_email(payment, group, background_tasks)
 
     return {'message': 'Installment plan payment approved successfully'}
 
 
 async def _handle_installment_plan_activated(
-    raw_body: dict,
+    webhook_payload: schemas.InstallmentPlanActivatedPayload,
     db: Session,
-    webhook_cache: WebhookCache,
+    background_tasks: Optional[BackgroundTasks] = None,
 ):
     """Handle the installment_plan_activated webhook event."""
-    webhook_payload = schemas.InstallmentPlanActivatedPayload(**raw_body)
     entity_id = webhook_payload.entity_id
-    event_type = webhook_payload.event_type
-
-    fingerprint = f'simplefi:installment:{entity_id}:{event_type}'
-    if not webhook_cache.add(fingerprint):
-        logger.info('Webhook already processed. Skipping...')
-        return {'message': 'Webhook already processed'}
 
     logger.info('Installment plan activated: %s', entity_id)
 
     # Find payment by external_id matching the installment plan ID
-    payments = payment_crud.find(db, filters=PaymentFilter(external_id=entity_id))
-    if not payments:
+    payment = payment_crud.get_by_external_id(db, entity_id)
+    if not payment:
         logger.info('Payment not found for installment plan %s', entity_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Payment not found',
         )
 
-    payment = payments[0]
     installment_plan = webhook_payload.data.installment_plan
 
     # Update installments_total with actual number chosen by user
@@ -488,33 +683,24 @@ async def _handle_installment_plan_activated(
 
 
 async def _handle_installment_plan_cancelled(
-    raw_body: dict,
+    webhook_payload: schemas.InstallmentPlanCancelledPayload,
     db: Session,
-    webhook_cache: WebhookCache,
+    background_tasks: Optional[BackgroundTasks] = None,
 ):
     """Handle the installment_plan_cancelled webhook event."""
-    webhook_payload = schemas.InstallmentPlanCancelledPayload(**raw_body)
     entity_id = webhook_payload.entity_id
-    event_type = webhook_payload.event_type
-
-    fingerprint = f'simplefi:installment:{entity_id}:{event_type}'
-    if not webhook_cache.add(fingerprint):
-        logger.info('Webhook already processed. Skipping...')
-        return {'message': 'Webhook already processed'}
 
     logger.info('Installment plan cancelled: %s', entity_id)
 
     # Find payment by external_id matching the installment plan ID
-    payments = payment_crud.find(db, filters=PaymentFilter(external_id=entity_id))
-    if not payments:
+    payment = payment_crud.get_by_external_id(db, entity_id)
+    if not payment:
         logger.info('Payment not found for installment plan %s', entity_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Payment not found',
         )
 
-    payment = payments[0]
-
     # Idempotent: skip if already cancelled
     if payment.status == 'cancelled':
         logger.info('Payment %s already cancelled. Skipping...', payment.id)
@@ -532,3 +718,12 @@ async def _handle_installment_plan_cancelled(
 
     logger.info('Payment %s cancelled', payment.id)
     return {'message': 'Installment plan cancelled successfully'}
+
+
+SIMPLEFI_HANDLERS = {
+    'new_payment': _handle_payment,
+    'new_card_payment': _handle_payment,
+    'installment_plan_completed': _handle_installment_plan_completed,
+    'installment_plan_activated': _handle_installment_plan_activated,
+    'installment_plan_cancelled': _handle_installment_plan_cancelled,
+}
@@ -1,13 +1,22 @@
 from datetime import datetime
-from typing import List, Optional, Union
-
-from pydantic import BaseModel, ConfigDict
-
-
-class WebhookRow(BaseModel):
+from typing import Annotated, Any, List, Optional, Union
+
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Discriminator,
+    Tag,
+    TypeAdapter,
+    with_config,
+)
+from typing_extensions import TypedDict
+
+
+# A TypedDict rather than a model: rows are read like plain dicts and only `id`
+# needs validating, so the extra columns are kept as-is without building a model
+@with_config(ConfigDict(extra='allow'))
+class WebhookRow(TypedDict):
     id: Union[int, str]
-    # Using a dynamic dict to accept any key-value pairs
-    model_config = ConfigDict(extra='allow')
 
 
 class WebhookData(BaseModel):
@@ -116,3 +125,42 @@ InstallmentPlanActivatedPayload = InstallmentPlanCompletedPayload
 
 # Reuse same structure for cancelled webhook
 InstallmentPlanCancelledPayload = InstallmentPlanCompletedPayload
+
+
+class UnhandledSimplefiEvent(BaseModel):
+    event_type: Optional[str] = None
+    model_config = ConfigDict(extra='allow')
+
+
+SIMPLEFI_PAYMENT_EVENTS = ('new_payment', 'new_card_payment')
+SIMPLEFI_INSTALLMENT_PLAN_EVENTS = (
+    'installment_plan_completed',
+    'installment_plan_activated',
+    'installment_plan_cancelled',
+)
+
+
+def _simplefi_event_tag(value: Any) -> str:
+    event_type = (
+        value.get('event_type')
+        if isinstance(value, dict)
+        else getattr(value, 'event_type', None)
+    )
+    if event_type in SIMPLEFI_PAYMENT_EVENTS:
+        return 'payment'
+    if event_type in SIMPLEFI_INSTALLMENT_PLAN_EVENTS:
+        return 'installment_plan'
+    return 'unhandled'
+
+
+SimplefiEvent = Annotated[
+    Union[
+        Annotated[SimplefiWebhookPayload, Tag('payment')],
+        Annotated[InstallmentPlanCompletedPayload, Tag('installment_plan')],
+        Annotated[UnhandledSimplefiEvent, Tag('unhandled')],
+    ],
+    Discriminator(_simplefi_event_tag),
+]
+
+# Validates raw request bytes in a single pass, dispatching on event_type
+simplefi_event_adapter = TypeAdapter(SimplefiEvent)
@@ -1,13 +1,21 @@
+import hashlib
 from datetime import datetime, timedelta
 from threading import Lock
-from typing import Dict, Tuple
+from typing import Any, Dict, Hashable, Optional, Tuple
 
 from app.core.utils import current_time
 
 
+def _fingerprint_key(fingerprint: str) -> int:
+    """Hash a fingerprint to a 64-bit int so entries don't keep the full string."""
+    digest = hashlib.blake2b(fingerprint.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
 class WebhookCache:
     def __init__(self, expiry: timedelta = timedelta(hours=24)):
-        self._cache: Dict[str, Tuple[datetime, str]] = {}
+        # Fingerprints are only ever inserted, so dict order is insertion time
+        self._cache: Dict[int, datetime] = {}
         self._expiry = expiry
         self._lock = Lock()
 
@@ -15,26 +23,85 @@ class WebhookCache:
         """Check if fingerprint exists and is not expired in a thread-safe manner"""
         with self._lock:
             self._clean_expired()
-            return fingerprint in self._cache
+            return _fingerprint_key(fingerprint) in self._cache
 
     def add(self, fingerprint: str) -> bool:
         """
         Add fingerprint to cache if it doesn't exist.
         Returns True if fingerprint was added, False if it already existed.
         """
+        key = _fingerprint_key(fingerprint)
         with self._lock:
             self._clean_expired()
-            if fingerprint in self._cache:
+            if key in self._cache:
                 return False
-            self._cache[fingerprint] = current_time()
+            self._cache[key] = current_time()
             return True
 
+    def discard(self, fingerprint: str) -> None:
+        """Forget a fingerprint so a redelivery of the webhook is processed again"""
+        with self._lock:
+            self._cache.pop(_fingerprint_key(fingerprint), None)
+
+    def _clean_expired(self) -> None:
+        """Remove expired fingerprints - already protected by lock in public methods
+
+        Entries are stored oldest first, so the sweep stops at the first live one
+        instead of scanning the whole cache on every webhook.
+        """
+        cutoff = current_time() - self._expiry
+        while self._cache:
+            oldest = next(iter(self._cache))
+            if self._cache[oldest] >= cutoff:
+                break
+            del self._cache[oldest]
+
+
+class TTLCache:
+    """Small thread-safe in-process cache whose entries expire after `expiry`."""
+
+    def __init__(self, expiry: timedelta, maxsize: int = 1024):
+        self._cache: Dict[Hashable, Tuple[datetime, Any]] = {}
+        self._expiry = expiry
+        self._maxsize = maxsize
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired"""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            timestamp, value = entry
+            if current_time() - timestamp > self._expiry:
+                del self._cache[key]
+                return None
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            if key not in self._cache and len(self._cache) >= self._maxsize:
+                self._clean_expired()
+                if len(self._cache) >= self._maxsize:
+                    # Evict the oldest entry (dicts keep insertion order)
+                    del self._cache[next(iter(self._cache))]
+            self._cache[key] = (current_time(), value)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
     def _clean_expired(self) -> None:
-        """Remove expired fingerprints - already protected by lock in public methods"""
+        """Remove expired entries - already protected by lock in public methods"""
+        now = current_time()
         expired = [
             k
-            for k, timestamp in self._cache.items()
-            if current_time() - timestamp > self._expiry
+            for k, (timestamp, _) in self._cache.items()
+            if now - timestamp > self._expiry
         ]
         for key in expired:
             del self._cache[key]
@@ -20,6 +20,14 @@ class Settings:
     DB_PORT: str = os.getenv('DB_PORT')
     DB_NAME: str = os.getenv('DB_NAME')
 
+    # Connection pool sizing is per worker process
+    DB_POOL_SIZE: int = int(os.getenv('DB_POOL_SIZE', '20'))
+    DB_MAX_OVERFLOW: int = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+    DB_POOL_TIMEOUT: int = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+    DB_POOL_RECYCLE: int = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+    # Set when connecting through PgBouncer in transaction pooling mode
+    DB_DISABLE_POOLING: bool = os.getenv('DB_DISABLE_POOLING', '').lower() == 'true'
+
     SQLALCHEMY_TEST_DATABASE_URL = 'sqlite:///:memory:'
     DATABASE_URL: str = (
         f'postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
@@ -1,5 +1,6 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import NullPool
 from sqlalchemy_utils import create_database, database_exists
 
 from .config import settings
@@ -8,12 +9,17 @@ from .logger import logger
 Base = declarative_base()
 
 _engine_kwargs = {}
-if not settings.DATABASE_URL.startswith('sqlite'):
+if settings.DATABASE_URL.startswith('sqlite'):
+    pass
+elif settings.DB_DISABLE_POOLING:
+    # PgBouncer already pools server connections
+    _engine_kwargs.update(poolclass=NullPool)
+else:
     _engine_kwargs.update(
-        pool_size=10,
-        max_overflow=20,
-        pool_timeout=30,
-        pool_recycle=3600,  # Recycle connections every hour
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
         pool_pre_ping=True,  # Validate connections before use
     )
 
@@ -0,0 +1,8 @@
+import httpx
+
+# Shared across requests so calls to NocoDB and Postmark reuse keep-alive
+# connections instead of opening a new TCP/TLS session each time.
+http_client = httpx.Client(
+    timeout=httpx.Timeout(10.0),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+)
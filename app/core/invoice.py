@@ -1,6 +1,6 @@
 import base64
 import io
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Optional
 from urllib.parse import urlparse
 from urllib.request import urlopen
@@ -22,6 +22,10 @@ from reportlab.platypus import (
 from xml.sax.saxutils import escape
 
 from app.api.payments import models
+from app.core.cache import TTLCache
+
+# Popup header images rarely change and are shared by every invoice of a popup
+_header_image_cache = TTLCache(expiry=timedelta(hours=1), maxsize=32)
 
 
 # ---- Helpers ----
@@ -87,12 +91,31 @@ class CroppedImageFitWidth(Flowable):
         canvas.restoreState()
 
 
+def _load_header_image(url: str) -> bytes:
+    if (image_bytes := _header_image_cache.get(url)) is None:
+        with urlopen(url) as resp:  # nosec - trusted configured input
+            image_bytes = resp.read()
+        _header_image_cache.set(url, image_bytes)
+    return image_bytes
+
+
 def generate_invoice_pdf(
     payment: models.Payment,
     client_name: str,
     discount: Optional[float] = None,  # percent (e.g., 10 for 10%)
     header_image: Optional[str] = None,  # URL or local path to header image
 ) -> str:
+    """Return the invoice PDF base64-encoded, as mail attachments expect it."""
+    pdf_bytes = _build_invoice_pdf(payment, client_name, discount, header_image)
+    return base64.b64encode(pdf_bytes).decode('ascii')
+
+
+def _build_invoice_pdf(
+    payment: models.Payment,
+    client_name: str,
+    discount: Optional[float] = None,
+    header_image: Optional[str] = None,
+) -> bytes:
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(
         buffer,
@@ -128,9 +151,7 @@ def generate_invoice_pdf(
         try:
             parsed = urlparse(header_image)
             if parsed.scheme in ('http', 'https'):
-                with urlopen(header_image) as resp:  # nosec - trusted configured input
-                    image_bytes = resp.read()
-                source = io.BytesIO(image_bytes)
+                source = io.BytesIO(_load_header_image(header_image))
             else:
                 source = header_image
 
@@ -340,5 +361,4 @@ def generate_invoice_pdf(
     # Build the document
     doc.build(flow)
 
-    pdf_bytes = buffer.getvalue()
-    return base64.b64encode(pdf_bytes).decode('ascii')
+    return buffer.getvalue()
@@ -1,5 +1,7 @@
 import logging
 import sys
+import time
+from contextlib import contextmanager
 
 logger = logging.getLogger('main-logger')
 logger.setLevel(logging.DEBUG)
@@ -15,3 +17,18 @@ def log_request_body(request_id, body):
 
 def log_error(msg):
     logger.error(msg)
+
+
+@contextmanager
+def log_duration(stage: str):
+    """Log how long the wrapped block or function took, tagged with `stage`.
+
+    Works both as `with log_duration(...)` and as a decorator.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        logger.info(
+            'Stage %s took %.1f ms', stage, (time.perf_counter() - start) * 1000
+        )
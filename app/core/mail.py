@@ -1,11 +1,22 @@
-import requests
-
 from app.api.email_logs.schemas import EmailAttachment, EmailStatus
 from app.core.config import Environment, settings
+from app.core.http import http_client
 from app.core.logger import logger
 
+POSTMARK_URL = 'https://api.postmarkapp.com'
+# Postmark rejects batch requests with more messages than this
+POSTMARK_BATCH_LIMIT = 500
 
-def send_mail(
+
+def _postmark_headers() -> dict:
+    return {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'X-Postmark-Server-Token': settings.POSTMARK_API_TOKEN,
+    }
+
+
+def build_message(
     receiver_mail: str,
     *,
     template: str,
@@ -14,19 +25,13 @@ def send_mail(
     from_address: str = None,
     from_name: str = None,
     reply_to: str = None,
-):
+) -> dict:
     # Use provided values or fall back to global settings
     from_addr = from_address or settings.EMAIL_FROM_ADDRESS
     from_nm = from_name or settings.EMAIL_FROM_NAME
     reply = reply_to if reply_to is not None else settings.EMAIL_REPLY_TO
 
     logger.info('sending %s email to %s from %s', template, receiver_mail, from_addr)
-    url = 'https://api.postmarkapp.com/email/withTemplate'
-    headers = {
-        'Accept': 'application/json',
-        'Content-Type': 'application/json',
-        'X-Postmark-Server-Token': settings.POSTMARK_API_TOKEN,
-    }
     data = {
         'From': f'{from_nm} <{from_addr}>',
         'To': receiver_mail,
@@ -39,10 +44,73 @@ def send_mail(
     if attachments:
         data['Attachments'] = [a.model_dump(by_alias=True) for a in attachments]
 
+    return data
+
+
+def send_mail(
+    receiver_mail: str,
+    *,
+    template: str,
+    params: dict,
+    attachments: list[EmailAttachment] = None,
+    from_address: str = None,
+    from_name: str = None,
+    reply_to: str = None,
+):
+    data = build_message(
+        receiver_mail,
+        template=template,
+        params=params,
+        attachments=attachments,
+        from_address=from_address,
+        from_name=from_name,
+        reply_to=reply_to,
+    )
+
     if settings.ENVIRONMENT == Environment.TEST:
         return {'status': EmailStatus.SUCCESS}
 
-    response = requests.post(url, json=data, headers=headers)
+    response = http_client.post(
+        f'{POSTMARK_URL}/email/withTemplate', json=data, headers=_postmark_headers()
+    )
     response.raise_for_status()
 
     return {'status': EmailStatus.SUCCESS, 'response': response.json()}
+
+
+def send_batch(messages: list[dict]) -> list[dict]:
+    """Send messages built with build_message through Postmark's batch endpoint.
+
+    Returns one result per message, in order. Postmark accepts a batch as a
+    whole and reports failures per message, so one bad address does not fail
+    the others. A request that fails only fails the messages of its own chunk,
+    since earlier chunks have already been delivered.
+    """
+    if settings.ENVIRONMENT == Environment.TEST:
+        return [{'status': EmailStatus.SUCCESS} for _ in messages]
+
+    results = []
+    for start in range(0, len(messages), POSTMARK_BATCH_LIMIT):
+        chunk = messages[start : start + POSTMARK_BATCH_LIMIT]
+        try:
+            response = http_client.post(
+                f'{POSTMARK_URL}/email/batchWithTemplates',
+                json={'Messages': chunk},
+                headers=_postmark_headers(),
+            )
+            response.raise_for_status()
+            items = response.json()
+        except Exception as e:
+            logger.error('Failed to send email batch: %s', str(e))
+            results.extend(
+                {'status': EmailStatus.FAILED, 'error': str(e)} for _ in chunk
+            )
+            continue
+        for item in items:
+            if item.get('ErrorCode'):
+                results.append(
+                    {'status': EmailStatus.FAILED, 'error': item.get('Message')}
+                )
+            else:
+                results.append({'status': EmailStatus.SUCCESS, 'response': item})
+    return results
@@ -13,6 +13,7 @@ from app.api.product_segments.models import (
     ProductSegmentProduct,
 )
 from app.api.products.models import Product
+from app.api.webhooks.models import ProcessedWebhook
 
 # Re-export all models
 __all__ = [
@@ -26,6 +27,7 @@ __all__ = [
     'PaymentInstallment',
     'PaymentProduct',
     'PopUpCity',
+    'ProcessedWebhook',
     'Product',
     'ApplicationProductSegment',
     'ProductSegment',
@@ -0,0 +1,14 @@
+from functools import lru_cache
+
+from app.core.config import settings
+
+NOCODB_HEADERS = {
+    'accept': 'application/json',
+    'xc-token': settings.NOCODB_TOKEN,
+    'Content-Type': 'application/json',
+}
+
+
+@lru_cache(maxsize=32)
+def records_url(table_id: str) -> str:
+    return f'{settings.NOCODB_URL}/api/v2/tables/{table_id}/records'
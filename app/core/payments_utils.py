@@ -1,12 +1,14 @@
-from datetime import datetime
-from typing import List, Optional, Tuple
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import exists, select
+from sqlalchemy.orm import Session, selectinload
 
 from app.api.applications.crud import application as application_crud
 from app.api.applications.models import Application
 from app.api.applications.schemas import ApplicationStatus
+from app.api.attendees.models import Attendee, AttendeeProduct
 from app.api.coupon_codes.crud import coupon_code as coupon_code_crud
 from app.api.payments import schemas
 from app.api.payments.schemas import PaymentPreview
@@ -14,59 +16,125 @@ from app.api.products.crud import product as product_crud
 from app.api.products.models import Product
 from app.api.products.schemas import ProductFilter
 from app.core import simplefi
+from app.core.cache import TTLCache
 from app.core.config import settings
-from app.core.logger import logger
+from app.core.logger import log_duration, logger
 from app.core.security import TokenData
 
+# Editing passes credits every attendee's current products; load them with the
+# application instead of lazily per attendee. group and popup_city are already
+# joined by the model.
+APPLICATION_PRODUCTS_OPTIONS = (
+    selectinload(Application.attendees)
+    .selectinload(Attendee.attendee_products)
+    .joinedload(AttendeeProduct.product),
+)
 
-def _get_discounted_price(price: float, discount_value: float) -> float:
-    return round(price * (1 - discount_value / 100), 2)
 
+# Segment membership is managed outside the API and changes rarely, but is
+# checked on every preview of a segmented application. Products themselves are
+# not cached: price, is_active and current_sold must be read fresh.
+# Edits to product_segment_products made directly in the database reach
+# purchases once the entry expires, up to a minute later in each worker.
+_segment_products_cache = TTLCache(expiry=timedelta(minutes=1), maxsize=256)
 
-def _get_credit(application: Application, discount_value: float) -> float:
-    total = 0.0
+
+def clear_segment_cache() -> None:
+    """Forget cached segment products, e.g. after editing segment membership."""
+    _segment_products_cache.clear()
+
+
+def _to_cents(amount: float) -> int:
+    return round(float(amount) * 100)
+
+
+def _get_discounted_cents(cents: int, discount_value: float) -> int:
+    """Apply a percentage discount in whole cents, rounding half up."""
+    basis_points = round(discount_value * 100)
+    return (cents * (10000 - basis_points) + 5000) // 10000
+
+
+def _get_attendees_subtotal(application: Application) -> int:
+    """Total in cents of the products already assigned to the attendees.
+
+    Attendees holding a patreon product are excluded. The result does not depend
+    on the discount, so callers compute it once and reuse it for every candidate.
+    """
+    total = 0
     for a in application.attendees:
         patreon = False
-        subtotal = 0.0
+        subtotal = 0
         for p in a.attendee_products:
             if p.product.category == 'patreon':
                 patreon = True
-                subtotal = 0.0
+                subtotal = 0
             elif not patreon:
-                subtotal += float(p.product.price) * int(p.quantity)  # ty: ignore[invalid-argument-type]
+                subtotal += _to_cents(p.product.price) * int(p.quantity)  # ty: ignore[invalid-argument-type]
         if not patreon:
             total += subtotal
 
-    return _get_discounted_price(total, discount_value) + float(application.credit)  # ty: ignore[invalid-argument-type]
+    return total
 
 
-def _classify_products(
-    requested_products: List[schemas.PaymentProduct],
-    valid_products: List[Product],
-    already_patreon: bool,
-    applies_to: Optional[str] = None,
-) -> Tuple[List[float], float, float, float, float]:
+def _get_credit(
+    attendees_subtotal: int, discount_value: float, application: Application
+) -> int:
+    application_credit = _to_cents(application.credit)  # ty: ignore[invalid-argument-type]
+    return (
+        _get_discounted_cents(attendees_subtotal, discount_value) + application_credit
+    )
+
+
+class ProductAmounts(NamedTuple):
+    """Requested product totals, kept apart by what a coupon scope can discount.
+
+    unit_prices: pre-discount unit price per requested product (for the reference)
     """
-    Classify requested products and compute category amounts.
 
-    Args:
-        applies_to: Coupon scope, mutually exclusive:
-            - 'pass' (default): regular passes are discountable; lodging is not.
-            - 'lodging': only lodging is discountable; passes are not.
-            - 'all': both passes and lodging are discountable.
-            None behaves like 'pass'.
+    unit_prices: List[float]
+    passes_amount: float
+    lodging_amount: float
+    non_discountable_amount: float
+    supporter_amount: float
+    patreon_amount: float
+
+    def split(self, applies_to: Optional[str] = None) -> Tuple[float, float]:
+        """
+        Return (discountable_amount, non_discountable_amount) for a coupon scope.
+
+        Args:
+            applies_to: Coupon scope, mutually exclusive:
+                - 'pass' (default): regular passes are discountable; lodging is not.
+                - 'lodging': only lodging is discountable; passes are not.
+                - 'all': both passes and lodging are discountable.
+                None behaves like 'pass'.
+        """
+        discountable_amount = 0.0
+        non_discountable_amount = self.non_discountable_amount
+        if applies_to != 'lodging':
+            discountable_amount += self.passes_amount
+        else:
+            non_discountable_amount += self.passes_amount
+        if applies_to in ('lodging', 'all'):
+            discountable_amount += self.lodging_amount
+        else:
+            non_discountable_amount += self.lodging_amount
+        return discountable_amount, non_discountable_amount
 
-    Returns:
-        unit_prices: pre-discount unit price per requested product (for the reference)
-        discountable_amount, non_discountable_amount, supporter_amount, patreon_amount
 
-    portal-patron is never discountable. Donations and the supporter/patreon
-    categories are never discounted.
+def _classify_products(
+    requested_products: List[schemas.PaymentProduct],
+    product_map: Dict[int, Product],
+    already_patreon: bool,
+) -> ProductAmounts:
     """
-    lodging_is_discountable = applies_to in ('lodging', 'all')
-    passes_are_discountable = applies_to != 'lodging'
-    product_map = {p.id: p for p in valid_products}
+    Classify requested products and compute category amounts in a single pass.
 
+    Passes and lodging are totalled separately so any coupon scope can be priced
+    from the result without classifying the products again (see
+    ProductAmounts.split). portal-patron is never discountable. Donations and the
+    supporter/patreon categories are never discounted.
+    """
     # Pre-scan: which attendees are buying patreon in this request?
     patreon_attendees = set()
     for rp in requested_products:
@@ -74,10 +142,12 @@ def _classify_products(
         if pm and pm.category == 'patreon':
             patreon_attendees.add(rp.attendee_id)
 
-    discountable_amount = 0.0
-    non_discountable_amount = 0.0
-    supporter_amount = 0.0
-    patreon_amount = 0.0
+    # Totals are kept in whole cents so they add up without float drift
+    passes_cents = 0
+    lodging_cents = 0
+    non_discountable_cents = 0
+    supporter_cents = 0
+    patreon_cents = 0
     unit_prices: List[float] = []
 
     for req_prod in requested_products:
@@ -101,44 +171,38 @@ def _classify_products(
 
         if product_model.category == 'patreon':
             price = unit_price if not already_patreon else 0.0
-            patreon_amount += price * quantity
+            patreon_cents += _to_cents(price) * quantity
             unit_prices.append(price)
         elif product_model.category == 'donation':
             price = float(req_prod.custom_price) if req_prod.custom_price else 0.0
-            non_discountable_amount += price * quantity
+            non_discountable_cents += _to_cents(price) * quantity
             unit_prices.append(price)
         elif product_model.category == 'supporter':
-            supporter_amount += unit_price * quantity
+            supporter_cents += _to_cents(unit_price) * quantity
             unit_prices.append(unit_price)
-        elif (
-            product_model.category == 'lodging' or product_model.slug == 'portal-patron'
-        ):
-            if (
-                product_model.category == 'lodging'
-                and lodging_is_discountable
-            ):
-                discountable_amount += unit_price * quantity
-            else:
-                non_discountable_amount += unit_price * quantity
+        elif product_model.category == 'lodging':
+            lodging_cents += _to_cents(unit_price) * quantity
+            unit_prices.append(unit_price)
+        elif product_model.slug == 'portal-patron':
+            non_discountable_cents += _to_cents(unit_price) * quantity
             unit_prices.append(unit_price)
         else:
-            if passes_are_discountable:
-                discountable_amount += unit_price * quantity
-            else:
-                non_discountable_amount += unit_price * quantity
+            passes_cents += _to_cents(unit_price) * quantity
             unit_prices.append(unit_price)
 
-    logger.info('Discountable amount: %s', discountable_amount)
-    logger.info('Non-discountable amount: %s', non_discountable_amount)
-    logger.info('Supporter amount: %s', supporter_amount)
-    logger.info('Patreon amount: %s', patreon_amount)
-
-    return (
-        unit_prices,
-        discountable_amount,
-        non_discountable_amount,
-        supporter_amount,
-        patreon_amount,
+    logger.info('Passes amount (cents): %s', passes_cents)
+    logger.info('Lodging amount (cents): %s', lodging_cents)
+    logger.info('Non-discountable amount (cents): %s', non_discountable_cents)
+    logger.info('Supporter amount (cents): %s', supporter_cents)
+    logger.info('Patreon amount (cents): %s', patreon_cents)
+
+    return ProductAmounts(
+        unit_prices=unit_prices,
+        passes_amount=passes_cents / 100,
+        lodging_amount=lodging_cents / 100,
+        non_discountable_amount=non_discountable_cents / 100,
+        supporter_amount=supporter_cents / 100,
+        patreon_amount=patreon_cents / 100,
     )
 
 
@@ -149,19 +213,28 @@ def _calculate_price(
     patreon_amount: float,
     discount_value: float,
     application: Application,
-    edit_passes: bool,
+    attendees_subtotal: Optional[int],
 ) -> float:
-    credit = _get_credit(application, discount_value) if edit_passes else 0
-    logger.info('Credit: %s', credit)
+    """Price for one discount candidate, computed in whole cents.
+
+    attendees_subtotal (in cents) is only given when editing passes, in which
+    case what the attendees already hold is credited back at the same discount.
+    """
+    credit = (
+        _get_credit(attendees_subtotal, discount_value, application)
+        if attendees_subtotal is not None
+        else 0
+    )
+    logger.info('Credit (cents): %s', credit)
 
     # Apply discount ONLY to discountable products (regular passes)
-    if discountable_amount > 0:
-        discountable_amount = _get_discounted_price(discountable_amount, discount_value)
+    discountable = _get_discounted_cents(_to_cents(discountable_amount), discount_value)
 
     # Combine discountable (after discount) + non_discountable (full price)
-    total_standard = discountable_amount + non_discountable_amount - credit
+    total_standard = discountable + _to_cents(non_discountable_amount) - credit
 
-    return total_standard + supporter_amount + patreon_amount
+    total = total_standard + _to_cents(supporter_amount) + _to_cents(patreon_amount)
+    return total / 100
 
 
 def _validate_application(application: Application):
@@ -215,13 +288,17 @@ def _validate_products(
     if application.product_segments:
         from app.api.product_segments.models import ProductSegmentProduct
 
-        segment_ids = [s.id for s in application.product_segments]
-        segment_product_ids = {
-            row.product_id
-            for row in db.query(ProductSegmentProduct.product_id)
-            .filter(ProductSegmentProduct.product_segment_id.in_(segment_ids))
-            .all()
-        }
+        segment_ids = frozenset(s.id for s in application.product_segments)
+        segment_product_ids = _segment_products_cache.get(segment_ids)
+        if segment_product_ids is None:
+            segment_product_ids = frozenset(
+                db.scalars(
+                    select(ProductSegmentProduct.product_id).where(
+                        ProductSegmentProduct.product_segment_id.in_(segment_ids)
+                    )
+                )
+            )
+            _segment_products_cache.set(segment_ids, segment_product_ids)
         outside_segment = set(requested_product_ids) - segment_product_ids
         if outside_segment:
             raise HTTPException(
@@ -232,39 +309,77 @@ def _validate_products(
     return valid_products
 
 
-def _check_patreon_status(
-    application: Application,
-    valid_products: List[Product],
-    requested_product_ids: List[int],
-    edit_passes: bool,
-):
-    application_products = [p for a in application.attendees for p in a.products]
-    already_patreon = any(p.category == 'patreon' for p in application_products)
-    is_buying_patreon = any(
-        p.category == 'patreon' for p in valid_products if p.id in requested_product_ids
-    )
+def _check_inventory(requested_qty: Dict[int, int], products: Iterable[Any]) -> None:
+    """Check aggregated quantities against the products' remaining inventory.
 
-    if edit_passes and is_buying_patreon and not already_patreon:
-        logger.error('Cannot edit passes for Patreon products. %s', application.email)
-        raise HTTPException(
-            status_code=400,
-            detail='Cannot edit passes for Patreon products',
+    `products` only need id, name, max_inventory and current_sold, so both
+    Product instances and rows selected with those columns work.
+    """
+    for product in products:
+        if product.max_inventory is None:
+            continue
+        available = product.max_inventory - (product.current_sold or 0)
+        if requested_qty[product.id] > available:
+            raise HTTPException(
+                status_code=400,
+                detail=f'Not enough inventory for {product.name}. '
+                f'Available: {available}',
+            )
+
+
+def _lock_inventory(
+    db: Session, requested_products: List[schemas.PaymentProduct]
+) -> None:
+    """Re-check inventory with the tracked product rows locked until commit.
+
+    Used when a checkout is approved in the same transaction, so two concurrent
+    free checkouts cannot both pass the check before either counts its sale.
+    """
+    requested_qty: Dict[int, int] = {}
+    for req_prod in requested_products:
+        requested_qty[req_prod.product_id] = (
+            requested_qty.get(req_prod.product_id, 0) + req_prod.quantity
         )
 
-    return already_patreon
+    rows = db.execute(
+        select(Product.id, Product.name, Product.max_inventory, Product.current_sold)
+        .where(Product.id.in_(requested_qty), Product.max_inventory.is_not(None))
+        .order_by(Product.id)
+        .with_for_update()
+    ).all()
+    _check_inventory(requested_qty, rows)
+
+
+def _has_patreon_product(db: Session, application: Application) -> bool:
+    return db.scalar(
+        select(
+            exists().where(
+                AttendeeProduct.attendee_id == Attendee.id,
+                AttendeeProduct.product_id == Product.id,
+                Attendee.application_id == application.id,
+                Product.category == 'patreon',
+            )
+        )
+    )
 
 
-def _validate_donations(
+def _validate_requested_products(
+    db: Session,
     requested_products: List[schemas.PaymentProduct],
-    valid_products: List[Product],
-):
-    """Validate donation products have valid custom_price values."""
-    product_categories = {p.id: p.category for p in valid_products}
+    product_map: Dict[int, Product],
+    application: Application,
+    edit_passes: bool,
+) -> bool:
+    """Validate donations, inventory and patreon rules in one pass over the cart.
 
+    Returns whether the application already holds a patreon product.
+    """
+    requested_qty: Dict[int, int] = {}
+    is_buying_patreon = False
     for req_prod in requested_products:
-        category = product_categories.get(req_prod.product_id)
+        product = product_map[req_prod.product_id]
 
-        if category == 'donation':
+        if product.category == 'donation':
             if not req_prod.custom_price:
                 raise HTTPException(
                     status_code=400,
@@ -275,48 +390,39 @@ def _validate_donations(
                     status_code=400,
                     detail='Minimum donation amount is $1',
                 )
+        elif product.category == 'patreon':
+            is_buying_patreon = True
 
+        requested_qty[req_prod.product_id] = (
+            requested_qty.get(req_prod.product_id, 0) + req_prod.quantity
+        )
 
-def _validate_inventory(
-    requested_products: List[schemas.PaymentProduct],
-    valid_products: List[Product],
-):
-    """Check inventory availability for requested products."""
-    product_map = {p.id: p for p in valid_products}
+    _check_inventory(requested_qty, (product_map[pid] for pid in requested_qty))
+
+    already_patreon = _has_patreon_product(db, application)
 
-    # Aggregate quantities per product
-    requested_qty = {}
-    for req in requested_products:
-        requested_qty[req.product_id] = (
-            requested_qty.get(req.product_id, 0) + req.quantity
+    if edit_passes and is_buying_patreon and not already_patreon:
+        logger.error('Cannot edit passes for Patreon products. %s', application.email)
+        raise HTTPException(
+            status_code=400,
+            detail='Cannot edit passes for Patreon products',
         )
 
-    for product_id, qty in requested_qty.items():
-        product = product_map[product_id]
-        if product.max_inventory is not None:
-            available = product.max_inventory - (product.current_sold or 0)
-            if qty > available:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f'Not enough inventory for {product.name}. '
-                    f'Available: {available}',
-                )
+    return already_patreon
 
 
+@log_duration('payment.apply_discounts')
 def _apply_discounts(
     db: Session,
     obj: schemas.PaymentCreate,
     application: Application,
-    discountable_amount: float,
-    non_discountable_amount: float,
-    supporter_amount: float,
-    patreon_amount: float,
-    requested_products: Optional[List[schemas.PaymentProduct]] = None,
-    valid_products: Optional[List[Product]] = None,
-    already_patreon: bool = False,
+    amounts: ProductAmounts,
 ) -> PaymentPreview:
     discount_assigned = application.discount_assigned or 0
     edit_passes = obj.edit_passes or False
+    # Walked once here instead of once per discount candidate below
+    attendees_subtotal = _get_attendees_subtotal(application) if edit_passes else None
+    discountable_amount, non_discountable_amount = amounts.split()
 
     response = PaymentPreview(
         products=obj.products,
@@ -329,17 +435,17 @@ def _apply_discounts(
     response.original_amount = (
         discountable_amount
         + non_discountable_amount
-        + supporter_amount
-        + patreon_amount
+        + amounts.supporter_amount
+        + amounts.patreon_amount
     )
     response.amount = _calculate_price(
         discountable_amount=discountable_amount,
         non_discountable_amount=non_discountable_amount,
-        supporter_amount=supporter_amount,
-        patreon_amount=patreon_amount,
+        supporter_amount=amounts.supporter_amount,
+        patreon_amount=amounts.patreon_amount,
         discount_value=discount_assigned,
         application=application,
-        edit_passes=edit_passes,
+        attendees_subtotal=attendees_subtotal,
     )
 
     if application.group:
@@ -348,11 +454,11 @@ def _apply_discounts(
         discounted_amount = _calculate_price(
             discountable_amount=discountable_amount,
             non_discountable_amount=non_discountable_amount,
-            supporter_amount=supporter_amount,
-            patreon_amount=patreon_amount,
+            supporter_amount=amounts.supporter_amount,
+            patreon_amount=amounts.patreon_amount,
             discount_value=discount_value,
             application=application,
-            edit_passes=edit_passes,
+            attendees_subtotal=attendees_subtotal,
         )
         if discounted_amount < response.amount:
             response.amount = discounted_amount
@@ -365,42 +471,19 @@ def _apply_discounts(
             popup_city_id=application.popup_city_id,  # ty: ignore[invalid-argument-type]
         )
 
-        # Re-classify products with this coupon's applies_to so lodging routes
-        # into the discountable bucket when applies_to is 'lodging' or 'all'.
-        # Falls back to the pre-computed amounts when caller did not pass the
-        # product context (defensive: keeps the function callable in old shape).
+        # Lodging moves into the discountable bucket when the coupon's
+        # applies_to is 'lodging' or 'all'
         coupon_applies_to = getattr(coupon_code, 'applies_to', None) or 'pass'
-        if (
-            coupon_applies_to in ('lodging', 'all')
-            and requested_products is not None
-            and valid_products is not None
-        ):
-            (
-                _unit_prices,
-                coupon_discountable,
-                coupon_non_discountable,
-                coupon_supporter,
-                coupon_patreon,
-            ) = _classify_products(
-                requested_products,
-                valid_products,
-                already_patreon,
-                applies_to=coupon_applies_to,
-            )
-        else:
-            coupon_discountable = discountable_amount
-            coupon_non_discountable = non_discountable_amount
-            coupon_supporter = supporter_amount
-            coupon_patreon = patreon_amount
+        coupon_discountable, coupon_non_discountable = amounts.split(coupon_applies_to)
 
         discounted_amount = _calculate_price(
             discountable_amount=coupon_discountable,
             non_discountable_amount=coupon_non_discountable,
-            supporter_amount=coupon_supporter,
-            patreon_amount=coupon_patreon,
+            supporter_amount=amounts.supporter_amount,
+            patreon_amount=amounts.patreon_amount,
             discount_value=coupon_code.discount_value,
             application=application,
-            edit_passes=edit_passes,
+            attendees_subtotal=attendees_subtotal,
         )
         if discounted_amount < response.amount:
             response.amount = discounted_amount
@@ -411,52 +494,33 @@ def _apply_discounts(
     return response
 
 
+@log_duration('payment.prepare_response')
 def _prepare_payment_response(
     db: Session,
     obj: schemas.PaymentCreate,
     user: TokenData,
-) -> Tuple[schemas.PaymentPreview, Application, List[Product], List[float]]:
-    application = application_crud.get(db, obj.application_id, user)
+) -> Tuple[schemas.PaymentPreview, Application, List[Product], Tuple[float, ...]]:
+    application = application_crud.get(
+        db,
+        obj.application_id,
+        user,
+        options=APPLICATION_PRODUCTS_OPTIONS if obj.edit_passes else (),
+    )
     _validate_application(application)
 
     requested_product_ids = [p.product_id for p in obj.products]
     valid_products = _validate_products(db, requested_product_ids, application, user)
+    # Built once and shared by the validation and pricing helpers below
+    product_map = {p.id: p for p in valid_products}
 
-    # Validate donation products have valid custom_price
-    _validate_donations(obj.products, valid_products)
-
-    # Check inventory availability
-    _validate_inventory(obj.products, valid_products)
-
-    already_patreon = _check_patreon_status(
-        application,
-        valid_products,
-        requested_product_ids,
-        obj.edit_passes or False,
+    already_patreon = _validate_requested_products(
+        db, obj.products, product_map, application, obj.edit_passes or False
     )
 
-    (
-        unit_prices,
-        discountable_amount,
-        non_discountable_amount,
-        supporter_amount,
-        patreon_amount,
-    ) = _classify_products(obj.products, valid_products, already_patreon)
-
-    response = _apply_discounts(
-        db,
-        obj,
-        application,
-        discountable_amount,
-        non_discountable_amount,
-        supporter_amount,
-        patreon_amount,
-        requested_products=obj.products,
-        valid_products=valid_products,
-        already_patreon=already_patreon,
-    )
+    amounts = _classify_products(obj.products, product_map, already_patreon)
+    response = _apply_discounts(db, obj, application, amounts)
 
-    return response, application, valid_products, unit_prices
+    return response, application, valid_products, amounts.unit_prices
 
 
 def _calculate_max_installments(installments_deadline: datetime) -> int:
@@ -480,28 +544,33 @@ def create_payment(
     db: Session,
     obj: schemas.PaymentCreate,
     user: TokenData,
-) -> PaymentPreview:
+) -> Tuple[PaymentPreview, List[Product]]:
+    """Price the checkout and open it in SimpleFi when there is something to pay.
+
+    Returns the preview together with the validated products so the caller can
+    snapshot them without querying them again. The credit update for fully
+    covered checkouts is only flushed; the caller commits it with the payment.
+    """
     response, application, valid_products, unit_prices = _prepare_payment_response(
         db, obj, user
     )
-    simplefi_api_key = _get_simplefi_api_key(application)
     amount = response.amount or 0.0
 
     if amount <= 0:
+        # Approved right away, so inventory is counted in this transaction
+        _lock_inventory(db, obj.products)
         response.status = 'approved'
         if amount < 0:
             application.credit = -amount
             response.amount = 0
         else:
             application.credit = 0
-        db.commit()
-        db.refresh(application)
+        db.flush()
 
-        return response
-
-    # --- Create a lookup for product names --- #
-    valid_products_names = {p.id: p.name for p in valid_products}
+        return response, valid_products
 
+    simplefi_api_key = _get_simplefi_api_key(application)
+    product_names = {p.id: p.name for p in valid_products}
     installments_deadline = application.popup_city.installments_deadline
     max_installments = (
         _calculate_max_installments(installments_deadline)
@@ -516,12 +585,12 @@ def create_payment(
         'products': [
             {
                 'product_id': req_prod.product_id,
-                'name': valid_products_names[req_prod.product_id],
+                'name': product_names[req_prod.product_id],
                 'quantity': req_prod.quantity,
                 'attendee_id': req_prod.attendee_id,
-                'unit_price': unit_prices[i],
+                'unit_price': unit_price,
             }
-            for i, req_prod in enumerate(obj.products)
+            for req_prod, unit_price in zip(obj.products, unit_prices)
         ],
     }
 
@@ -548,7 +617,7 @@ def create_payment(
     if max_installments is not None and max_installments > 1:
         response.is_installment_plan = True
 
-    return response
+    return response, valid_products
 
 
 def create_application_fee_payment(
@@ -1,6 +1,7 @@
 import base64
 import json
 import os
+from functools import lru_cache
 from io import BytesIO
 
 import font_roboto
@@ -247,6 +248,7 @@ def generate_qr_code_base64(code: str, name: str) -> str:
     return base64_str
 
 
+@lru_cache(maxsize=256)
 def generate_plain_qr_code_base64(code: str) -> str:
     """
     Generate a plain black and white QR code image and return it as a base64-encoded PNG.
@@ -1,62 +1,67 @@
+import random
 import time
 import urllib.parse
+from functools import lru_cache
 from typing import Optional
 
-import requests
+import httpx
 
 from app.core.config import get_popup_frontend_url, settings
-from app.core.logger import logger
-
-
-def _create_payment_request(body: dict, simplefi_api_key: str):
-    def post_request():
-        return requests.post(
-            f'{settings.SIMPLEFI_API_URL}/payment_requests',
-            json=body,
-            headers={'Authorization': f'Bearer {simplefi_api_key}'},
-            timeout=20,
-        )
-
-    try:
-        response = post_request()
-        logger.info('Simplefi response status: %s', response.status_code)
-        retry = response.status_code >= 400
-    except requests.exceptions.RequestException as e:
-        logger.error('Simplefi error: %s', e)
-        retry = True
-
-    if retry:
-        logger.error('Simplefi error, retrying...')
-        time.sleep(5)
-        response = post_request()
-        logger.info('Simplefi response status (retry): %s', response.status_code)
-
-    response.raise_for_status()
-    return response.json()
-
-
-def _create_installments_plan(body: dict, simplefi_api_key: str):
-    def post_request():
-        return requests.post(
-            f'{settings.SIMPLEFI_API_URL}/installment_plans',
-            json=body,
-            headers={'Authorization': f'Bearer {simplefi_api_key}'},
-            timeout=20,
-        )
-
-    try:
-        response = post_request()
-        logger.info('Simplefi response status: %s', response.status_code)
-        retry = response.status_code >= 400
-    except requests.exceptions.RequestException as e:
-        logger.error('Simplefi error: %s', e)
-        retry = True
-
-    if retry:
-        logger.error('Simplefi error, retrying...')
-        time.sleep(5)
-        response = post_request()
-        logger.info('Simplefi response status (retry): %s', response.status_code)
+from app.core.http import http_client
+from app.core.logger import log_duration, logger
+
+# Retries on top of the first attempt for transport errors, 429 and 5xx
+SIMPLEFI_MAX_RETRIES = 2
+SIMPLEFI_BACKOFF_FACTOR = 0.5
+# Upper bound for a server-provided Retry-After, so a checkout never hangs
+SIMPLEFI_MAX_RETRY_AFTER = 10.0
+
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response]) -> float:
+    """Seconds to wait before retry number `attempt` (starting at 0)."""
+    retry_after = response.headers.get('Retry-After') if response else None
+    if retry_after:
+        try:
+            return min(float(retry_after), SIMPLEFI_MAX_RETRY_AFTER)
+        except ValueError:
+            pass
+    # Exponential backoff with full jitter so retrying workers spread out
+    return random.uniform(0, SIMPLEFI_BACKOFF_FACTOR * 2**attempt)
+
+
+@lru_cache(maxsize=64)
+def _auth_headers(simplefi_api_key: str) -> dict:
+    # Built once per popup key; httpx only reads the mapping
+    return {'Authorization': f'Bearer {simplefi_api_key}'}
+
+
+@log_duration('simplefi.post')
+def _post(path: str, body: dict, simplefi_api_key: str) -> dict:
+    url = f'{settings.SIMPLEFI_API_URL}/{path}'
+    headers = _auth_headers(simplefi_api_key)
+    for attempt in range(SIMPLEFI_MAX_RETRIES + 1):
+        response = None
+        try:
+            response = http_client.post(
+                url,
+                json=body,
+                headers=headers,
+                timeout=20,
+            )
+            logger.info('Simplefi response status: %s', response.status_code)
+            # Other 4xx responses would fail the same way again, so only
+            # retry on server errors and rate limiting
+            if not (response.is_server_error or response.status_code == 429):
+                break
+        except httpx.HTTPError as e:
+            logger.error('Simplefi error: %s', e)
+            if attempt == SIMPLEFI_MAX_RETRIES:
+                raise
+
+        if attempt < SIMPLEFI_MAX_RETRIES:
+            delay = _retry_delay(attempt, response)
+            logger.error('Simplefi error, retrying in %.2fs...', delay)
+            time.sleep(delay)
 
     response.raise_for_status()
     return response.json()
@@ -96,7 +101,7 @@ def create_payment(
             'notification_url': notification_url,
             'redirect_urls': redirect_urls,
         }
-        return _create_installments_plan(body, simplefi_api_key)
+        return _post('installment_plans', body, simplefi_api_key)
 
     body = {
         'amount': amount,
@@ -107,6 +112,6 @@ def create_payment(
         'redirect_urls': redirect_urls,
     }
 
-    response = _create_payment_request(body, simplefi_api_key)
+    response = _post('payment_requests', body, simplefi_api_key)
     response['checkout_url'] = response['checkout_v2_url']
     return response
@@ -1,8 +1,7 @@
 import time
 from datetime import timedelta
-from typing import List
 
-from sqlalchemy import select, true
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from app.api.email_logs.crud import email_log as email_log_crud
@@ -17,22 +16,7 @@ def _format_price(price):
     return f'${price:,.2f}'.rstrip('0').rstrip('.')
 
 
-def get_to_exclude_emails(db: Session) -> List[str]:
-    """Get list of emails that have received an abandoned cart email in the past week.
-
-    These emails should be excluded from receiving another abandoned cart email
-    to avoid spamming users.
-    """
-    one_week_ago = current_time() - timedelta(days=7)
-    return db.scalars(
-        select(models.EmailLog.receiver_email).where(
-            models.EmailLog.event == EmailEvent.ABANDONED_CART.value,
-            models.EmailLog.created_at >= one_week_ago,
-        )
-    ).all()
-
-
-def process_abandoned_cart(db: Session, to_exclude_emails: List[str]):
+def process_abandoned_cart(db: Session):
     five_hours_ago = current_time() - timedelta(hours=5)
     one_hours_ago = current_time() - timedelta(hours=1)
     # Subquery: latest payment OVERALL per application in popup_city_id=2
@@ -49,9 +33,12 @@ def process_abandoned_cart(db: Session, to_exclude_emails: List[str]):
         )
         .where(
             models.Application.popup_city_id == 2,
-            models.Application.email.notin_(to_exclude_emails)
-            if to_exclude_emails
-            else true(),
+            # Skip anyone who got an abandoned cart email in the past week
+            ~email_log_crud.sent_since(
+                models.Application.email,
+                EmailEvent.ABANDONED_CART.value,
+                timedelta(days=7),
+            ),
             models.Payment.edit_passes.is_(False),
         )
         .distinct(models.Payment.application_id)  # DISTINCT ON (application_id)
@@ -124,9 +111,7 @@ def process_abandoned_cart(db: Session, to_exclude_emails: List[str]):
 
 def main():
     with SessionLocal() as db:
-        to_exclude = get_to_exclude_emails(db)
-        logger.info('To exclude emails: %s', to_exclude)
-        process_abandoned_cart(db, to_exclude)
+        process_abandoned_cart(db)
 
     logger.info('Sleeping for 2 minutes...')
     time.sleep(120)
@@ -1,15 +1,15 @@
 import time
 from datetime import timedelta
 
-import requests
 from sqlalchemy.orm import Session
 
 from app.api.applications.models import Application
 from app.api.applications.schemas import ApplicationStatus
 from app.api.popup_city.models import PopUpCity
-from app.core import models
+from app.core import models, nocodb
 from app.core.config import settings
 from app.core.database import SessionLocal
+from app.core.http import http_client
 from app.core.logger import logger
 from app.core.utils import current_time
 
@@ -30,19 +30,14 @@ def process_popup_city(db: Session, popup_city: PopUpCity):
         .all()
     )
 
+    url = nocodb.records_url(settings.APPLICATIONS_TABLE_ID)
     for application in applications:
         logger.info('Approving application %s %s', application.id, application.email)
         data = {
             'id': application.id,
             'auto_approved': True,
         }
-        url = f'{settings.NOCODB_URL}/api/v2/tables/{settings.APPLICATIONS_TABLE_ID}/records'
-        headers = {
-            'accept': 'application/json',
-            'xc-token': settings.NOCODB_TOKEN,
-            'Content-Type': 'application/json',
-        }
-        response = requests.patch(url, headers=headers, json=data)
+        response = http_client.patch(url, headers=nocodb.NOCODB_HEADERS, json=data)
         if response.status_code != 200:
             logger.error(
                 'Error approving application %s %s', application.id, application.email
@@ -0,0 +1,35 @@
+import time
+from datetime import timedelta
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from app.api.webhooks.models import ProcessedWebhook
+from app.core import models  # noqa: F401
+from app.core.database import SessionLocal
+from app.core.logger import logger
+from app.core.utils import current_time
+
+# SimpleFi stops redelivering a webhook long before this, so older claims only
+# take up space
+PROCESSED_WEBHOOK_RETENTION = timedelta(days=30)
+
+
+def purge_processed_webhooks(db: Session) -> int:
+    cutoff = current_time() - PROCESSED_WEBHOOK_RETENTION
+    result = db.execute(
+        delete(ProcessedWebhook).where(ProcessedWebhook.processed_at < cutoff)
+    )
+    db.commit()
+    logger.info('Purged %s processed webhooks older than %s', result.rowcount, cutoff)
+    return result.rowcount
+
+
+def main():
+    with SessionLocal() as db:
+        purge_processed_webhooks(db)
+
+
+if __name__ == '__main__':
+    main()
+    time.sleep(3600)
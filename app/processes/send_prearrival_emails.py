@@ -1,8 +1,11 @@
+import logging
 import time
+from concurrent.futures import Executor, ProcessPoolExecutor
 from datetime import timedelta
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session, selectinload
 
 from app.api.applications.models import Application
 from app.api.attendees.models import Attendee
@@ -11,6 +14,7 @@ from app.api.email_logs.crud import email_log as email_log_crud
 from app.api.email_logs.models import EmailLog
 from app.api.email_logs.schemas import EmailAttachment, EmailEvent
 from app.api.popup_city.models import PopUpCity
+from app.api.products.models import Product
 from app.core import models  # noqa: F401
 from app.core.config import Environment, settings
 from app.core.database import SessionLocal
@@ -21,263 +25,224 @@ from app.core.utils import current_time
 POPUP_CITY_SLUG = 'edge-patagonia'
 DAYS_BEFORE_START_5DAY = 5
 DAYS_BEFORE_START_24H = 1
+# Emails per Postmark batch request; each carries a few QR PNG attachments
+PREARRIVAL_BATCH_SIZE = 50
+
+# Attendees and their products are walked for every candidate application, so
+# load them up front in one IN query per level instead of lazily per row.
+# Only ticket holders and the main attendee (whose code the 24h email always
+# carries) are needed, so the rest are never loaded.
+# popup_city is already joined-loaded by the relationship itself.
+APPLICATION_ATTENDEES_OPTIONS = (
+    selectinload(
+        Application.attendees.and_(
+            or_(Attendee.category == 'main', Attendee.products.any())
+        )
+    ).selectinload(Attendee.products),
+)
+
+# Rendered QR images by (check_in_code, name), kept for the process lifetime
+_qr_cache: Dict[Tuple[str, str], str] = {}
 
 
-def generate_qr_attachment(check_in_code: str, attendee_name: str):
-    """Generate a modern, styled QR code attachment for an attendee."""
-    logger.info('Generating QR code for %s %s', check_in_code, attendee_name)
+def generate_qr_attachment(check_in_code: str, attendee_name: str, content: str):
+    """Wrap a rendered QR code for an attendee as an email attachment."""
     filename = f'{attendee_name}.png'.replace(' ', '_')
     return EmailAttachment(
         name=filename,
         content_id=f'cid:{filename}',
-        content=generate_qr_code_base64(check_in_code, attendee_name),
+        content=content,
         content_type='image/png',
     )
 
 
-def generate_qr_attachments(attendees: List[Attendee]):
-    """Generate QR code attachments for all attendees with products."""
-    attachments = []
-    for attendee in attendees:
-        if attendee.products:
-            qr = generate_qr_attachment(attendee.check_in_code, attendee.name)
-            attachments.append(qr)
-    return attachments
-
+def _qr_keys(attendees: List[Attendee]) -> List[Tuple[str, str]]:
+    return [
+        (attendee.check_in_code, attendee.name)
+        for attendee in attendees
+        if attendee.products
+    ]
 
-def generate_checkin_codes_html(attendees: List[Attendee]) -> str:
-    """Generate HTML formatted string with all attendees' check-in codes and products."""
-    html_parts = []
-    for attendee in attendees:
-        if attendee.category == 'main':
-            continue
-        if attendee.products:
-            html_parts.append(
-                f'<li><strong>{attendee.name}</strong>: {attendee.check_in_code}</li>'
-            )
 
-    if not html_parts:
-        return ''
+def render_qr_codes(keys: List[Tuple[str, str]], executor: Optional[Executor] = None):
+    """Render the QR images for the given (code, name) pairs not cached yet.
 
-    return f"<p>Here are the access codes for your guests:</p><ul>{''.join(html_parts)}</ul><p>You'll find their QR codes attached.</p>"
-
-
-def get_earliest_start_date(application: Application):
+    Rendering is CPU bound, so when an executor is given the images are
+    rendered on it in parallel.
     """
-    Get the earliest start date from all products across all attendees.
-    Fallback to popup city start date if no product has a start date.
-    """
-    earliest_date = None
-    for attendee in application.attendees:
-        for product in attendee.products:
-            if product.start_date:
-                if not earliest_date or product.start_date < earliest_date:
-                    earliest_date = product.start_date
+    # Applications due for both the 5-day and the 24h email in the same run
+    # reuse the images rendered for the first one
+    missing = [key for key in dict.fromkeys(keys) if key not in _qr_cache]
+    if not missing:
+        return
+    logger.info('Generating QR codes for %s', [code for code, _ in missing])
 
-    if not earliest_date:
-        # Fallback to popup city start date
-        earliest_date = application.popup_city.start_date
+    map_fn = executor.map if executor else map
+    codes = [code for code, _ in missing]
+    names = [name for _, name in missing]
+    _qr_cache.update(zip(missing, map_fn(generate_qr_code_base64, codes, names)))
 
-    return earliest_date
 
+def generate_qr_attachments(
+    attendees: List[Attendee], executor: Optional[Executor] = None
+):
+    """Generate QR code attachments for all attendees with products."""
+    keys = _qr_keys(attendees)
+    render_qr_codes(keys, executor)
+    return [
+        generate_qr_attachment(code, name, _qr_cache[code, name]) for code, name in keys
+    ]
 
-def has_any_attendee_checked_in(application: Application, db: Session) -> bool:
-    """
-    Check if any attendee in the application has already checked in via QR code.
-    Returns True if any attendee has qr_check_in=True, False otherwise.
-    """
-    attendee_ids = [attendee.id for attendee in application.attendees]
 
-    if not attendee_ids:
-        return False
+def generate_checkin_codes_html(attendees: List[Attendee]) -> str:
+    """Generate HTML formatted string with all attendees' check-in codes and products."""
+    html_parts = [
+        f'<li><strong>{attendee.name}</strong>: {attendee.check_in_code}</li>'
+        for attendee in attendees
+        if attendee.category != 'main' and attendee.products
+    ]
 
-    # Check if any attendee has a check-in record with qr_check_in=True
-    checked_in_count = (
-        db.query(CheckIn)
-        .filter(
-            CheckIn.attendee_id.in_(attendee_ids),
-            CheckIn.qr_check_in == True,  # noqa: E712
-        )
-        .count()
-    )
+    if not html_parts:
+        return ''
 
-    return checked_in_count > 0
+    return f"<p>Here are the access codes for your guests:</p><ul>{''.join(html_parts)}</ul><p>You'll find their QR codes attached.</p>"
 
 
-def get_sent_prearrival_emails(db: Session, event: str) -> List[str]:
-    """Get list of application emails that have already received pre-arrival emails for a specific event."""
-    logs = (
-        db.query(EmailLog.receiver_email.distinct())
-        .filter(EmailLog.event == event)
-        .all()
+def _already_sent(event: str):
+    # Anti-join against the email logs instead of sending every address
+    # that already got the email back to the database in a NOT IN list
+    return (
+        select(EmailLog.id)
+        .where(
+            EmailLog.event == event,
+            EmailLog.receiver_email == Application.email,
+        )
+        .exists()
     )
-    return [log[0] for log in logs]
 
 
-def get_applications_for_prearrival(db: Session):
+def get_prearrival_candidates(
+    db: Session,
+) -> Tuple[List[Application], List[Application]]:
     """
-    Get applications that need to receive pre-arrival emails.
+    Get the applications that need the 5-day and the 24-hour pre-arrival emails.
+
+    Both lists come from one query, since every 24h candidate is also within
+    the 5-day window.
 
     Criteria:
     - From Edge Patagonia (popup_city slug == 'edge-patagonia')
     - Has attendees with products
-    - Earliest product start date is 5 days or less away
-    - Haven't received pre-arrival email yet (deduplication handled by exclusion list)
+    - Earliest product start date (or the popup start date when no product
+      has one) is 5 days or less away, or 1 day or less for the 24h email
+    - No attendees have checked in yet (qr_check_in=False), for the 24h email
+    - Haven't received that email yet (deduplicated by email logs)
     """
-    excluded_emails = get_sent_prearrival_emails(db, EmailEvent.PRE_ARRIVAL.value)
-    logger.info('Excluded application emails: %s', excluded_emails)
-
     today = current_time()
-    target_date = today + timedelta(days=DAYS_BEFORE_START_5DAY)
 
-    # Get all applications from Edge Patagonia with attendees that have products
-    applications = (
-        db.query(Application)
-        .join(Application.popup_city)
-        .join(Application.attendees)
-        .join(Attendee.products)
-        .filter(
-            PopUpCity.slug == POPUP_CITY_SLUG,
-            Application.email.notin_(excluded_emails),
+    earliest = (
+        select(
+            Attendee.application_id,
+            func.min(Product.start_date).label('earliest_start_date'),
         )
-        .distinct()
-        .all()
+        .join(Attendee.products)
+        .group_by(Attendee.application_id)
+        .subquery()
     )
-
-    logger.info('Applications before filter: %s', len(applications))
-
-    # Filter to only include applications where the earliest start date
-    # is 5 days or less away
-    filtered_applications = []
-    for application in applications:
-        earliest_date = get_earliest_start_date(application)
-        logger.info(
-            'Earliest date for application %s %s: %s',
-            application.id,
-            application.email,
-            earliest_date.strftime('%Y-%m-%d'),
+    earliest_date = func.coalesce(earliest.c.earliest_start_date, PopUpCity.start_date)
+    sent_5day = _already_sent(EmailEvent.PRE_ARRIVAL.value)
+    sent_24h = _already_sent(EmailEvent.PRE_ARRIVAL_24H.value)
+    # Any attendee of the application already checked in via QR code
+    checked_in = (
+        select(CheckIn.id)
+        .join(Attendee, Attendee.id == CheckIn.attendee_id)
+        .where(
+            Attendee.application_id == Application.id,
+            CheckIn.qr_check_in == True,  # noqa: E712
         )
-        if not earliest_date:
-            logger.error('No earliest date for application %s', application.id)
-            continue
-
-        # Check if earliest start date is at most 5 days away
-        if earliest_date <= target_date:
-            logger.info('Application %s is 5 days or less away', application.id)
-            filtered_applications.append(application)
-
-    logger.info('Total applications found: %s', len(filtered_applications))
-    logger.info('Emails: %s', [a.email for a in filtered_applications])
-    logger.info(
-        'Applications ids to process: %s', [a.id for a in filtered_applications]
+        .exists()
     )
 
-    return filtered_applications
-
-
-def get_applications_for_24h_prearrival(db: Session):
-    """
-    Get applications that need to receive 24-hour pre-arrival emails.
-
-    Criteria:
-    - From Edge Patagonia (popup_city slug == 'edge-patagonia')
-    - Has attendees with products
-    - Earliest product start date is 1 day or less away
-    - No attendees have checked in yet (qr_check_in=False)
-    - Haven't received 24-hour pre-arrival email yet (deduplication handled by exclusion list)
-    """
-    excluded_emails = get_sent_prearrival_emails(db, EmailEvent.PRE_ARRIVAL_24H.value)
-    logger.info('Excluded 24h application emails: %s', excluded_emails)
-
-    today = current_time()
-    target_date = today + timedelta(days=DAYS_BEFORE_START_24H)
-
-    # Get all applications from Edge Patagonia with attendees that have products
-    applications = (
-        db.query(Application)
+    rows = (
+        db.query(
+            Application,
+            earliest_date.label('earliest_date'),
+            sent_5day.label('sent_5day'),
+            sent_24h.label('sent_24h'),
+            checked_in.label('checked_in'),
+        )
+        .options(*APPLICATION_ATTENDEES_OPTIONS)
         .join(Application.popup_city)
-        .join(Application.attendees)
-        .join(Attendee.products)
+        .join(earliest, earliest.c.application_id == Application.id)
         .filter(
             PopUpCity.slug == POPUP_CITY_SLUG,
-            Application.email.notin_(excluded_emails),
+            earliest_date <= today + timedelta(days=DAYS_BEFORE_START_5DAY),
+            ~and_(sent_5day, sent_24h),
         )
-        .distinct()
         .all()
     )
 
-    logger.info('Applications before filter (24h): %s', len(applications))
-
-    # Filter to only include applications where the earliest start date
-    # is 1 day or less away
-    filtered_applications = []
-    for application in applications:
-        earliest_date = get_earliest_start_date(application)
+    target_24h = today + timedelta(days=DAYS_BEFORE_START_24H)
+    applications_5day = [row.Application for row in rows if not row.sent_5day]
+    applications_24h = [
+        row.Application
+        for row in rows
+        if row.earliest_date <= target_24h and not row.sent_24h and not row.checked_in
+    ]
+
+    logger.info('Total applications found: %s', len(applications_5day))
+    logger.info('Total 24h applications found: %s', len(applications_24h))
+    # Only build the per-application summaries when they will be emitted
+    if logger.isEnabledFor(logging.INFO):
         logger.info(
-            'Earliest date for application %s %s (24h check): %s',
-            application.id,
-            application.email,
-            earliest_date.strftime('%Y-%m-%d'),
+            'Applications to process: %s',
+            {a.id: a.email for a in applications_5day},
+        )
+        logger.info(
+            '24h Applications to process: %s',
+            {a.id: a.email for a in applications_24h},
         )
-        if not earliest_date:
-            logger.error('No earliest date for application %s', application.id)
-            continue
-
-        # Check if earliest start date is at most 1 day away
-        if earliest_date <= target_date:
-            logger.info('Application %s is 1 day or less away', application.id)
-
-            # Check if any attendee has already checked in
-            if has_any_attendee_checked_in(application, db):
-                logger.info(
-                    'Skipping application %s %s - at least one attendee has already checked in',
-                    application.id,
-                    application.email,
-                )
-                continue
-
-            filtered_applications.append(application)
-
-    logger.info('Total 24h applications found: %s', len(filtered_applications))
-    logger.info('24h Emails: %s', [a.email for a in filtered_applications])
-    logger.info(
-        '24h Applications ids to process: %s', [a.id for a in filtered_applications]
-    )
 
-    return filtered_applications
+    return applications_5day, applications_24h
 
 
-def process_application_for_prearrival(application: Application):
-    """Send pre-arrival email to application with QR codes for all attendees."""
+def build_prearrival_email(application: Application) -> dict:
+    """Build the pre-arrival email with QR codes for all attendees."""
     logger.info('Processing application %s %s', application.id, application.email)
 
     attachments = generate_qr_attachments(application.attendees)
 
     params = {'first_name': application.first_name}
-    logger.info('Sending pre-arrival email to %s', application.email)
-    email_log_crud.send_mail(
-        receiver_mail=application.email,
-        event=EmailEvent.PRE_ARRIVAL.value,
-        popup_city=application.popup_city,
-        params=params,
-        entity_type='application',
-        entity_id=application.id,
-        attachments=attachments,
-    )
+    return {
+        'receiver_mail': application.email,
+        'event': EmailEvent.PRE_ARRIVAL.value,
+        'popup_city': application.popup_city,
+        'params': params,
+        'entity_type': 'application',
+        'entity_id': application.id,
+        'attachments': attachments,
+    }
 
 
-def process_application_for_24h_prearrival(application: Application):
-    """Send 24-hour pre-arrival email to application with check-in codes details and QR codes."""
+def build_24h_prearrival_email(application: Application) -> Optional[dict]:
+    """Build the 24-hour pre-arrival email with check-in codes and QR codes."""
     logger.info('Processing 24h application %s %s', application.id, application.email)
 
-    main_attendee = application.get_main_attendee()
+    # One pass over the (already loaded) attendees for everything below
+    main_attendee = None
+    ticket_holders = []
+    for attendee in application.attendees:
+        if attendee.category == 'main' and main_attendee is None:
+            main_attendee = attendee
+        if attendee.products:
+            ticket_holders.append(attendee)
 
     if not main_attendee:
         logger.warning('No attendees with products for application %s', application.id)
-        return
+        return None
 
     # Generate QR code attachments for all attendees
-    attachments = generate_qr_attachments(application.attendees)
+    attachments = generate_qr_attachments(ticket_holders)
 
     # Add main attendee QR code as main.png (plain black and white version)
     main_qr = EmailAttachment(
@@ -289,7 +254,7 @@ def process_application_for_24h_prearrival(application: Application):
     attachments.append(main_qr)
 
     # Generate HTML with all attendees' check-in codes
-    checkin_codes_html = generate_checkin_codes_html(application.attendees)
+    checkin_codes_html = generate_checkin_codes_html(ticket_holders)
 
     params = {
         'first_name': application.first_name,
@@ -297,50 +262,61 @@ def process_application_for_24h_prearrival(application: Application):
         'checkin_codes_details': checkin_codes_html,
     }
 
-    logger.info('Params: %s', params)
-    logger.info('Sending 24h pre-arrival email to %s', application.email)
-    email_log_crud.send_mail(
-        receiver_mail=application.email,
-        event=EmailEvent.PRE_ARRIVAL_24H.value,
-        popup_city=application.popup_city,
-        params=params,
-        entity_type='application',
-        entity_id=application.id,
-        attachments=attachments,
-    )
+    logger.debug('Params: %s', params)
+    return {
+        'receiver_mail': application.email,
+        'event': EmailEvent.PRE_ARRIVAL_24H.value,
+        'popup_city': application.popup_city,
+        'params': params,
+        'entity_type': 'application',
+        'entity_id': application.id,
+        'attachments': attachments,
+    }
 
 
 def send_prearrival_emails(db: Session):
     """Main function to process and send pre-arrival emails (both 5-day and 24-hour)."""
     logger.info('Starting pre-arrival email process')
 
-    # Process 5-day pre-arrival emails
-    logger.info('Processing 5-day pre-arrival emails')
-    applications_5day = get_applications_for_prearrival(db)
+    applications_5day, applications_24h = get_prearrival_candidates(db)
     logger.info('Total 5-day applications to process: %s', len(applications_5day))
-
-    for application in applications_5day:
-        try:
-            process_application_for_prearrival(application)
-        except Exception as e:
-            logger.error(
-                'Error processing 5-day application %s: %s', application.id, str(e)
-            )
-            continue
-
-    # Process 24-hour pre-arrival emails
-    logger.info('Processing 24-hour pre-arrival emails')
-    applications_24h = get_applications_for_24h_prearrival(db)
     logger.info('Total 24-hour applications to process: %s', len(applications_24h))
 
-    for application in applications_24h:
-        try:
-            process_application_for_24h_prearrival(application)
-        except Exception as e:
-            logger.error(
-                'Error processing 24h application %s: %s', application.id, str(e)
-            )
-            continue
+    # Render every QR code of the run in one pass over the pool, so workers
+    # stay busy instead of waiting on one application at a time
+    with ProcessPoolExecutor() as qr_pool:
+        render_qr_codes(
+            [
+                key
+                for application in {*applications_5day, *applications_24h}
+                for key in _qr_keys(application.attendees)
+            ],
+            qr_pool,
+        )
+
+    # Build every email before sending: sending commits the session, which
+    # would expire the loaded attendees and reload them one by one
+    emails = []
+    for builder, applications in (
+        (build_prearrival_email, applications_5day),
+        (build_24h_prearrival_email, applications_24h),
+    ):
+        for application in applications:
+            try:
+                email = builder(application)
+            except Exception as e:
+                logger.error(
+                    'Error processing application %s: %s', application.id, str(e)
+                )
+                continue
+            if email is not None:
+                emails.append(email)
+
+    # Postmark caps the total batch size, and QR attachments are large
+    for start in range(0, len(emails), PREARRIVAL_BATCH_SIZE):
+        batch = emails[start : start + PREARRIVAL_BATCH_SIZE]
+        logger.info('Sending %s pre-arrival emails', len(batch))
+        email_log_crud.send_mail_batch(db, batch)
 
     logger.info('Finished pre-arrival email process')
 
@@ -93,8 +93,9 @@ def get_used_frequencies(
     db: Session, application_id: int, template_name: str
 ) -> list[timedelta]:
     """Get list of frequencies for which emails have already been sent."""
-    email_logs = (
-        db.query(EmailLog)
+    # Only the params column is needed, not the full log rows
+    logged_params = (
+        db.query(EmailLog.params)
         .filter(
             EmailLog.entity_id == application_id,
             EmailLog.entity_type == 'application',
@@ -106,8 +107,8 @@ def get_used_frequencies(
 
     return [
         _get_frequency_timedelta(params['freq'])
-        for log in email_logs
-        if log.params and (params := json.loads(log.params)).get('freq')
+        for (raw_params,) in logged_params
+        if raw_params and (params := json.loads(raw_params)).get('freq')
     ]
 
 
@@ -3,6 +3,7 @@ from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from app.api.account_clusters.routes import router as account_clusters_router
 from app.api.achievements.routes import router as achievements_router
@@ -30,7 +31,7 @@ async def lifespan(app: FastAPI):
     yield
 
 
-app = FastAPI(lifespan=lifespan, version='0.1.1')
+app = FastAPI(lifespan=lifespan, version='0.1.1', default_response_class=ORJSONResponse)
 
 # Include routers
 app.include_router(
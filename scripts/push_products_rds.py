@@ -8,7 +8,7 @@ import json
 import os
 from datetime import datetime
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import column, create_engine, func, insert, table, text
 from sqlalchemy.orm import sessionmaker
 
 # Direct connection - no app imports needed
@@ -20,6 +20,27 @@ DB_PASS = os.environ.get('DB_PASSWORD', 'secret')
 
 DATABASE_URL = f'postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
 
+BATCH_SIZE = 500
+
+PRODUCTS = table(
+    'products',
+    column('name'),
+    column('slug'),
+    column('price'),
+    column('compare_price'),
+    column('popup_city_id'),
+    column('description'),
+    column('category'),
+    column('attendee_category'),
+    column('start_date'),
+    column('end_date'),
+    column('is_active'),
+    column('exclusive'),
+    column('created_at'),
+    column('updated_at'),
+    column('created_by'),
+)
+
 
 def parse_bool(val):
     if isinstance(val, bool):
@@ -30,22 +51,84 @@ def parse_bool(val):
 
 
 def parse_float(val):
+    if val in (None, '', 'None'):
+        return None
     try:
-        return float(val) if val not in (None, '', 'None') else None
-    except Exception:
+        return float(val)
+    except (TypeError, ValueError):
         return None
 
 
 def parse_datetime(val):
-    if not val or val.strip() == '':
+    if not val or not (val := val.strip()):
         return None
+    # fromisoformat parses the 'YYYY-MM-DD HH:MM:SS' export format natively, so
+    # the common case never raises and no strptime fallback is needed
     try:
         return datetime.fromisoformat(val)
-    except Exception:
-        try:
-            return datetime.strptime(val, '%Y-%m-%d %H:%M:%S')
-        except Exception:
-            return None
+    except ValueError:
+        return None
+
+
+def iter_products(csv_path: str):
+    with open(csv_path, newline='') as f:
+        yield from csv.DictReader(f)
+
+
+def insert_batch(session, popup_city_id: int, batch: list[dict]):
+    """Insert a batch of CSV rows, skipping slugs the popup already has."""
+    # One lookup for every slug in the batch instead of one SELECT per row
+    existing = {
+        slug
+        for (slug,) in session.execute(
+            text(
+                'SELECT slug FROM products '
+                'WHERE popup_city_id = :popup_id AND slug = ANY(:slugs)'
+            ),
+            {'popup_id': popup_city_id, 'slugs': [r.get('slug') for r in batch]},
+        )
+    }
+
+    rows = []
+    skipped = 0
+    for row in batch:
+        slug = row.get('slug')
+        if slug in existing:
+            print(f'  Skipping (exists): {slug}')
+            skipped += 1
+            continue
+        existing.add(slug)
+
+        rows.append(
+            {
+                'name': row.get('name'),
+                'slug': slug,
+                'price': parse_float(row.get('price')),
+                'compare_price': parse_float(row.get('compare_price')),
+                'popup_city_id': popup_city_id,
+                'description': row.get('description') or None,
+                'category': row.get('category') or None,
+                'attendee_category': row.get('attendee_category') or None,
+                'start_date': parse_datetime(row.get('start_date')),
+                'end_date': parse_datetime(row.get('end_date')),
+                'is_active': parse_bool(row.get('is_active')),
+                'exclusive': parse_bool(row.get('exclusive')),
+            }
+        )
+
+    if rows:
+        # An insert() construct lets SQLAlchemy batch every row into
+        # multi-row INSERT statements instead of one round trip per row
+        session.execute(
+            insert(PRODUCTS).values(
+                created_at=func.now(), updated_at=func.now(), created_by='system'
+            ),
+            rows,
+        )
+    for row in rows:
+        print(f'  ✓ Inserted: {row["name"]} ({row["slug"]})')
+
+    return len(rows), skipped
 
 
 def main():
@@ -66,65 +149,24 @@ def main():
         popup_city_id, popup_name = result
         print(f'Using popup city: {popup_name} (ID: {popup_city_id})')
 
-        # Read products CSV
+        # Stream the CSV and flush it in batches so memory stays flat
         csv_path = os.path.join(os.path.dirname(__file__), 'products.csv')
-        with open(csv_path, newline='') as f:
-            reader = csv.DictReader(f)
-            products = list(reader)
-
-        print(f'Found {len(products)} products to insert')
-
         inserted = 0
         skipped = 0
-
-        for row in products:
-            slug = row.get('slug')
-
-            # Check if exists
-            exists = session.execute(
-                text(
-                    'SELECT id FROM products WHERE slug = :slug AND popup_city_id = :popup_id'
-                ),
-                {'slug': slug, 'popup_id': popup_city_id},
-            ).fetchone()
-
-            if exists:
-                print(f'  Skipping (exists): {slug}')
-                skipped += 1
-                continue
-
-            # Insert
-            session.execute(
-                text("""
-                INSERT INTO products (
-                    name, slug, price, compare_price, popup_city_id,
-                    description, category, attendee_category,
-                    start_date, end_date, is_active, exclusive,
-                    created_at, updated_at, created_by
-                ) VALUES (
-                    :name, :slug, :price, :compare_price, :popup_city_id,
-                    :description, :category, :attendee_category,
-                    :start_date, :end_date, :is_active, :exclusive,
-                    NOW(), NOW(), 'system'
+        batch = []
+        for row in iter_products(csv_path):
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                batch_inserted, batch_skipped = insert_batch(
+                    session, popup_city_id, batch
                 )
-                """),
-                {
-                    'name': row.get('name'),
-                    'slug': slug,
-                    'price': parse_float(row.get('price')),
-                    'compare_price': parse_float(row.get('compare_price')),
-                    'popup_city_id': popup_city_id,
-                    'description': row.get('description') or None,
-                    'category': row.get('category') or None,
-                    'attendee_category': row.get('attendee_category') or None,
-                    'start_date': parse_datetime(row.get('start_date')),
-                    'end_date': parse_datetime(row.get('end_date')),
-                    'is_active': parse_bool(row.get('is_active')),
-                    'exclusive': parse_bool(row.get('exclusive')),
-                },
-            )
-            print(f'  ✓ Inserted: {row.get("name")} ({slug})')
-            inserted += 1
+                inserted += batch_inserted
+                skipped += batch_skipped
+                batch = []
+        if batch:
+            batch_inserted, batch_skipped = insert_batch(session, popup_city_id, batch)
+            inserted += batch_inserted
+            skipped += batch_skipped
 
         session.commit()
         print(f'\nDone! Inserted: {inserted}, Skipped: {skipped}')
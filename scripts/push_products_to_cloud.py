@@ -10,9 +10,24 @@ import argparse
 import csv
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 NOCODB_BASE_URL = 'https://app.nocodb.com/api/v2'
 PRODUCTS_TABLE_ID = 'mjt8xx9ltkhfcbu'
+# The records endpoint accepts a list; keep batches small enough for NocoDB
+BATCH_SIZE = 100
+# Rate limiting and gateway errors mean the batch was not stored, so they are
+# safe to retry. A plain 500 could have inserted part of it, so it is not.
+RETRY = Retry(
+    total=5,
+    backoff_factor=0.3,
+    status_forcelist=[429, 502, 503, 504],
+    allowed_methods=['POST'],
+    respect_retry_after_header=True,
+    # Hand back the last response so the batch is reported as failed
+    raise_on_status=False,
+)
 
 
 def parse_bool(val):
@@ -24,25 +39,23 @@ def parse_bool(val):
 
 
 def parse_float(val):
+    if val in (None, '', 'None'):
+        return None
     try:
-        return float(val) if val not in (None, '', 'None') else None
-    except Exception:
+        return float(val)
+    except (TypeError, ValueError):
         return None
 
 
-def read_products_csv(csv_path: str):
+def iter_products(csv_path: str):
     with open(csv_path, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        return list(reader)
+        yield from csv.DictReader(csvfile)
 
 
-def push_product(token: str, product: dict):
-    """Push a single product to NocoDB Cloud."""
+def push_products(session: requests.Session, products: list[dict]):
+    """Push a batch of products to NocoDB Cloud in a single request."""
     url = f'{NOCODB_BASE_URL}/tables/{PRODUCTS_TABLE_ID}/records'
-    headers = {'xc-token': token, 'Content-Type': 'application/json'}
-
-    response = requests.post(url, json=product, headers=headers)
-    return response
+    return session.post(url, json=products)
 
 
 def main():
@@ -59,45 +72,60 @@ def main():
     args = parser.parse_args()
 
     csv_path = os.path.join(os.path.dirname(__file__), 'products.csv')
-    rows = read_products_csv(csv_path)
-
-    print(f'Found {len(rows)} products to push')
 
     success = 0
     failed = 0
 
-    for row in rows:
-        product = {
-            'name': row.get('name'),
-            'slug': row.get('slug'),
-            'price': parse_float(row.get('price')),
-            'compare_price': parse_float(row.get('compare_price')),
-            # Use the linked record field name with display value
-            'popups': args.popup_city_name,
-            'description': row.get('description') or None,
-            'category': row.get('category') or None,
-            'attendee_category': row.get('attendee_category') or None,
-            'start_date': row.get('start_date') or None,
-            'end_date': row.get('end_date') or None,
-            'is_active': parse_bool(row.get('is_active')),
-            'exclusive': parse_bool(row.get('exclusive')),
-        }
-
-        # Remove None values (NocoDB doesn't like explicit nulls for some fields)
-        product = {k: v for k, v in product.items() if v is not None}
-
-        if args.dry_run:
-            print(f'  Would push: {product["name"]} ({product["slug"]})')
-            continue
-
-        response = push_product(args.token, product)
+    def flush(session: requests.Session, batch: list[dict]):
+        nonlocal success, failed
+        response = push_products(session, batch)
 
         if response.status_code in (200, 201):
-            print(f'  ✓ {product["name"]} ({product["slug"]})')
-            success += 1
+            for product in batch:
+                print(f'  ✓ {product["name"]} ({product["slug"]})')
+            success += len(batch)
         else:
-            print(f'  ✗ {product["name"]}: {response.status_code} - {response.text}')
-            failed += 1
+            for product in batch:
+                print(f'  ✗ {product["name"]}')
+            print(f'    {response.status_code} - {response.text}')
+            failed += len(batch)
+
+    # Stream the CSV and push it in batches over one keep-alive connection,
+    # instead of a new connection and request per product
+    with requests.Session() as session:
+        session.headers.update({'xc-token': args.token})
+        session.mount('https://', HTTPAdapter(max_retries=RETRY))
+        batch = []
+        for row in iter_products(csv_path):
+            product = {
+                'name': row.get('name'),
+                'slug': row.get('slug'),
+                'price': parse_float(row.get('price')),
+                'compare_price': parse_float(row.get('compare_price')),
+                # Use the linked record field name with display value
+                'popups': args.popup_city_name,
+                'description': row.get('description') or None,
+                'category': row.get('category') or None,
+                'attendee_category': row.get('attendee_category') or None,
+                'start_date': row.get('start_date') or None,
+                'end_date': row.get('end_date') or None,
+                'is_active': parse_bool(row.get('is_active')),
+                'exclusive': parse_bool(row.get('exclusive')),
+            }
+
+            # Remove None values (NocoDB doesn't like explicit nulls for some fields)
+            product = {k: v for k, v in product.items() if v is not None}
+
+            if args.dry_run:
+                print(f'  Would push: {product["name"]} ({product["slug"]})')
+                continue
+
+            batch.append(product)
+            if len(batch) == BATCH_SIZE:
+                flush(session, batch)
+                batch = []
+        if batch:
+            flush(session, batch)
 
     if not args.dry_run:
         print(f'\nDone! {success} succeeded, {failed} failed')
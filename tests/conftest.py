@@ -1,16 +1,22 @@
 import asyncio
+import uuid
 from datetime import timedelta
+from functools import lru_cache
+from types import MappingProxyType
 from unittest.mock import Mock, patch
 
 import pytest
+import pytest_asyncio
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from app.api.citizens.models import Citizen
 from app.api.coupon_codes.models import CouponCode
 from app.api.groups.models import Group, GroupLeader
+from app.api.payments.models import Payment
 from app.api.popup_city.models import PopUpCity
 from app.api.webhooks.dependencies import get_webhook_cache
 from app.core.config import Environment, settings
@@ -20,6 +26,13 @@ from app.core.utils import current_time
 from main import app
 
 
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers',
+        'real_side_effects: skip the autouse webhook cache and email template mocks',
+    )
+
+
 @pytest.fixture(scope='session', autouse=True)
 def check_test_environment():
     if settings.ENVIRONMENT != Environment.TEST:
@@ -66,6 +79,17 @@ def test_db_engine():
         connect_args={'check_same_thread': False},
         poolclass=StaticPool,
     )
+
+    # pysqlite manages transactions itself and breaks SAVEPOINT; let
+    # SQLAlchemy emit BEGIN so each test can run inside one outer transaction
+    @event.listens_for(engine, 'connect')
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def _begin(conn):
+        conn.exec_driver_sql('BEGIN')
+
     Base.metadata.create_all(bind=engine)
     yield engine
     Base.metadata.drop_all(bind=engine)
@@ -73,26 +97,40 @@ def test_db_engine():
 
 @pytest.fixture(scope='function')
 def db_session(test_db_engine):
-    """Create a fresh database session for each test"""
-    TestingSessionLocal = sessionmaker(
-        autocommit=False, autoflush=False, bind=test_db_engine
+    """Run each test inside a transaction that is rolled back afterwards.
+
+    Commits made by the code under test only release a SAVEPOINT, so the schema
+    is created once per run instead of being rebuilt for every test.
+    """
+    connection = test_db_engine.connect()
+    transaction = connection.begin()
+    # Ids restart once the rows are rolled back, so caches keyed by id are stale
+    from app.core.payments_utils import clear_segment_cache
+
+    clear_segment_cache()
+
+    session = Session(
+        bind=connection,
+        autoflush=False,
+        join_transaction_mode='create_savepoint',
     )
-
-    # Drop and recreate all tables before each test
-    Base.metadata.drop_all(bind=test_db_engine)
-    Base.metadata.create_all(bind=test_db_engine)
-
-    session = TestingSessionLocal()
     try:
         yield session
     finally:
         session.close()
-        # Optionally, drop all tables after each test
-        # Base.metadata.drop_all(bind=test_db_engine)
+        transaction.rollback()
+        connection.close()
 
 
 @pytest.fixture(scope='function')
-def client(db_session):
+def app_overrides(db_session):
+    """Point the app's database dependencies at the test session.
+
+    Routes use db_session itself, so their commits expire the objects a test
+    holds and the next attribute access reloads them; refresh() is only
+    needed for rows changed through another session.
+    """
+
     def override_get_db():
         try:
             yield db_session
@@ -100,19 +138,78 @@ def client(db_session):
             pass
 
     app.dependency_overrides[get_db] = override_get_db
+    # Background tasks open their own session; join the test's transaction
+    background_session = sessionmaker(
+        autoflush=False,
+        bind=db_session.get_bind(),
+        join_transaction_mode='create_savepoint',
+    )
+    with (
+        patch('app.api.payments.crud.SessionLocal', background_session),
+        patch('app.api.webhooks.routes.SessionLocal', background_session),
+    ):
+        yield
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture(scope='session')
+def _shared_client():
     with TestClient(app) as test_client:
         yield test_client
-    app.dependency_overrides.clear()
 
 
-def get_auth_headers_for_citizen(citizen_id: int) -> dict:
-    """Generate auth headers for a specific citizen ID"""
+@pytest.fixture(scope='function')
+def client(_shared_client, app_overrides):
+    """Session-wide TestClient; per-test isolation comes from app_overrides"""
+    _shared_client.cookies.clear()
+    return _shared_client
+
+
+@pytest_asyncio.fixture(scope='session')
+async def _shared_async_client():
+    # The app's lifespan does nothing under the test environment, so the
+    # in-process transport can be reused without running it
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url='http://test'
+    ) as async_client:
+        yield async_client
+
+
+@pytest.fixture(scope='function')
+def async_client(_shared_async_client, app_overrides):
+    """In-process async client, without TestClient's per-test thread portal"""
+    return _shared_async_client
+
+
+@lru_cache
+def _access_token_for_citizen(citizen_id: int) -> str:
+    # Test tokens have no expiry, so each citizen id only needs signing once
     user_data = {
         'citizen_id': citizen_id,
         'email': f'test{citizen_id}@example.com',
     }
-    access_token = create_access_token(data=user_data)
-    return {'Authorization': f'Bearer {access_token}'}
+    return create_access_token(data=user_data)
+
+
+def get_auth_headers_for_citizen(citizen_id: int) -> dict:
+    """Generate auth headers for a specific citizen ID"""
+    return {'Authorization': f'Bearer {_access_token_for_citizen(citizen_id)}'}
+
+
+def make_approved_fee_payment(db_session, application_id: int, amount: float = 5.0):
+    """Insert an approved application fee payment without going through the API"""
+    payment = Payment(
+        application_id=application_id,
+        is_application_fee=True,
+        status='approved',
+        amount=amount,
+        currency='USD',
+        external_id=f'test_ext_{uuid.uuid4().hex}',
+    )
+    db_session.add(payment)
+    # Commit so loaded applications see the payment in their collection
+    db_session.commit()
+    return payment
 
 
 @pytest.fixture(scope='function')
@@ -301,7 +398,7 @@ def mock_webhook_cache():
     mock_cache.add.return_value = True  # Always treat webhooks as new
     app.dependency_overrides[get_webhook_cache] = lambda: mock_cache
     yield mock_cache
-    app.dependency_overrides.clear()
+    app.dependency_overrides.pop(get_webhook_cache, None)
 
 
 @pytest.fixture
@@ -316,6 +413,19 @@ def mock_email_template(monkeypatch):
     return mock_get_template
 
 
+@pytest.fixture(autouse=True)
+def mock_external_side_effects(request):
+    """Apply the webhook cache and email template mocks to every test.
+
+    Tests that need the real dedupe cache or template lookup opt out with
+    @pytest.mark.real_side_effects.
+    """
+    if request.node.get_closest_marker('real_side_effects'):
+        return
+    request.getfixturevalue('mock_webhook_cache')
+    request.getfixturevalue('mock_email_template')
+
+
 @pytest.fixture
 def mock_send_mail():
     with patch('app.api.email_logs.crud.send_mail') as mock:
@@ -324,19 +434,41 @@ def mock_send_mail():
 
 
 @pytest.fixture
-def mock_create_payment(mock_simplefi_response):
-    with patch('app.core.simplefi.create_payment') as mock:
-        mock.return_value = mock_simplefi_response
+def mock_send_batch():
+    with patch('app.api.email_logs.crud.send_batch') as mock:
+        mock.side_effect = lambda messages: [{'status': 'success'} for _ in messages]
         yield mock
 
 
+class FakeCreatePayment:
+    """Stand-in for simplefi.create_payment that records its calls in a list"""
+
+    def __init__(self, return_value):
+        self.return_value = return_value
+        self.calls = []
+
+    def __call__(self, amount, **kwargs):
+        self.calls.append((amount, kwargs))
+        return self.return_value
+
+
 @pytest.fixture
+def mock_create_payment(monkeypatch, mock_simplefi_response):
+    fake = FakeCreatePayment(mock_simplefi_response)
+    monkeypatch.setattr('app.core.simplefi.create_payment', fake)
+    return fake
+
+
+@pytest.fixture(scope='session')
 def mock_simplefi_response():
-    return {
-        'id': 'test_payment_id',
-        'status': 'pending',
-        'checkout_url': 'https://test.checkout.url',
-    }
+    # Shared by every test, so make it read-only
+    return MappingProxyType(
+        {
+            'id': 'test_payment_id',
+            'status': 'pending',
+            'checkout_url': 'https://test.checkout.url',
+        }
+    )
 
 
 @pytest.fixture(scope='function', autouse=True)
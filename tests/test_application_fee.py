@@ -1,9 +1,41 @@
+import copy
+
 import pytest
+import pytest_asyncio
 from fastapi import status
 
+from app.api.applications.models import Application
 from app.api.applications.schemas import ApplicationStatus
-from app.api.payments.models import Payment
-from tests.conftest import get_auth_headers_for_citizen
+from tests.conftest import get_auth_headers_for_citizen, make_approved_fee_payment
+
+_WEBHOOK_TEMPLATE = {
+    'id': 'test_fee_webhook',
+    'event_type': 'new_payment',
+    'entity_type': 'payment_request',
+    # entity_id and the payment request id are filled in per test
+    'entity_id': None,
+    'data': {
+        'payment_request': {
+            'id': None,
+            'order_id': 1,
+            'amount': 5.0,
+            'amount_paid': 5.0,
+            'currency': 'USD',
+            'reference': {},
+            'status': 'approved',
+            'status_detail': 'correct',
+            'transactions': [],
+            'card_payment': None,
+            'payments': [],
+        },
+        'new_payment': {
+            'coin': 'USD',
+            'hash': 'test_hash',
+            'amount': 5.0,
+            'paid_at': '2024-01-01T00:00:00Z',
+        },
+    },
+}
 
 
 @pytest.fixture
@@ -15,23 +47,25 @@ def fee_popup_city(test_popup_city, db_session):
     return test_popup_city
 
 
-@pytest.fixture
-def draft_application(client, test_application, auth_headers, db_session):
+@pytest_asyncio.fixture
+async def draft_application(async_client, test_application, auth_headers, db_session):
     """Create a draft application."""
-    response = client.post(
+    response = await async_client.post(
         '/applications/', json=test_application, headers=auth_headers
     )
     assert response.status_code == status.HTTP_201_CREATED
     return response.json()
 
 
-@pytest.fixture
-def draft_application_with_fee(
-    client, test_application, auth_headers, fee_popup_city, db_session
+@pytest_asyncio.fixture
+async def draft_application_with_fee(
+    async_client, test_application, auth_headers, fee_popup_city, db_session
 ):
     """Create a draft application when fee is required (auto-forced to draft)."""
     app_data = {**test_application, 'status': 'in review'}
-    response = client.post('/applications/', json=app_data, headers=auth_headers)
+    response = await async_client.post(
+        '/applications/', json=app_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_201_CREATED
     data = response.json()
     assert data['status'] == 'draft'
@@ -41,8 +75,9 @@ def draft_application_with_fee(
 # --- Happy path tests ---
 
 
-def test_create_application_fee_success(
-    client,
+@pytest.mark.asyncio
+async def test_create_application_fee_success(
+    async_client,
     auth_headers,
     draft_application,
     fee_popup_city,
@@ -50,7 +85,7 @@ def test_create_application_fee_success(
     db_session,
 ):
     """POST /payments/application-fee succeeds for draft app with fee configured."""
-    response = client.post(
+    response = await async_client.post(
         '/payments/application-fee',
         json={'application_id': draft_application['id']},
         headers=auth_headers,
@@ -67,8 +102,9 @@ def test_create_application_fee_success(
     assert data['products_snapshot'] == []
 
 
-def test_create_application_fee_cancels_pending(
-    client,
+@pytest.mark.asyncio
+async def test_create_application_fee_cancels_pending(
+    async_client,
     auth_headers,
     draft_application,
     fee_popup_city,
@@ -77,7 +113,7 @@ def test_create_application_fee_cancels_pending(
 ):
     """Creating a new fee payment cancels existing pending fee payments."""
     # Create first fee payment
-    response1 = client.post(
+    response1 = await async_client.post(
         '/payments/application-fee',
         json={'application_id': draft_application['id']},
         headers=auth_headers,
@@ -86,41 +122,40 @@ def test_create_application_fee_cancels_pending(
     first_payment_id = response1.json()['id']
 
     # Create second fee payment
-    response2 = client.post(
+    response2 = await async_client.post(
         '/payments/application-fee',
         json={'application_id': draft_application['id']},
         headers=auth_headers,
     )
     assert response2.status_code == status.HTTP_200_OK
-    second_payment_id = response2.json()['id']
 
     # Verify first payment was cancelled
-    first_payment = db_session.get(Payment, first_payment_id)
-    assert first_payment.status == 'cancelled'
+    first_payment = await async_client.get(
+        f'/payments/{first_payment_id}', headers=auth_headers
+    )
+    assert first_payment.json()['status'] == 'cancelled'
 
-    # Verify second payment is pending
-    second_payment = db_session.get(Payment, second_payment_id)
-    assert second_payment.status == 'pending'
+    # The second payment is returned as pending by the POST itself
+    assert response2.json()['status'] == 'pending'
 
 
 # --- Rejection tests ---
 
 
-def test_create_application_fee_not_draft(
-    client,
+@pytest.mark.asyncio
+async def test_create_application_fee_not_draft(
+    async_client,
     auth_headers,
     draft_application,
     fee_popup_city,
     db_session,
 ):
     """Reject if application is not in draft status."""
-    from app.api.applications.models import Application
-
     application = db_session.get(Application, draft_application['id'])
     application.status = ApplicationStatus.ACCEPTED.value
     db_session.commit()
 
-    response = client.post(
+    response = await async_client.post(
         '/payments/application-fee',
         json={'application_id': draft_application['id']},
         headers=auth_headers,
@@ -129,14 +164,15 @@ def test_create_application_fee_not_draft(
     assert response.json()['detail'] == 'Application must be in draft status'
 
 
-def test_create_application_fee_no_fee_configured(
-    client,
+@pytest.mark.asyncio
+async def test_create_application_fee_no_fee_configured(
+    async_client,
     auth_headers,
     draft_application,
     db_session,
 ):
     """Reject if popup city has no application fee."""
-    response = client.post(
+    response = await async_client.post(
         '/payments/application-fee',
         json={'application_id': draft_application['id']},
         headers=auth_headers,
@@ -148,30 +184,19 @@ def test_create_application_fee_no_fee_configured(
     )
 
 
-def test_create_application_fee_already_paid(
-    client,
+@pytest.mark.asyncio
+async def test_create_application_fee_already_paid(
+    async_client,
     auth_headers,
     draft_application,
     fee_popup_city,
-    mock_create_payment,
     db_session,
 ):
     """Reject if approved fee payment already exists."""
-    # Create and manually approve a fee payment
-    response = client.post(
-        '/payments/application-fee',
-        json={'application_id': draft_application['id']},
-        headers=auth_headers,
-    )
-    assert response.status_code == status.HTTP_200_OK
-    payment_id = response.json()['id']
-
-    payment = db_session.get(Payment, payment_id)
-    payment.status = 'approved'
-    db_session.commit()
+    make_approved_fee_payment(db_session, draft_application['id'])
 
     # Try to create another fee payment
-    response = client.post(
+    response = await async_client.post(
         '/payments/application-fee',
         json={'application_id': draft_application['id']},
         headers=auth_headers,
@@ -183,15 +208,16 @@ def test_create_application_fee_already_paid(
 # --- Fee-before-submit gate tests ---
 
 
-def test_submit_application_rejected_without_fee(
-    client,
+@pytest.mark.asyncio
+async def test_submit_application_rejected_without_fee(
+    async_client,
     auth_headers,
     draft_application_with_fee,
     fee_popup_city,
     db_session,
 ):
     """PUT /applications/{id} with status=in_review rejected when fee unpaid (402)."""
-    response = client.put(
+    response = await async_client.put(
         f'/applications/{draft_application_with_fee["id"]}',
         json={'status': 'in review'},
         headers=auth_headers,
@@ -200,39 +226,26 @@ def test_submit_application_rejected_without_fee(
     assert response.json()['detail'] == 'Application fee must be paid before submitting'
 
     # Verify application is still in draft (not persisted as in_review)
-    from app.api.applications.models import Application
-
     application = db_session.get(Application, draft_application_with_fee['id'])
     db_session.refresh(application)
     assert application.status == 'draft'
 
 
-def test_submit_application_succeeds_with_fee_paid(
-    client,
+@pytest.mark.asyncio
+async def test_submit_application_succeeds_with_fee_paid(
+    async_client,
     auth_headers,
     draft_application_with_fee,
     fee_popup_city,
-    mock_create_payment,
     mock_email_template,
     db_session,
 ):
     """PUT /applications/{id} with status=in_review succeeds when fee paid."""
-    # Create and approve fee payment
     app_id = draft_application_with_fee['id']
-    response = client.post(
-        '/payments/application-fee',
-        json={'application_id': app_id},
-        headers=auth_headers,
-    )
-    assert response.status_code == status.HTTP_200_OK
-    payment_id = response.json()['id']
-
-    payment = db_session.get(Payment, payment_id)
-    payment.status = 'approved'
-    db_session.commit()
+    make_approved_fee_payment(db_session, app_id)
 
     # Now submit the application
-    response = client.put(
+    response = await async_client.put(
         f'/applications/{app_id}',
         json={'status': 'in review'},
         headers=auth_headers,
@@ -241,8 +254,9 @@ def test_submit_application_succeeds_with_fee_paid(
     assert response.json()['status'] == 'in review'
 
 
-def test_application_created_with_in_review_forced_to_draft_when_fee_required(
-    client,
+@pytest.mark.asyncio
+async def test_application_created_with_in_review_forced_to_draft_when_fee_required(
+    async_client,
     auth_headers,
     fee_popup_city,
     test_citizen,
@@ -256,7 +270,7 @@ def test_application_created_with_in_review_forced_to_draft_when_fee_required(
         'popup_city_id': fee_popup_city.id,
         'status': 'in review',
     }
-    response = client.post(
+    response = await async_client.post(
         '/applications/',
         json=app_data,
         headers=auth_headers,
@@ -269,8 +283,9 @@ def test_application_created_with_in_review_forced_to_draft_when_fee_required(
 # --- Webhook integration test ---
 
 
-def test_webhook_approves_fee_and_submits_application(
-    client,
+@pytest.mark.asyncio
+async def test_webhook_approves_fee_and_submits_application(
+    async_client,
     auth_headers,
     draft_application,
     fee_popup_city,
@@ -284,7 +299,7 @@ def test_webhook_approves_fee_and_submits_application(
     app_id = draft_application['id']
 
     # Create fee payment
-    response = client.post(
+    response = await async_client.post(
         '/payments/application-fee',
         json={'application_id': app_id},
         headers=auth_headers,
@@ -293,53 +308,31 @@ def test_webhook_approves_fee_and_submits_application(
     payment = response.json()
 
     # Simulate webhook approval
-    webhook_data = {
-        'id': 'test_fee_webhook',
-        'event_type': 'new_payment',
-        'entity_type': 'payment_request',
-        'entity_id': payment['external_id'],
-        'data': {
-            'payment_request': {
-                'id': mock_simplefi_response['id'],
-                'order_id': 1,
-                'amount': 5.0,
-                'amount_paid': 5.0,
-                'currency': 'USD',
-                'reference': {},
-                'status': 'approved',
-                'status_detail': 'correct',
-                'transactions': [],
-                'card_payment': None,
-                'payments': [],
-            },
-            'new_payment': {
-                'coin': 'USD',
-                'hash': 'test_hash',
-                'amount': 5.0,
-                'paid_at': '2024-01-01T00:00:00Z',
-            },
-        },
-    }
+    webhook_data = copy.deepcopy(_WEBHOOK_TEMPLATE)
+    webhook_data['entity_id'] = payment['external_id']
+    webhook_data['data']['payment_request']['id'] = mock_simplefi_response['id']
 
-    response = client.post('/webhooks/simplefi', json=webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
     assert response.status_code == status.HTTP_200_OK
 
     # Verify payment was approved
-    payment_response = client.get(f'/payments/{payment["id"]}', headers=auth_headers)
+    payment_response = await async_client.get(
+        f'/payments/{payment["id"]}', headers=auth_headers
+    )
     assert payment_response.json()['status'] == 'approved'
     assert payment_response.json()['is_application_fee'] is True
 
     # Verify application was submitted (transitioned to in_review)
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, app_id)
-    db_session.refresh(application)
-    assert application.submitted_at is not None
-    assert application.status == 'in review'
+    application_response = await async_client.get(
+        f'/applications/{app_id}', headers=auth_headers
+    )
+    assert application_response.json()['submitted_at'] is not None
+    assert application_response.json()['status'] == 'in review'
 
 
-def test_application_response_fee_fields_when_required(
-    client,
+@pytest.mark.asyncio
+async def test_application_response_fee_fields_when_required(
+    async_client,
     auth_headers,
     draft_application_with_fee,
     fee_popup_city,
@@ -347,64 +340,57 @@ def test_application_response_fee_fields_when_required(
 ):
     """Application response includes fee_required=True and fee_paid=False."""
     app_id = draft_application_with_fee['id']
-    response = client.get(f'/applications/{app_id}', headers=auth_headers)
+    response = await async_client.get(f'/applications/{app_id}', headers=auth_headers)
     assert response.status_code == status.HTTP_200_OK
     data = response.json()
     assert data['application_fee_required'] is True
     assert data['application_fee_paid'] is False
 
 
-def test_application_response_fee_fields_when_paid(
-    client,
+@pytest.mark.asyncio
+async def test_application_response_fee_fields_when_paid(
+    async_client,
     auth_headers,
     draft_application_with_fee,
     fee_popup_city,
-    mock_create_payment,
     db_session,
 ):
     """Application response shows fee_paid=True after approval."""
     app_id = draft_application_with_fee['id']
 
-    # Create and approve fee payment
-    response = client.post(
-        '/payments/application-fee',
-        json={'application_id': app_id},
-        headers=auth_headers,
-    )
-    assert response.status_code == status.HTTP_200_OK
-    payment = db_session.get(Payment, response.json()['id'])
-    payment.status = 'approved'
-    db_session.commit()
+    make_approved_fee_payment(db_session, app_id)
 
-    response = client.get(f'/applications/{app_id}', headers=auth_headers)
+    response = await async_client.get(f'/applications/{app_id}', headers=auth_headers)
     data = response.json()
     assert data['application_fee_required'] is True
     assert data['application_fee_paid'] is True
 
 
-def test_application_response_fee_fields_when_not_required(
-    client,
+@pytest.mark.asyncio
+async def test_application_response_fee_fields_when_not_required(
+    async_client,
     auth_headers,
     draft_application,
     db_session,
 ):
     """Application response shows fee_required=False when no fee configured."""
     app_id = draft_application['id']
-    response = client.get(f'/applications/{app_id}', headers=auth_headers)
+    response = await async_client.get(f'/applications/{app_id}', headers=auth_headers)
     data = response.json()
     assert data['application_fee_required'] is False
     assert data['application_fee_paid'] is False
 
 
-def test_submit_application_without_fee_no_gate(
-    client,
+@pytest.mark.asyncio
+async def test_submit_application_without_fee_no_gate(
+    async_client,
     auth_headers,
     draft_application,
     mock_email_template,
     db_session,
 ):
     """Submitting application works normally when no fee is configured."""
-    response = client.put(
+    response = await async_client.put(
         f'/applications/{draft_application["id"]}',
         json={'status': 'in review'},
         headers=auth_headers,
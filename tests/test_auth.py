@@ -30,3 +30,36 @@ def test_expired_token(client):
     )
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
     assert response.json()['detail'] == 'Token has expired'
+
+
+def test_authenticate_third_party_api_key_cache(client, db_session, test_citizen):
+    from app.api.authorized_third_party_apps.crud import authorized_third_party_app
+    from app.api.authorized_third_party_apps.models import AuthorizedThirdPartyApp
+    from app.api.authorized_third_party_apps.schemas import (
+        AuthorizedThirdPartyAppUpdate,
+    )
+    from app.core.security import SYSTEM_TOKEN
+
+    authorized_third_party_app._api_key_cache.clear()
+    third_party_app = AuthorizedThirdPartyApp(name='Test App', api_key='test-key')
+    db_session.add(third_party_app)
+    db_session.commit()
+
+    headers = {'X-API-Key': 'test-key'}
+    data = {'email': test_citizen.primary_email}
+    response = client.post(
+        '/citizens/authenticate-third-party', json=data, headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    # Deactivating the app must invalidate the cached lookup
+    authorized_third_party_app.update(
+        db_session,
+        third_party_app.id,
+        AuthorizedThirdPartyAppUpdate(active=False),
+        SYSTEM_TOKEN,
+    )
+    response = client.post(
+        '/citizens/authenticate-third-party', json=data, headers=headers
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
@@ -0,0 +1,26 @@
+from unittest.mock import Mock, patch
+
+import httpx
+
+from app.api.email_logs.schemas import EmailStatus
+from app.core import mail
+from app.core.config import Environment, settings
+
+
+def test_send_batch_only_fails_the_failed_chunk(monkeypatch):
+    monkeypatch.setattr(settings, 'ENVIRONMENT', Environment.DEVELOP)
+    monkeypatch.setattr(mail, 'POSTMARK_BATCH_LIMIT', 2)
+    delivered = Mock()
+    delivered.json.return_value = [{'MessageID': 'a'}, {'MessageID': 'b'}]
+    messages = [{'To': f'user{i}@example.com'} for i in range(3)]
+
+    with patch.object(mail, 'http_client') as mock_http:
+        mock_http.post.side_effect = [delivered, httpx.ConnectError('down')]
+        results = mail.send_batch(messages)
+
+    assert [r['status'] for r in results] == [
+        EmailStatus.SUCCESS,
+        EmailStatus.SUCCESS,
+        EmailStatus.FAILED,
+    ]
+    assert results[2]['error'] == 'down'
@@ -1,55 +1,180 @@
+from types import MappingProxyType
+
 import pytest
-from fastapi import status
+from fastapi import HTTPException, status
+from sqlalchemy import event, insert, select, update
 
+from app.api.applications.models import Application
 from app.api.applications.schemas import ApplicationStatus
-from app.api.payments.models import Payment
-from app.api.payments.schemas import PaymentSource
+from app.api.attendees.models import Attendee, AttendeeProduct
+from app.api.groups.models import Group
+from app.api.payments.crud import payment as payment_crud
+from app.api.payments.models import Payment, PaymentProduct
+from app.api.payments.schemas import PaymentSource, PaymentUpdate
+from app.api.products.models import Product
+from app.api.webhooks.models import ProcessedWebhook
+from app.core.payments_utils import _calculate_price, _get_discounted_cents
+from app.core.security import TokenData
 from tests.conftest import get_auth_headers_for_citizen
 
+_OTHER_CITIZEN_HEADERS = get_auth_headers_for_citizen(999)
 
-@pytest.fixture
-def test_payment_data(test_application, client, auth_headers):
-    # First create an application
-    response = client.post(
-        '/applications/', json=test_application, headers=auth_headers
-    )
-    assert response.status_code == status.HTTP_201_CREATED
-    application = response.json()
-    application_id = application['id']
-
-    # Create an attendee
-    attendee_data = {
-        'name': 'Test Attendee',
-        'category': 'spouse',
-        'email': 'spouse@example.com',
+
+def _simplefi_response(payment_id):
+    """Pending payment request as returned by simplefi.create_payment"""
+    return {
+        'id': payment_id,
+        'status': 'pending',
+        'checkout_url': 'https://test.checkout.url',
+    }
+
+
+# Fields every test payment_request shares; the nested lists are tuples so
+# the constant cannot be mutated through a built webhook
+_BASE_PAYMENT_REQUEST = MappingProxyType(
+    {
+        'order_id': 1,
+        'amount': 100.0,
+        'amount_paid': 100.0,
+        'currency': 'USD',
+        'transactions': (),
+        'card_payment': None,
+        'payments': (),
+    }
+)
+
+
+def _payment_request_webhook(
+    entity_id,
+    *,
+    webhook_id='test_id',
+    event_type='new_payment',
+    request_id=None,
+    status='approved',
+    status_detail='correct',
+    installment_plan_id=None,
+    coin='USD',
+    amount=100.0,
+    tx_hash='test_hash',
+    paid_at='2024-01-01T00:00:00Z',
+):
+    """Build a SimpleFi payment_request webhook body"""
+    payment_request = {
+        **_BASE_PAYMENT_REQUEST,
+        'id': request_id or entity_id,
+        'reference': {},
+        'status': status,
+        'status_detail': status_detail,
     }
-    response = client.post(
-        f'/applications/{application_id}/attendees',
-        json=attendee_data,
-        headers=auth_headers,
+    if installment_plan_id:
+        payment_request['installment_plan_id'] = installment_plan_id
+    return {
+        'id': webhook_id,
+        'event_type': event_type,
+        'entity_type': 'payment_request',
+        'entity_id': entity_id,
+        'data': {
+            'payment_request': payment_request,
+            'new_payment': {
+                'coin': coin,
+                'hash': tx_hash,
+                'amount': amount,
+                'paid_at': paid_at,
+            },
+        },
+    }
+
+
+def _installment_plan_webhook(
+    plan_id, *, webhook_id, event_type, status, paid_installments_count
+):
+    """Build a SimpleFi installment_plan webhook body for a 3-installment plan"""
+    return {
+        'id': webhook_id,
+        'event_type': event_type,
+        'entity_type': 'installment_plan',
+        'entity_id': plan_id,
+        'merchant_id': 'merchant_abc',
+        'data': {
+            'installment_plan': {
+                'id': plan_id,
+                'status': status,
+                'paid_installments_count': paid_installments_count,
+                'number_of_installments': 3,
+                'user_email': 'test@example.com',
+                'payment_method': 'card',
+            }
+        },
+    }
+
+
+@pytest.fixture
+def test_payment_data(db_session, test_citizen, test_popup_city):
+    # Insert the application and its attendees directly; the endpoints that
+    # create them have their own tests
+    application = Application(
+        first_name='Test',
+        last_name='User',
+        email=test_citizen.primary_email,
+        citizen_id=test_citizen.id,
+        popup_city_id=test_popup_city.id,
+        _status=ApplicationStatus.IN_REVIEW.value,
     )
-    assert response.status_code == status.HTTP_200_OK
-    attendee = response.json()['attendees'][1]  # Index 1 is the spouse
+    main_attendee = Attendee(
+        application=application,
+        name='Test User',
+        category='main',
+        email=test_citizen.primary_email,
+        check_in_code='TCMAIN',
+    )
+    spouse = Attendee(
+        application=application,
+        name='Test Attendee',
+        category='spouse',
+        email='spouse@example.com',
+        check_in_code='TCSPOU',
+    )
+    db_session.add_all([application, main_attendee, spouse])
+    db_session.commit()
 
     return {
-        'application_id': application_id,
+        'application_id': application.id,
         'products': [
             {
                 'product_id': 1,
-                'attendee_id': attendee['id'],
+                'attendee_id': spouse.id,
                 'quantity': 1,
             }
         ],
     }
 
 
-def test_create_payment_unauthorized(client, test_payment_data):
-    response = client.post('/payments/', json=test_payment_data)
+@pytest.fixture
+def accepted_application(test_payment_data, db_session):
+    """Accept the test_payment_data application, with no discount or scholarship"""
+    db_session.execute(
+        update(Application)
+        .where(Application.id == test_payment_data['application_id'])
+        .values(
+            {
+                Application._status: ApplicationStatus.ACCEPTED.value,
+                Application.scholarship_request: False,
+                Application._discount_assigned: None,
+            }
+        )
+    )
+    return db_session.get(Application, test_payment_data['application_id'])
+
+
+@pytest.mark.asyncio
+async def test_create_payment_unauthorized(async_client, test_payment_data):
+    response = await async_client.post('/payments/', json=test_payment_data)
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
 
-def test_create_payment_zero_quantity_validation(
-    client,
+@pytest.mark.asyncio
+async def test_create_payment_zero_quantity_validation(
+    async_client,
     auth_headers,
     test_payment_data,
 ):
@@ -58,14 +183,15 @@ def test_create_payment_zero_quantity_validation(
         'products': [{**test_payment_data['products'][0], 'quantity': 0}],
     }
 
-    response = client.post(
+    response = await async_client.post(
         '/payments/', json=invalid_payment_data, headers=auth_headers
     )
     assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
 
 
-def test_create_payment_negative_quantity_validation(
-    client,
+@pytest.mark.asyncio
+async def test_create_payment_negative_quantity_validation(
+    async_client,
     auth_headers,
     test_payment_data,
 ):
@@ -74,29 +200,25 @@ def test_create_payment_negative_quantity_validation(
         'products': [{**test_payment_data['products'][0], 'quantity': -1}],
     }
 
-    response = client.post(
+    response = await async_client.post(
         '/payments/', json=invalid_payment_data, headers=auth_headers
     )
     assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
 
 
-def test_create_payment_success(
-    client,
+@pytest.mark.asyncio
+async def test_create_payment_success(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     db_session,
     mock_create_payment,
 ):
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
 
     data = response.json()
@@ -108,33 +230,51 @@ def test_create_payment_success(
     assert data['checkout_url'] is not None
 
     # Verify simplefi.create_payment was called with correct arguments
-    mock_create_payment.assert_called_once()
-    call_args = mock_create_payment.call_args
-    assert call_args.args[0] == data['amount']
-    assert 'reference' in call_args.kwargs
+    assert len(mock_create_payment.calls) == 1
+    amount, kwargs = mock_create_payment.calls[0]
+    assert amount == data['amount']
+    assert 'reference' in kwargs
 
 
-def test_create_payment_with_group_success(
-    client,
+@pytest.mark.asyncio
+async def test_create_payment_invalid_attendee(
+    async_client,
     auth_headers,
     test_payment_data,
-    test_application,
-    test_group,
+    accepted_application,
     test_products,
     db_session,
     mock_create_payment,
-    mock_email_template,
 ):
-    from app.api.applications.models import Application
+    invalid_payment_data = {
+        **test_payment_data,
+        'products': [{**test_payment_data['products'][0], 'attendee_id': 999}],
+    }
+    response = await async_client.post(
+        '/payments/', json=invalid_payment_data, headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()['detail'] == 'Invalid attendees'
+
 
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = 100
-    application.group_id = test_group.id
+@pytest.mark.asyncio
+async def test_create_payment_with_group_success(
+    async_client,
+    auth_headers,
+    test_payment_data,
+    accepted_application,
+    test_group,
+    test_products,
+    db_session,
+    mock_create_payment,
+):
+    accepted_application.discount_assigned = 100
+    accepted_application.group_id = test_group.id
     db_session.commit()
 
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
 
     data = response.json()
@@ -147,159 +287,147 @@ def test_create_payment_with_group_success(
     assert payment.group_id == test_group.id
 
 
-def test_create_payment_application_not_accepted(
-    client, auth_headers, test_payment_data
+@pytest.mark.asyncio
+async def test_create_payment_application_not_accepted(
+    async_client, auth_headers, test_payment_data
 ):
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_400_BAD_REQUEST
     assert response.json()['detail'] == 'Application is not accepted'
 
 
-def test_get_payments(
-    client,
+@pytest.mark.asyncio
+async def test_get_payments(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
     db_session,
 ):
     # First create a payment
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
-    create_response = client.post(
+    create_response = await async_client.post(
         '/payments/', json=test_payment_data, headers=auth_headers
     )
     assert create_response.status_code == status.HTTP_200_OK
 
     # Now get all payments
-    response = client.get('/payments/', headers=auth_headers)
+    response = await async_client.get('/payments/', headers=auth_headers)
     assert response.status_code == status.HTTP_200_OK
     data = response.json()
     assert len(data) == 1
     assert data[0]['application_id'] == test_payment_data['application_id']
 
 
-def test_get_payment_by_id(
-    client,
+@pytest.mark.asyncio
+async def test_get_payment_by_id(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
     db_session,
 ):
     # First create a payment
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
-    create_response = client.post(
+    create_response = await async_client.post(
         '/payments/', json=test_payment_data, headers=auth_headers
     )
     payment_id = create_response.json()['id']
 
-    response = client.get(f'/payments/{payment_id}', headers=auth_headers)
+    response = await async_client.get(f'/payments/{payment_id}', headers=auth_headers)
     assert response.status_code == status.HTTP_200_OK
     data = response.json()
     assert data['id'] == payment_id
 
 
-def test_get_payment_other_citizen(
-    client,
+@pytest.mark.asyncio
+async def test_get_payment_other_citizen(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
     db_session,
 ):
     # First create a payment
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
-    create_response = client.post(
+    create_response = await async_client.post(
         '/payments/', json=test_payment_data, headers=auth_headers
     )
     payment_id = create_response.json()['id']
 
     # Try to get payment with different citizen
-    other_headers = get_auth_headers_for_citizen(999)
-    response = client.get(f'/payments/{payment_id}', headers=other_headers)
+    response = await async_client.get(
+        f'/payments/{payment_id}', headers=_OTHER_CITIZEN_HEADERS
+    )
     assert response.status_code == status.HTTP_403_FORBIDDEN
 
 
-def test_create_payment_two_kids_same_ticket(
-    client,
+@pytest.mark.asyncio
+async def test_get_payment_not_found(async_client, auth_headers):
+    response = await async_client.get('/payments/999', headers=auth_headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_update_payment_other_citizen(
+    async_client,
     auth_headers,
-    test_application,  # Using the base application fixture
+    test_payment_data,
+    accepted_application,
     test_products,
-    db_session,
     mock_create_payment,
+    db_session,
 ):
-    """Test creating a payment with the same ticket for two different kids."""
-    from app.api.applications.models import Application
-    from app.api.products.models import Product
-
-    # --- 1. Create and Accept Application ---
-    response = client.post(
-        '/applications/', json=test_application, headers=auth_headers
-    )
-    assert response.status_code == status.HTTP_201_CREATED
-    application_data = response.json()
-    application_id = application_data['id']
-
-    # Mark application as accepted
-    application = db_session.get(Application, application_id)
-    assert application is not None
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-    db_session.refresh(application)
-
-    # --- 2. Add Two Kid Attendees ---
-    kid1_data = {'name': 'Kid One', 'category': 'kid', 'age': 10}
-    response = client.post(
-        f'/applications/{application_id}/attendees',
-        json=kid1_data,
-        headers=auth_headers,
-    )
-    assert response.status_code == status.HTTP_200_OK
-    updated_application = response.json()
-    kid1_id = next(
-        att['id']
-        for att in updated_application['attendees']
-        if att['name'] == 'Kid One'
+    create_response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
     )
+    payment_id = create_response.json()['id']
 
-    kid2_data = {'name': 'Kid Two', 'category': 'kid', 'age': 12}
-    response = client.post(
-        f'/applications/{application_id}/attendees',
-        json=kid2_data,
-        headers=auth_headers,
+    other_citizen = TokenData(citizen_id=999, email='other@example.com')
+    with pytest.raises(HTTPException) as exc_info:
+        payment_crud.update(
+            db_session, payment_id, PaymentUpdate(status='approved'), other_citizen
+        )
+
+    assert exc_info.value.status_code == status.HTTP_403_FORBIDDEN
+    assert db_session.get(Payment, payment_id).status == 'pending'
+
+
+@pytest.mark.asyncio
+async def test_create_payment_two_kids_same_ticket(
+    async_client,
+    auth_headers,
+    accepted_application,
+    test_products,
+    db_session,
+    mock_create_payment,
+):
+    """Test creating a payment with the same ticket for two different kids."""
+    application_id = accepted_application.id
+
+    # --- 1. Add Two Kid Attendees ---
+    kid1 = Attendee(
+        application_id=application_id,
+        name='Kid One',
+        category='kid',
+        check_in_code='TCKID1',
     )
-    assert response.status_code == status.HTTP_200_OK
-    updated_application = response.json()
-    kid2_id = next(
-        att['id']
-        for att in updated_application['attendees']
-        if att['name'] == 'Kid Two'
+    kid2 = Attendee(
+        application_id=application_id,
+        name='Kid Two',
+        category='kid',
+        check_in_code='TCKID2',
     )
+    db_session.add_all([kid1, kid2])
+    db_session.flush()
+    kid1_id, kid2_id = kid1.id, kid2.id
 
-    # --- 3. Define Payment Payload ---
+    # --- 2. Define Payment Payload ---
     kid_product_id = 2  # Assuming product ID 2 is for kids
     payment_data = {
         'application_id': application_id,
@@ -309,11 +437,13 @@ def test_create_payment_two_kids_same_ticket(
         ],
     }
 
-    # --- 4. Create Payment ---
-    response = client.post('/payments/', json=payment_data, headers=auth_headers)
+    # --- 3. Create Payment ---
+    response = await async_client.post(
+        '/payments/', json=payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
 
-    # --- 5. Assertions ---
+    # --- 4. Assertions ---
     data = response.json()
     assert data['application_id'] == application_id
     assert data['status'] == 'pending'
@@ -327,354 +457,525 @@ def test_create_payment_two_kids_same_ticket(
     assert data['amount'] == expected_amount
 
     # Verify simplefi.create_payment mock call
-    mock_create_payment.assert_called_once()
-    call_args = mock_create_payment.call_args
-    assert call_args.args[0] == expected_amount
-    assert 'reference' in call_args.kwargs
-
-
-def test_simplefi_webhook_payment_approval(
-    client,
+    assert len(mock_create_payment.calls) == 1
+    amount, kwargs = mock_create_payment.calls[0]
+    assert amount == expected_amount
+    assert 'reference' in kwargs
+
+
+@pytest.mark.parametrize(
+    'webhook_status,status_detail,coin,expected_source',
+    [
+        ('approved', 'correct', 'ETH', PaymentSource.SIMPLEFI.value),
+        ('expired', 'not_paid', 'USD', None),
+    ],
+)
+@pytest.mark.asyncio
+async def test_simplefi_webhook_payment_status(
+    webhook_status,
+    status_detail,
+    coin,
+    expected_source,
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
     mock_simplefi_response,
-    mock_webhook_cache,
-    mock_email_template,
     db_session,
 ):
     # First create a payment
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
-    create_response = client.post(
+    create_response = await async_client.post(
         '/payments/', json=test_payment_data, headers=auth_headers
     )
+    assert create_response.status_code == status.HTTP_200_OK
     payment = create_response.json()
 
-    webhook_data = {
-        'id': 'test_id',
-        'event_type': 'new_payment',
-        'entity_type': 'payment_request',
-        'entity_id': payment['external_id'],
-        'data': {
-            'payment_request': {
-                'id': mock_simplefi_response['id'],
-                'order_id': 1,
-                'amount': 100.0,
-                'amount_paid': 100.0,
-                'currency': 'USD',
-                'reference': {},
-                'status': 'approved',
-                'status_detail': 'correct',
-                'transactions': [],
-                'card_payment': None,
-                'payments': [],
-            },
-            'new_payment': {
-                'coin': 'ETH',
-                'hash': 'test_hash',
-                'amount': payment['amount'],
-                'paid_at': '2024-01-01T00:00:00Z',
-            },
-        },
-    }
+    webhook_data = _payment_request_webhook(
+        payment['external_id'],
+        request_id=mock_simplefi_response['id'],
+        status=webhook_status,
+        status_detail=status_detail,
+        coin=coin,
+        amount=payment['amount'],
+    )
 
-    response = client.post('/webhooks/simplefi', json=webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
     assert response.status_code == status.HTTP_200_OK
 
-    # Verify payment was approved
-    payment_response = client.get(f'/payments/{payment["id"]}', headers=auth_headers)
-    assert payment_response.json()['status'] == 'approved'
-    assert payment_response.json()['source'] == PaymentSource.SIMPLEFI.value
+    # Verify the payment took the webhook's status
+    payment_response = await async_client.get(
+        f'/payments/{payment["id"]}', headers=auth_headers
+    )
+    assert payment_response.json()['status'] == webhook_status
+    assert payment_response.json()['source'] == expected_source
 
 
-def test_simplefi_webhook_payment_expired(
-    client,
+@pytest.mark.asyncio
+async def test_simplefi_webhook_invalid_event_type(
+    async_client,
+    mock_simplefi_response,
+):
+    webhook_data = _payment_request_webhook(
+        '123',
+        event_type='invalid_event_type',
+        request_id=mock_simplefi_response['id'],
+        status='expired',
+        status_detail='not_paid',
+    )
+
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['message'] == 'Event type invalid_event_type not handled'
+
+
+@pytest.mark.asyncio
+async def test_use_coupon_code(
+    async_client,
     auth_headers,
+    test_coupon_code,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
-    mock_simplefi_response,
-    mock_webhook_cache,
     db_session,
 ):
-    # First create a payment
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
+    test_coupon_code.current_uses = 0
+    test_coupon_code.max_uses = 1
+    test_coupon_code.discount_value = 100
     db_session.commit()
 
-    create_response = client.post(
+    assert accepted_application.popup_city_id == test_coupon_code.popup_city_id
+    test_payment_data['coupon_code'] = test_coupon_code.code
+
+    response = await async_client.post(
         '/payments/', json=test_payment_data, headers=auth_headers
     )
-    assert create_response.status_code == status.HTTP_200_OK
-    payment = create_response.json()
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['status'] == 'approved'
 
-    webhook_data = {
-        'id': 'test_id',
-        'event_type': 'new_payment',
-        'entity_type': 'payment_request',
-        'entity_id': payment['external_id'],
-        'data': {
-            'payment_request': {
-                'id': mock_simplefi_response['id'],
-                'order_id': 1,
-                'amount': 100.0,
-                'amount_paid': 100.0,
-                'currency': 'USD',
-                'reference': {},
-                'status': 'expired',
-                'status_detail': 'not_paid',
-                'transactions': [],
-                'card_payment': None,
-                'payments': [],
-            },
-            'new_payment': {
-                'coin': 'USD',
-                'hash': 'test_hash',
-                'amount': payment['amount'],
-                'paid_at': '2024-01-01T00:00:00Z',
-            },
-        },
-    }
+    # Verify discount code was used
+    assert test_coupon_code.current_uses == 1
 
-    response = client.post('/webhooks/simplefi', json=webhook_data)
+
+async def _approve_payment(client, payment, mock_simplefi_response):
+    webhook_data = _payment_request_webhook(
+        payment['external_id'],
+        request_id=mock_simplefi_response['id'],
+        coin='ETH',
+        amount=payment['amount'],
+    )
+
+    response = await client.post('/webhooks/simplefi', json=webhook_data)
+    assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.asyncio
+async def test_payment_confirmed_email_sent_after_response(
+    async_client,
+    auth_headers,
+    test_payment_data,
+    accepted_application,
+    test_products,
+    mock_create_payment,
+    mock_send_mail,
+    db_session,
+):
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
 
-    # Verify payment was expired
-    payment_response = client.get(f'/payments/{payment["id"]}', headers=auth_headers)
-    assert payment_response.json()['status'] == 'expired'
+    await _approve_payment(
+        async_client, response.json(), mock_create_payment.return_value
+    )
+
+    templates = [c.kwargs['template'] for c in mock_send_mail.call_args_list]
+    assert 'payment-confirmed' in templates
+    payment_confirmed = mock_send_mail.call_args_list[
+        templates.index('payment-confirmed')
+    ]
+    attachment = payment_confirmed.kwargs['attachments'][0]
+    assert attachment.name == f'invoice_{response.json()["id"]}.pdf'
+
+
+def _racing_approve_payment(monkeypatch, races):
+    """Make approve_payment lose `races` races against another worker"""
+    approve_payment = payment_crud.approve_payment
+    calls = []
+
+    def _approve(db, payment, **kwargs):
+        calls.append(payment.id)
+        if len(calls) <= races:
+            # Another worker commits a change to the row before this one flushes
+            db.execute(
+                update(Payment)
+                .where(Payment.id == payment.id)
+                .values(version=Payment.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+        return approve_payment(db, payment, **kwargs)
+
+    monkeypatch.setattr(payment_crud, 'approve_payment', _approve)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_simplefi_webhook_retries_stale_payment(
+    async_client,
+    auth_headers,
+    test_payment_data,
+    accepted_application,
+    test_products,
+    mock_create_payment,
+    monkeypatch,
+    db_session,
+):
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
+    payment = response.json()
+    calls = _racing_approve_payment(monkeypatch, races=1)
+
+    await _approve_payment(async_client, payment, mock_create_payment.return_value)
 
+    assert calls == [payment['id'], payment['id']]
+    db_payment = db_session.get(Payment, payment['id'])
+    assert db_payment.status == 'approved'
+    assert _assigned_products(db_session, accepted_application.id) == {(2, 1): 1}
 
-def test_simplefi_webhook_invalid_event_type(
-    client,
-    mock_simplefi_response,
+
+@pytest.mark.asyncio
+async def test_simplefi_webhook_gives_up_on_stale_payment(
+    async_client,
+    auth_headers,
+    test_payment_data,
+    accepted_application,
+    test_products,
+    mock_create_payment,
     mock_webhook_cache,
+    monkeypatch,
+    db_session,
 ):
-    webhook_data = {
-        'id': 'test_id',
-        'event_type': 'invalid_event_type',
-        'entity_type': 'payment_request',
-        'entity_id': '123',
-        'data': {
-            'payment_request': {
-                'id': mock_simplefi_response['id'],
-                'order_id': 1,
-                'amount': 100.0,
-                'amount_paid': 100.0,
-                'currency': 'USD',
-                'reference': {},
-                'status': 'expired',
-                'status_detail': 'not_paid',
-                'transactions': [],
-                'card_payment': None,
-                'payments': [],
-            },
-            'new_payment': {
-                'coin': 'USD',
-                'hash': 'test_hash',
-                'amount': 100.0,
-                'paid_at': '2024-01-01T00:00:00Z',
-            },
-        },
-    }
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
+    payment = response.json()
+    _racing_approve_payment(monkeypatch, races=3)
 
-    response = client.post('/webhooks/simplefi', json=webhook_data)
-    assert response.status_code == status.HTTP_200_OK
-    assert response.json()['message'] == 'Event type invalid_event_type not handled'
+    webhook_data = _payment_request_webhook(
+        payment['external_id'],
+        request_id=mock_create_payment.return_value['id'],
+        coin='ETH',
+        amount=payment['amount'],
+    )
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+    # SimpleFi's redelivery must not be skipped as already processed
+    mock_webhook_cache.discard.assert_called_once()
+    assert db_session.get(Payment, payment['id']).status == 'pending'
 
 
-def test_use_coupon_code(
-    client,
+@pytest.mark.asyncio
+async def test_simplefi_webhook_dedupes_across_workers(
+    async_client,
     auth_headers,
-    test_coupon_code,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
-    mock_email_template,
     db_session,
 ):
-    test_coupon_code.current_uses = 0
-    test_coupon_code.max_uses = 1
-    test_coupon_code.discount_value = 100
+    """A redelivery another worker's cache has not seen is still skipped."""
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
+    payment = response.json()
+    await _approve_payment(async_client, payment, mock_create_payment.return_value)
+    # Simulate a later change, so reprocessing the webhook would be visible
+    db_session.get(Payment, payment['id']).status = 'expired'
     db_session.commit()
 
-    # First create a payment
-    from app.api.applications.models import Application
+    webhook_data = _payment_request_webhook(
+        payment['external_id'],
+        request_id=mock_create_payment.return_value['id'],
+        coin='ETH',
+        amount=payment['amount'],
+    )
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
 
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
+    assert response.json()['message'] == 'Webhook already processed'
+    assert db_session.get(Payment, payment['id']).status == 'expired'
 
-    assert application.popup_city_id == test_coupon_code.popup_city_id
-    test_payment_data['coupon_code'] = test_coupon_code.code
 
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
-    assert response.status_code == status.HTTP_200_OK
-    assert response.json()['status'] == 'approved'
+@pytest.mark.asyncio
+async def test_simplefi_webhook_claims_no_op_delivery(
+    async_client,
+    auth_headers,
+    test_payment_data,
+    accepted_application,
+    test_products,
+    mock_create_payment,
+    db_session,
+):
+    """A delivery that changes nothing is still recorded as processed."""
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
+    payment = response.json()
+    webhook_data = _payment_request_webhook(
+        payment['external_id'],
+        request_id=mock_create_payment.return_value['id'],
+        status='pending',
+    )
 
-    # Verify discount code was used
-    assert test_coupon_code.current_uses == 1
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
+    assert response.json()['message'] == (
+        'Payment status is the same as payment request status'
+    )
+    # Drop anything the handler left uncommitted
+    db_session.rollback()
+    assert db_session.scalars(select(ProcessedWebhook)).one()
 
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
+    assert response.json()['message'] == 'Webhook already processed'
 
-def _approve_payment(client, payment, mock_simplefi_response):
-    webhook_data = {
-        'id': 'test_id',
-        'event_type': 'new_payment',
-        'entity_type': 'payment_request',
-        'entity_id': payment['external_id'],
-        'data': {
-            'payment_request': {
-                'id': mock_simplefi_response['id'],
-                'order_id': 1,
-                'amount': 100.0,
-                'amount_paid': 100.0,
-                'currency': 'USD',
-                'reference': {},
-                'status': 'approved',
-                'status_detail': 'correct',
-                'transactions': [],
-                'card_payment': None,
-                'payments': [],
-            },
-            'new_payment': {
-                'coin': 'ETH',
-                'hash': 'test_hash',
-                'amount': payment['amount'],
-                'paid_at': '2024-01-01T00:00:00Z',
-            },
-        },
-    }
 
-    response = client.post('/webhooks/simplefi', json=webhook_data)
-    assert response.status_code == status.HTTP_200_OK
+@pytest.mark.real_side_effects
+@pytest.mark.asyncio
+async def test_simplefi_webhook_handles_later_event_for_same_request(
+    async_client,
+    auth_headers,
+    test_payment_data,
+    accepted_application,
+    test_products,
+    mock_create_payment,
+    mock_email_template,
+    db_session,
+):
+    """A new event for an already seen payment request is not a redelivery."""
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
+    payment = response.json()
+    request_id = mock_create_payment.return_value['id']
+
+    pending = _payment_request_webhook(
+        payment['external_id'],
+        webhook_id='evt-1',
+        request_id=request_id,
+        status='pending',
+    )
+    response = await async_client.post('/webhooks/simplefi', json=pending)
+    assert response.json()['message'] == (
+        'Payment status is the same as payment request status'
+    )
+
+    approved = _payment_request_webhook(
+        payment['external_id'],
+        webhook_id='evt-2',
+        request_id=request_id,
+        coin='ETH',
+        amount=payment['amount'],
+    )
+    response = await async_client.post('/webhooks/simplefi', json=approved)
+    assert response.json()['message'] == 'Payment status updated successfully'
+    assert db_session.get(Payment, payment['id']).status == 'approved'
 
 
-def test_edit_passes_payment(
-    client,
+@pytest.mark.asyncio
+async def test_payment_approval_commits_ambassador_group_once(
+    async_client,
     auth_headers,
     test_payment_data,
-    test_application,
+    accepted_application,
     test_products,
     mock_create_payment,
-    mock_webhook_cache,
-    mock_email_template,
     db_session,
 ):
-    from app.api.applications.models import Application
+    accepted_application.popup_city.slug = 'edge-patagonia'
+    db_session.commit()
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
 
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    application.credit = 0
+    commits = []
+    on_commit = commits.append
+    event.listen(db_session, 'after_commit', on_commit)
+    try:
+        await _approve_payment(
+            async_client, response.json(), mock_create_payment.return_value
+        )
+    finally:
+        event.remove(db_session, 'after_commit', on_commit)
 
-    mock_response = {
-        'id': 'sf1',
-        'status': 'pending',
-        'checkout_url': 'https://test.checkout.url',
-    }
-    mock_create_payment.return_value = mock_response
+    assert len(commits) == 1
+    group = db_session.scalars(
+        select(Group).where(Group.ambassador_id == accepted_application.citizen_id)
+    ).one()
+    assert [leader.id for leader in group.leaders] == [accepted_application.citizen_id]
 
-    # Create initial payment
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
-    assert response.status_code == status.HTTP_200_OK
 
-    _approve_payment(client, response.json(), mock_response)
+@pytest.mark.asyncio
+@pytest.mark.parametrize('installment_plan_id', [None, 'installment_plan_reload'])
+async def test_payment_webhook_does_not_reload_after_commit(
+    installment_plan_id,
+    async_client,
+    auth_headers,
+    test_payment_data,
+    accepted_application,
+    test_products,
+    mock_create_payment,
+    db_session,
+):
+    if installment_plan_id:
+        mock_create_payment.return_value = _simplefi_response(installment_plan_id)
+        test_payment_data['installments'] = 3
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
+    payment = response.json()
+    db_payment = db_session.get(Payment, payment['id'])
+    if installment_plan_id:
+        # A later installment: nothing reloads the payment to approve it
+        db_payment.is_installment_plan = True
+        db_payment.installments_paid = 1
+        db_payment.status = 'approved'
+        db_session.commit()
+        webhook_data = _payment_request_webhook(
+            'payment_req_reload', installment_plan_id=installment_plan_id
+        )
+    else:
+        webhook_data = _payment_request_webhook(
+            payment['external_id'],
+            request_id=mock_create_payment.return_value['id'],
+            coin='ETH',
+            amount=payment['amount'],
+        )
 
-    mock_response['id'] = 'sf2'
+    statements = []
+
+    def on_commit(session):
+        statements.clear()
+
+    def on_execute(state):
+        statements.append(state.statement)
+
+    event.listen(db_session, 'after_commit', on_commit)
+    event.listen(db_session, 'do_orm_execute', on_execute)
+    try:
+        response = await async_client.post('/webhooks/simplefi', json=webhook_data)
+    finally:
+        event.remove(db_session, 'after_commit', on_commit)
+        event.remove(db_session, 'do_orm_execute', on_execute)
 
-    # Create edit passes payment
-    edit_payment_data = test_payment_data.copy()
-    edit_payment_data['edit_passes'] = True
-    edit_payment_data['products'] = [
-        {
-            'product_id': 2,
-            'attendee_id': 1,
-            'quantity': 1,
-        }
-    ]
-    response = client.post('/payments/', json=edit_payment_data, headers=auth_headers)
     assert response.status_code == status.HTTP_200_OK
-    assert response.json()['status'] == 'pending'
+    # Queuing the confirmation email and analytics reads what was just written
+    assert statements == []
+    assert db_session.expire_on_commit
+    # Skipping the reload is only safe if the loaded payment matches the row
+    assert db_payment.status == 'approved'
+    assert (db_payment.installments_paid, db_payment.version) == _payment_row(
+        db_session, payment['id']
+    )
+    if installment_plan_id:
+        assert db_payment.installments_paid == 2
 
-    _approve_payment(client, response.json(), mock_response)
 
-    payment = client.get(f'/payments/{response.json()["id"]}', headers=auth_headers)
-    assert payment.json()['status'] == 'approved'
-    # Verify application state
-    db_session.refresh(application)
-    assert application.credit == 0
-    for attendee in application.attendees:
-        if attendee.id == 1:
-            assert len(attendee.attendee_products) == 1
-            assert attendee.attendee_products[0].product_id == 2
-            assert attendee.attendee_products[0].quantity == 1
-        else:
-            assert len(attendee.attendee_products) == 0
+def _assigned_products(db_session, application_id):
+    """Map (attendee_id, product_id) to quantity for an application's attendees"""
+    rows = db_session.execute(
+        select(
+            AttendeeProduct.attendee_id,
+            AttendeeProduct.product_id,
+            AttendeeProduct.quantity,
+        )
+        .join(Attendee, Attendee.id == AttendeeProduct.attendee_id)
+        .where(Attendee.application_id == application_id)
+    )
+    return {(attendee_id, product_id): qty for attendee_id, product_id, qty in rows}
 
 
-def test_edit_passes_payment_cheaper_product(
-    client,
+@pytest.mark.asyncio
+async def test_edit_passes_payment(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_application,
     test_products,
     mock_create_payment,
-    mock_webhook_cache,
-    mock_email_template,
     db_session,
 ):
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    initial_credit = 10
-    application.credit = initial_credit
+    application = accepted_application
+    application.credit = 0
 
-    mock_response = {
-        'id': 'sf1',
-        'status': 'pending',
-        'checkout_url': 'https://test.checkout.url',
-    }
-    mock_create_payment.return_value = mock_response
+    # The passes bought earlier; only the edit goes through the API
+    db_session.execute(
+        insert(AttendeeProduct),
+        [
+            {'attendee_id': p['attendee_id'], 'product_id': p['product_id']}
+            for p in test_payment_data['products']
+        ],
+    )
+    mock_create_payment.return_value = _simplefi_response('sf2')
 
-    product_1 = test_products[0]
-    product_2 = test_products[1]
-    test_payment_data['products'] = [
-        {
-            'product_id': product_1.id,
-            'attendee_id': 1,
-            'quantity': 1,
-        },
+    # Create edit passes payment
+    edit_payment_data = test_payment_data.copy()
+    edit_payment_data['edit_passes'] = True
+    edit_payment_data['products'] = [
         {
-            'product_id': product_2.id,
+            'product_id': 2,
             'attendee_id': 1,
             'quantity': 1,
-        },
+        }
     ]
-
-    # Create initial payment
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=edit_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
     assert response.json()['status'] == 'pending'
-    _approve_payment(client, response.json(), mock_response)
 
-    mock_response['id'] = 'sf2'
+    await _approve_payment(
+        async_client, response.json(), mock_create_payment.return_value
+    )
+
+    payment = await async_client.get(
+        f'/payments/{response.json()["id"]}', headers=auth_headers
+    )
+    assert payment.json()['status'] == 'approved'
+    # Verify application state
+    assert application.credit == 0
+    assert _assigned_products(db_session, application.id) == {(1, 2): 1}
+
+
+@pytest.mark.asyncio
+async def test_edit_passes_payment_cheaper_product(
+    async_client,
+    auth_headers,
+    test_payment_data,
+    accepted_application,
+    test_application,
+    test_products,
+    mock_create_payment,
+    db_session,
+):
+    application = accepted_application
+    initial_credit = 10
+    application.credit = initial_credit
+
+    product_1 = test_products[0]
+    product_2 = test_products[1]
+    # The passes bought earlier; only the edit goes through the API
+    db_session.execute(
+        insert(AttendeeProduct),
+        [
+            {'attendee_id': 1, 'product_id': product_1.id},
+            {'attendee_id': 1, 'product_id': product_2.id},
+        ],
+    )
 
     # Create edit passes payment
     edit_payment_data = test_payment_data.copy()
@@ -686,52 +987,36 @@ def test_edit_passes_payment_cheaper_product(
             'quantity': 1,
         }
     ]
-    response = client.post('/payments/', json=edit_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=edit_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
     payment = response.json()
 
     assert payment['status'] == 'approved'
     # Verify application state
-    db_session.refresh(application)
     assert application.credit == initial_credit + product_2.price
-    for attendee in application.attendees:
-        if attendee.id == 1:
-            assert len(attendee.attendee_products) == 1
-            assert attendee.attendee_products[0].product_id == product_1.id
-            assert attendee.attendee_products[0].quantity == 1
-        else:
-            assert len(attendee.attendee_products) == 0
+    assert _assigned_products(db_session, application.id) == {(1, product_1.id): 1}
 
 
-def test_simplefi_installment_plan_completed_webhook(
-    client,
+@pytest.mark.asyncio
+async def test_simplefi_installment_plan_completed_webhook(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
-    mock_webhook_cache,
-    mock_email_template,
     db_session,
 ):
     """Test that installment_plan_completed webhook approves payment."""
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
     # Create a payment with installments
-    mock_response = {
-        'id': 'installment_plan_123',
-        'status': 'pending',
-        'checkout_url': 'https://test.checkout.url',
-    }
-    mock_create_payment.return_value = mock_response
+    mock_create_payment.return_value = _simplefi_response('installment_plan_123')
 
     test_payment_data['installments'] = 3
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
     payment = response.json()
 
@@ -742,62 +1027,46 @@ def test_simplefi_installment_plan_completed_webhook(
     db_session.commit()
 
     # Send installment_plan_completed webhook
-    webhook_data = {
-        'id': 'webhook_123',
-        'event_type': 'installment_plan_completed',
-        'entity_type': 'installment_plan',
-        'entity_id': 'installment_plan_123',
-        'merchant_id': 'merchant_abc',
-        'data': {
-            'installment_plan': {
-                'id': 'installment_plan_123',
-                'status': 'completed',
-                'paid_installments_count': 3,
-                'number_of_installments': 3,
-                'user_email': 'test@example.com',
-                'payment_method': 'card',
-            }
-        },
-    }
+    webhook_data = _installment_plan_webhook(
+        'installment_plan_123',
+        webhook_id='webhook_123',
+        event_type='installment_plan_completed',
+        status='completed',
+        paid_installments_count=3,
+    )
 
-    response = client.post('/webhooks/simplefi', json=webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
     assert response.status_code == status.HTTP_200_OK
     assert (
         response.json()['message'] == 'Installment plan payment approved successfully'
     )
 
     # Verify payment was approved
-    payment_response = client.get(f'/payments/{payment["id"]}', headers=auth_headers)
+    payment_response = await async_client.get(
+        f'/payments/{payment["id"]}', headers=auth_headers
+    )
     assert payment_response.json()['status'] == 'approved'
     assert payment_response.json()['installments_paid'] == 3
 
 
-def test_simplefi_installment_webhook_duplicate(
-    client,
+@pytest.mark.real_side_effects
+@pytest.mark.asyncio
+async def test_simplefi_installment_webhook_duplicate(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
     mock_email_template,
     db_session,
 ):
     """Test that duplicate installment webhooks are rejected."""
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
-    mock_response = {
-        'id': 'installment_plan_456',
-        'status': 'pending',
-        'checkout_url': 'https://test.checkout.url',
-    }
-    mock_create_payment.return_value = mock_response
+    mock_create_payment.return_value = _simplefi_response('installment_plan_456')
 
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
     payment = response.json()
 
@@ -806,87 +1075,58 @@ def test_simplefi_installment_webhook_duplicate(
     db_payment.installments_total = 3
     db_session.commit()
 
-    webhook_data = {
-        'id': 'webhook_456',
-        'event_type': 'installment_plan_completed',
-        'entity_type': 'installment_plan',
-        'entity_id': 'installment_plan_456',
-        'data': {
-            'installment_plan': {
-                'id': 'installment_plan_456',
-                'status': 'completed',
-                'paid_installments_count': 3,
-                'number_of_installments': 3,
-                'user_email': 'test@example.com',
-                'payment_method': 'card',
-            }
-        },
-    }
+    webhook_data = _installment_plan_webhook(
+        'installment_plan_456',
+        webhook_id='webhook_456',
+        event_type='installment_plan_completed',
+        status='completed',
+        paid_installments_count=3,
+    )
 
     # First webhook should succeed
-    response = client.post('/webhooks/simplefi', json=webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
     assert response.status_code == status.HTTP_200_OK
 
     # Second webhook should be marked as duplicate
-    response = client.post('/webhooks/simplefi', json=webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
     assert response.status_code == status.HTTP_200_OK
     assert response.json()['message'] == 'Webhook already processed'
 
 
-def test_simplefi_installment_webhook_payment_not_found(
-    client,
-    mock_webhook_cache,
+@pytest.mark.asyncio
+async def test_simplefi_installment_webhook_payment_not_found(
+    async_client,
 ):
     """Test that 404 is returned when payment is not found."""
-    webhook_data = {
-        'id': 'webhook_789',
-        'event_type': 'installment_plan_completed',
-        'entity_type': 'installment_plan',
-        'entity_id': 'nonexistent_plan_id',
-        'data': {
-            'installment_plan': {
-                'id': 'nonexistent_plan_id',
-                'status': 'completed',
-                'paid_installments_count': 3,
-                'number_of_installments': 3,
-                'user_email': 'test@example.com',
-                'payment_method': 'card',
-            }
-        },
-    }
+    webhook_data = _installment_plan_webhook(
+        'nonexistent_plan_id',
+        webhook_id='webhook_789',
+        event_type='installment_plan_completed',
+        status='completed',
+        paid_installments_count=3,
+    )
 
-    response = client.post('/webhooks/simplefi', json=webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert response.json()['detail'] == 'Payment not found'
 
 
-def test_simplefi_installment_webhook_already_approved(
-    client,
+@pytest.mark.asyncio
+async def test_simplefi_installment_webhook_already_approved(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
-    mock_webhook_cache,
-    mock_email_template,
     db_session,
 ):
     """Test that already approved payments return 200 (idempotent)."""
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
-    mock_response = {
-        'id': 'installment_plan_approved',
-        'status': 'pending',
-        'checkout_url': 'https://test.checkout.url',
-    }
-    mock_create_payment.return_value = mock_response
+    mock_create_payment.return_value = _simplefi_response('installment_plan_approved')
 
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
     payment = response.json()
 
@@ -897,58 +1137,37 @@ def test_simplefi_installment_webhook_already_approved(
     db_payment.status = 'approved'
     db_session.commit()
 
-    webhook_data = {
-        'id': 'webhook_approved',
-        'event_type': 'installment_plan_completed',
-        'entity_type': 'installment_plan',
-        'entity_id': 'installment_plan_approved',
-        'data': {
-            'installment_plan': {
-                'id': 'installment_plan_approved',
-                'status': 'completed',
-                'paid_installments_count': 3,
-                'number_of_installments': 3,
-                'user_email': 'test@example.com',
-                'payment_method': 'card',
-            }
-        },
-    }
+    webhook_data = _installment_plan_webhook(
+        'installment_plan_approved',
+        webhook_id='webhook_approved',
+        event_type='installment_plan_completed',
+        status='completed',
+        paid_installments_count=3,
+    )
 
-    response = client.post('/webhooks/simplefi', json=webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
     assert response.status_code == status.HTTP_200_OK
     assert response.json()['message'] == 'Installment plan completed - count synced'
 
 
-def test_simplefi_first_installment_approves_payment(
-    client,
+@pytest.mark.asyncio
+async def test_simplefi_first_installment_approves_payment(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
-    mock_webhook_cache,
-    mock_email_template,
     db_session,
 ):
     """Test that first installment payment approves the payment."""
-    from app.api.applications.models import Application
-    from app.api.attendees.models import AttendeeProduct
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
     # Create a payment with installments
-    mock_response = {
-        'id': 'installment_plan_first',
-        'status': 'pending',
-        'checkout_url': 'https://test.checkout.url',
-    }
-    mock_create_payment.return_value = mock_response
+    mock_create_payment.return_value = _simplefi_response('installment_plan_first')
 
     test_payment_data['installments'] = 3
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
     payment = response.json()
 
@@ -963,85 +1182,45 @@ def test_simplefi_first_installment_approves_payment(
     assert db_payment.installments_paid is None or db_payment.installments_paid == 0
 
     # Send first installment payment webhook
-    webhook_data = {
-        'id': 'webhook_first_installment',
-        'event_type': 'new_payment',
-        'entity_type': 'payment_request',
-        'entity_id': 'payment_req_1',
-        'data': {
-            'payment_request': {
-                'id': 'payment_req_1',
-                'order_id': 1,
-                'amount': 100.0,
-                'amount_paid': 100.0,
-                'currency': 'USD',
-                'reference': {},
-                'status': 'approved',
-                'status_detail': 'correct',
-                'transactions': [],
-                'card_payment': None,
-                'payments': [],
-                'installment_plan_id': 'installment_plan_first',
-            },
-            'new_payment': {
-                'coin': 'USD',
-                'hash': 'test_hash',
-                'amount': 100.0,
-                'paid_at': '2024-01-01T00:00:00Z',
-            },
-        },
-    }
+    webhook_data = _payment_request_webhook(
+        'payment_req_1',
+        webhook_id='webhook_first_installment',
+        installment_plan_id='installment_plan_first',
+    )
 
-    response = client.post('/webhooks/simplefi', json=webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
     assert response.status_code == status.HTTP_200_OK
     assert response.json()['message'] == 'Installment payment recorded'
 
     # Verify payment was approved and products assigned
-    db_session.refresh(db_payment)
     assert db_payment.status == 'approved'
     assert db_payment.installments_paid == 1
 
     # Verify products were assigned to attendees
-    attendee_products = (
-        db_session.query(AttendeeProduct)
-        .filter(
-            AttendeeProduct.attendee_id
-            == test_payment_data['products'][0]['attendee_id']
-        )
-        .all()
-    )
-    assert len(attendee_products) == 1
+    attendee_id = test_payment_data['products'][0]['attendee_id']
+    assert _assigned_products(db_session, test_payment_data['application_id']) == {
+        (attendee_id, 1): 1
+    }
 
 
-def test_simplefi_subsequent_installments_do_not_reapprove(
-    client,
+@pytest.mark.asyncio
+async def test_simplefi_subsequent_installments_do_not_reapprove(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
-    mock_webhook_cache,
-    mock_email_template,
     db_session,
 ):
     """Test that subsequent installments just increment counter."""
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
     # Create a payment with installments
-    mock_response = {
-        'id': 'installment_plan_subsequent',
-        'status': 'pending',
-        'checkout_url': 'https://test.checkout.url',
-    }
-    mock_create_payment.return_value = mock_response
+    mock_create_payment.return_value = _simplefi_response('installment_plan_subsequent')
 
     test_payment_data['installments'] = 3
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
     payment = response.json()
 
@@ -1054,76 +1233,90 @@ def test_simplefi_subsequent_installments_do_not_reapprove(
     db_session.commit()
 
     # Send second installment payment webhook
-    webhook_data = {
-        'id': 'webhook_second_installment',
-        'event_type': 'new_payment',
-        'entity_type': 'payment_request',
-        'entity_id': 'payment_req_2',
-        'data': {
-            'payment_request': {
-                'id': 'payment_req_2',
-                'order_id': 1,
-                'amount': 100.0,
-                'amount_paid': 100.0,
-                'currency': 'USD',
-                'reference': {},
-                'status': 'approved',
-                'status_detail': 'correct',
-                'transactions': [],
-                'card_payment': None,
-                'payments': [],
-                'installment_plan_id': 'installment_plan_subsequent',
-            },
-            'new_payment': {
-                'coin': 'USD',
-                'hash': 'test_hash_2',
-                'amount': 100.0,
-                'paid_at': '2024-01-15T00:00:00Z',
-            },
-        },
-    }
+    webhook_data = _payment_request_webhook(
+        'payment_req_2',
+        webhook_id='webhook_second_installment',
+        installment_plan_id='installment_plan_subsequent',
+        tx_hash='test_hash_2',
+        paid_at='2024-01-15T00:00:00Z',
+    )
 
-    response = client.post('/webhooks/simplefi', json=webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
     assert response.status_code == status.HTTP_200_OK
     assert response.json()['message'] == 'Installment payment recorded'
 
     # Verify payment is still approved and counter was incremented
-    db_session.refresh(db_payment)
     assert db_payment.status == 'approved'
     assert db_payment.installments_paid == 2
 
 
-def test_simplefi_installment_plan_cancelled_revokes_products(
-    client,
+def _payment_row(db_session, payment_id):
+    """installments_paid and version as stored, bypassing the identity map"""
+    return db_session.execute(
+        select(Payment.installments_paid, Payment.version).where(
+            Payment.id == payment_id
+        )
+    ).one()
+
+
+@pytest.mark.asyncio
+async def test_simplefi_installments_keep_loaded_payment_in_sync(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
-    mock_webhook_cache,
-    mock_email_template,
     db_session,
 ):
-    """Test that cancelled plan revokes products and restores inventory."""
-    from app.api.applications.models import Application
-    from app.api.attendees.models import AttendeeProduct
-    from app.api.products.models import Product
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
+    mock_create_payment.return_value = _simplefi_response('installment_plan_sync')
+    test_payment_data['installments'] = 3
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
+    payment = response.json()
+    db_payment = db_session.get(Payment, payment['id'])
+    db_payment.is_installment_plan = True
+    db_payment.installments_total = 3
     db_session.commit()
+    initial_version = db_payment.version
+
+    # The first installment also approves the payment, a second version bump
+    expected = [(1, initial_version + 2), (2, initial_version + 3)]
+    for number, (installments_paid, version) in enumerate(expected, start=1):
+        webhook_data = _payment_request_webhook(
+            f'payment_req_sync_{number}',
+            webhook_id=f'webhook_sync_{number}',
+            installment_plan_id='installment_plan_sync',
+        )
+        response = await async_client.post('/webhooks/simplefi', json=webhook_data)
+        assert response.json()['message'] == 'Installment payment recorded'
 
+        assert (db_payment.installments_paid, db_payment.version) == (
+            installments_paid,
+            version,
+        )
+        assert _payment_row(db_session, payment['id']) == (installments_paid, version)
+
+
+@pytest.mark.asyncio
+async def test_simplefi_installment_plan_cancelled_revokes_products(
+    async_client,
+    auth_headers,
+    test_payment_data,
+    accepted_application,
+    test_products,
+    mock_create_payment,
+    db_session,
+):
+    """Test that cancelled plan revokes products and restores inventory."""
     # Create a payment with installments
-    mock_response = {
-        'id': 'installment_plan_cancel',
-        'status': 'pending',
-        'checkout_url': 'https://test.checkout.url',
-    }
-    mock_create_payment.return_value = mock_response
+    mock_create_payment.return_value = _simplefi_response('installment_plan_cancel')
 
     test_payment_data['installments'] = 3
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
     payment = response.json()
 
@@ -1139,119 +1332,66 @@ def test_simplefi_installment_plan_cancelled_revokes_products(
     initial_sold = product.current_sold or 0
 
     # Send first installment to approve and assign products
-    webhook_data = {
-        'id': 'webhook_first_cancel',
-        'event_type': 'new_payment',
-        'entity_type': 'payment_request',
-        'entity_id': 'payment_req_cancel_1',
-        'data': {
-            'payment_request': {
-                'id': 'payment_req_cancel_1',
-                'order_id': 1,
-                'amount': 100.0,
-                'amount_paid': 100.0,
-                'currency': 'USD',
-                'reference': {},
-                'status': 'approved',
-                'status_detail': 'correct',
-                'transactions': [],
-                'card_payment': None,
-                'payments': [],
-                'installment_plan_id': 'installment_plan_cancel',
-            },
-            'new_payment': {
-                'coin': 'USD',
-                'hash': 'test_hash',
-                'amount': 100.0,
-                'paid_at': '2024-01-01T00:00:00Z',
-            },
-        },
-    }
-    response = client.post('/webhooks/simplefi', json=webhook_data)
+    webhook_data = _payment_request_webhook(
+        'payment_req_cancel_1',
+        webhook_id='webhook_first_cancel',
+        installment_plan_id='installment_plan_cancel',
+    )
+    response = await async_client.post('/webhooks/simplefi', json=webhook_data)
     assert response.status_code == status.HTTP_200_OK
 
     # Verify payment approved and products assigned
-    db_session.refresh(db_payment)
-    db_session.refresh(product)
     assert db_payment.status == 'approved'
 
     # Check products are assigned
     attendee_id = test_payment_data['products'][0]['attendee_id']
-    attendee_products = (
-        db_session.query(AttendeeProduct)
-        .filter(AttendeeProduct.attendee_id == attendee_id)
-        .all()
-    )
-    assert len(attendee_products) == 1
+    assert _assigned_products(db_session, test_payment_data['application_id']) == {
+        (attendee_id, 1): 1
+    }
 
     # Now send installment_plan_cancelled webhook
-    cancel_webhook_data = {
-        'id': 'webhook_cancel',
-        'event_type': 'installment_plan_cancelled',
-        'entity_type': 'installment_plan',
-        'entity_id': 'installment_plan_cancel',
-        'merchant_id': 'merchant_abc',
-        'data': {
-            'installment_plan': {
-                'id': 'installment_plan_cancel',
-                'status': 'cancelled',
-                'paid_installments_count': 1,
-                'number_of_installments': 3,
-                'user_email': 'test@example.com',
-                'payment_method': 'card',
-            }
-        },
-    }
+    cancel_webhook_data = _installment_plan_webhook(
+        'installment_plan_cancel',
+        webhook_id='webhook_cancel',
+        event_type='installment_plan_cancelled',
+        status='cancelled',
+        paid_installments_count=1,
+    )
 
-    response = client.post('/webhooks/simplefi', json=cancel_webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=cancel_webhook_data)
     assert response.status_code == status.HTTP_200_OK
     assert response.json()['message'] == 'Installment plan cancelled successfully'
 
     # Verify payment status is cancelled
-    db_session.refresh(db_payment)
     assert db_payment.status == 'cancelled'
 
     # Verify products were removed from attendees
-    attendee_products = (
-        db_session.query(AttendeeProduct)
-        .filter(AttendeeProduct.attendee_id == attendee_id)
-        .all()
-    )
-    assert len(attendee_products) == 0
+    assert _assigned_products(db_session, test_payment_data['application_id']) == {}
 
     # Verify inventory was restored
-    db_session.refresh(product)
     assert product.current_sold == initial_sold
 
 
-def test_simplefi_installment_plan_cancelled_before_payment(
-    client,
+@pytest.mark.asyncio
+async def test_simplefi_installment_plan_cancelled_before_payment(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
-    mock_webhook_cache,
     db_session,
 ):
     """Test that cancelled plan before first payment just updates status."""
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
     # Create a payment with installments
-    mock_response = {
-        'id': 'installment_plan_cancel_early',
-        'status': 'pending',
-        'checkout_url': 'https://test.checkout.url',
-    }
-    mock_create_payment.return_value = mock_response
+    mock_create_payment.return_value = _simplefi_response(
+        'installment_plan_cancel_early'
+    )
 
     test_payment_data['installments'] = 3
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
     payment = response.json()
 
@@ -1265,59 +1405,39 @@ def test_simplefi_installment_plan_cancelled_before_payment(
     assert db_payment.status == 'pending'
 
     # Send installment_plan_cancelled webhook
-    cancel_webhook_data = {
-        'id': 'webhook_cancel_early',
-        'event_type': 'installment_plan_cancelled',
-        'entity_type': 'installment_plan',
-        'entity_id': 'installment_plan_cancel_early',
-        'data': {
-            'installment_plan': {
-                'id': 'installment_plan_cancel_early',
-                'status': 'cancelled',
-                'paid_installments_count': 0,
-                'number_of_installments': 3,
-                'user_email': 'test@example.com',
-                'payment_method': 'card',
-            }
-        },
-    }
+    cancel_webhook_data = _installment_plan_webhook(
+        'installment_plan_cancel_early',
+        webhook_id='webhook_cancel_early',
+        event_type='installment_plan_cancelled',
+        status='cancelled',
+        paid_installments_count=0,
+    )
 
-    response = client.post('/webhooks/simplefi', json=cancel_webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=cancel_webhook_data)
     assert response.status_code == status.HTTP_200_OK
     assert response.json()['message'] == 'Installment plan cancelled successfully'
 
     # Verify payment status is cancelled
-    db_session.refresh(db_payment)
     assert db_payment.status == 'cancelled'
 
 
-def test_simplefi_installment_plan_cancelled_idempotent(
-    client,
+@pytest.mark.asyncio
+async def test_simplefi_installment_plan_cancelled_idempotent(
+    async_client,
     auth_headers,
     test_payment_data,
+    accepted_application,
     test_products,
     mock_create_payment,
-    mock_webhook_cache,
     db_session,
 ):
     """Test that duplicate cancelled webhooks are handled."""
-    from app.api.applications.models import Application
-
-    application = db_session.get(Application, test_payment_data['application_id'])
-    application.status = ApplicationStatus.ACCEPTED.value
-    application.scholarship_request = False
-    application.discount_assigned = None
-    db_session.commit()
-
     # Create a payment
-    mock_response = {
-        'id': 'installment_plan_idempotent',
-        'status': 'pending',
-        'checkout_url': 'https://test.checkout.url',
-    }
-    mock_create_payment.return_value = mock_response
+    mock_create_payment.return_value = _simplefi_response('installment_plan_idempotent')
 
-    response = client.post('/payments/', json=test_payment_data, headers=auth_headers)
+    response = await async_client.post(
+        '/payments/', json=test_payment_data, headers=auth_headers
+    )
     assert response.status_code == status.HTTP_200_OK
     payment = response.json()
 
@@ -1328,23 +1448,117 @@ def test_simplefi_installment_plan_cancelled_idempotent(
     db_session.commit()
 
     # Send installment_plan_cancelled webhook
-    cancel_webhook_data = {
-        'id': 'webhook_idempotent',
-        'event_type': 'installment_plan_cancelled',
-        'entity_type': 'installment_plan',
-        'entity_id': 'installment_plan_idempotent',
-        'data': {
-            'installment_plan': {
-                'id': 'installment_plan_idempotent',
-                'status': 'cancelled',
-                'paid_installments_count': 1,
-                'number_of_installments': 3,
-                'user_email': 'test@example.com',
-                'payment_method': 'card',
-            }
-        },
-    }
+    cancel_webhook_data = _installment_plan_webhook(
+        'installment_plan_idempotent',
+        webhook_id='webhook_idempotent',
+        event_type='installment_plan_cancelled',
+        status='cancelled',
+        paid_installments_count=1,
+    )
 
-    response = client.post('/webhooks/simplefi', json=cancel_webhook_data)
+    response = await async_client.post('/webhooks/simplefi', json=cancel_webhook_data)
     assert response.status_code == status.HTTP_200_OK
     assert response.json()['message'] == 'Payment already cancelled'
+
+
+def test_inventory_adjusted_in_bulk(db_session, test_attendee, test_products):
+    """Decrement/increment only touch tracked products and never go below zero."""
+    tracked, untracked = test_products
+    tracked.max_inventory = 10
+    tracked.current_sold = 2
+    untracked.current_sold = 5
+    payment = Payment(application_id=test_attendee.application_id, status='approved')
+    db_session.add(payment)
+    db_session.flush()
+    for product, quantity in ((tracked, 3), (untracked, 1)):
+        db_session.add(
+            PaymentProduct(
+                payment_id=payment.id,
+                product_id=product.id,
+                attendee_id=test_attendee.id,
+                quantity=quantity,
+            )
+        )
+    db_session.commit()
+
+    payment_crud._decrement_inventory(db_session, payment)
+    db_session.commit()
+    assert tracked.current_sold == 5
+    assert untracked.current_sold == 5
+
+    tracked.current_sold = 1
+    db_session.commit()
+    payment_crud._increment_inventory(db_session, payment)
+    db_session.commit()
+    assert tracked.current_sold == 0
+    assert untracked.current_sold == 5
+
+
+def test_clear_application_products_returns_inventory(
+    db_session, test_attendee_product, test_products
+):
+    product = test_products[0]
+    product.max_inventory = 10
+    product.current_sold = 5
+    test_attendee_product.quantity = 2
+    payment = Payment(application_id=test_attendee_product.attendee.application_id)
+    db_session.add(payment)
+    db_session.commit()
+
+    payment_crud._clear_application_products(db_session, payment)
+    db_session.commit()
+
+    assert db_session.query(AttendeeProduct).count() == 0
+    assert product.current_sold == 3
+
+
+@pytest.mark.asyncio
+async def test_edit_passes_to_patreon_requires_existing_patreon(
+    async_client,
+    auth_headers,
+    test_payment_data,
+    accepted_application,
+    test_products,
+    db_session,
+):
+    patreon = test_products[1]
+    patreon.category = 'patreon'
+    db_session.commit()
+
+    preview_data = {
+        **test_payment_data,
+        'edit_passes': True,
+        'products': [{**test_payment_data['products'][0], 'product_id': patreon.id}],
+    }
+    response = await async_client.post(
+        '/payments/preview', json=preview_data, headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()['detail'] == 'Cannot edit passes for Patreon products'
+
+    attendee_id = test_payment_data['products'][0]['attendee_id']
+    db_session.add(AttendeeProduct(attendee_id=attendee_id, product_id=patreon.id))
+    db_session.commit()
+
+    response = await async_client.post(
+        '/payments/preview', json=preview_data, headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test_discounted_price_is_computed_in_cents():
+    assert _get_discounted_cents(1999, 15) == 1699
+    assert _get_discounted_cents(1000, 12.5) == 875
+    # 0.1 + 0.2 would drift in floats
+    assert (
+        _calculate_price(
+            discountable_amount=0.1,
+            non_discountable_amount=0.2,
+            supporter_amount=0,
+            patreon_amount=0,
+            discount_value=0,
+            application=None,
+            attendees_subtotal=None,
+        )
+        == 0.3
+    )
@@ -0,0 +1,179 @@
+from datetime import timedelta
+
+import pytest
+
+from app.api.applications.models import Application
+from app.api.applications.schemas import ApplicationStatus
+from app.api.attendees.models import Attendee, AttendeeProduct
+from app.api.check_in.models import CheckIn
+from app.api.email_logs.models import EmailLog
+from app.api.email_logs.schemas import EmailEvent
+from app.api.popup_city.models import PopUpCity
+from app.api.products.models import Product
+from app.core.utils import current_time
+from app.processes.send_prearrival_emails import (
+    POPUP_CITY_SLUG,
+    get_prearrival_candidates,
+    send_prearrival_emails,
+)
+
+
+@pytest.fixture
+def prearrival_popup(db_session):
+    popup = PopUpCity(
+        id=1,
+        name='Edge Patagonia',
+        slug=POPUP_CITY_SLUG,
+        prefix='EP',
+        location='Patagonia',
+        start_date=current_time() + timedelta(days=30),
+    )
+    db_session.add(popup)
+    db_session.commit()
+    return popup
+
+
+@pytest.fixture
+def create_application_with_product(db_session, create_test_citizen, prearrival_popup):
+    """Factory creating an application whose main attendee holds one product"""
+
+    def _create(citizen_id: int, product_start_date):
+        citizen = create_test_citizen(citizen_id)
+        application = Application(
+            id=citizen_id,
+            first_name='Test',
+            last_name='User',
+            email=citizen.primary_email,
+            citizen_id=citizen.id,
+            popup_city_id=prearrival_popup.id,
+            _status=ApplicationStatus.ACCEPTED.value,
+        )
+        attendee = Attendee(
+            id=citizen_id,
+            application=application,
+            name=f'Attendee {citizen_id}',
+            category='main',
+            email=citizen.primary_email,
+            check_in_code=f'CODE{citizen_id}',
+        )
+        product = Product(
+            id=citizen_id,
+            name=f'Pass {citizen_id}',
+            slug=f'pass-{citizen_id}',
+            price=100.0,
+            category='ticket',
+            popup_city_id=prearrival_popup.id,
+            start_date=product_start_date,
+        )
+        db_session.add_all([application, attendee, product])
+        db_session.flush()
+        db_session.add(AttendeeProduct(attendee_id=attendee.id, product_id=product.id))
+        db_session.commit()
+        return application
+
+    return _create
+
+
+def test_prearrival_filters_by_earliest_start_date(
+    db_session, create_application_with_product
+):
+    soon = create_application_with_product(1, current_time() + timedelta(days=3))
+    create_application_with_product(2, current_time() + timedelta(days=10))
+    # No product start date and the popup starts in 30 days
+    create_application_with_product(3, None)
+
+    applications_5day, applications_24h = get_prearrival_candidates(db_session)
+
+    assert [a.id for a in applications_5day] == [soon.id]
+    assert applications_24h == []
+
+
+def test_prearrival_skips_already_emailed_applications(
+    db_session, create_application_with_product
+):
+    pending = create_application_with_product(1, current_time())
+    emailed = create_application_with_product(2, current_time())
+    db_session.add(
+        EmailLog(
+            receiver_email=emailed.email,
+            event=EmailEvent.PRE_ARRIVAL.value,
+            template='pre-arrival',
+            status='success',
+        )
+    )
+    db_session.commit()
+
+    applications_5day, applications_24h = get_prearrival_candidates(db_session)
+
+    assert [a.id for a in applications_5day] == [pending.id]
+    # The 24h email is tracked separately
+    assert len(applications_24h) == 2
+
+
+def test_24h_prearrival_skips_checked_in_applications(
+    db_session, create_application_with_product
+):
+    pending = create_application_with_product(1, current_time())
+    checked_in = create_application_with_product(2, current_time())
+    db_session.add(
+        CheckIn(
+            code='CODE2',
+            attendee_id=checked_in.attendees[0].id,
+            virtual_check_in=False,
+            qr_check_in=True,
+        )
+    )
+    db_session.commit()
+
+    applications_5day, applications_24h = get_prearrival_candidates(db_session)
+
+    assert [a.id for a in applications_24h] == [pending.id]
+    # Checking in only affects the 24h email
+    assert len(applications_5day) == 2
+
+
+def test_send_prearrival_emails_sends_one_batch(
+    db_session, create_application_with_product, mock_email_template, mock_send_batch
+):
+    due_today = create_application_with_product(1, current_time())
+    due_soon = create_application_with_product(2, current_time() + timedelta(days=3))
+
+    send_prearrival_emails(db_session)
+
+    mock_send_batch.assert_called_once()
+    messages = mock_send_batch.call_args.args[0]
+    # Both get the 5-day email, only the one starting today gets the 24h one
+    assert sorted(m['To'] for m in messages) == sorted(
+        [due_today.email, due_today.email, due_soon.email]
+    )
+    assert all(m['Attachments'] for m in messages)
+
+    logs = db_session.query(EmailLog).all()
+    assert sorted((log.receiver_email, log.event) for log in logs) == sorted(
+        [
+            (due_today.email, EmailEvent.PRE_ARRIVAL.value),
+            (due_today.email, EmailEvent.PRE_ARRIVAL_24H.value),
+            (due_soon.email, EmailEvent.PRE_ARRIVAL.value),
+        ]
+    )
+
+
+def test_prearrival_candidates_only_load_needed_attendees(
+    db_session, create_application_with_product
+):
+    application = create_application_with_product(1, current_time())
+    db_session.add(
+        Attendee(
+            application_id=application.id,
+            name='Guest Without Pass',
+            category='spouse',
+            email='guest@example.com',
+            check_in_code='GUEST1',
+        )
+    )
+    db_session.commit()
+    db_session.expire_all()
+
+    applications_5day, _ = get_prearrival_candidates(db_session)
+
+    assert [a.name for a in applications_5day[0].attendees] == ['Attendee 1']
@@ -0,0 +1,281 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from fastapi import status
+
+from app.api.email_logs.models import EmailLog
+from app.api.email_logs.schemas import EmailStatus
+from app.api.webhooks.models import ProcessedWebhook
+from app.core.cache import WebhookCache
+from app.core.config import settings
+from app.core.utils import current_time
+from app.processes.purge_processed_webhooks import (
+    PROCESSED_WEBHOOK_RETENTION,
+    purge_processed_webhooks,
+)
+
+_NOCODB_SECRET = 'test-secret'
+
+
+def _nocodb_payload(rows):
+    return {
+        'type': 'records.after.update',
+        'id': 'test-webhook-id',
+        'data': {
+            'table_id': 'test-table',
+            'table_name': 'applications',
+            'rows': rows,
+        },
+    }
+
+
+@pytest.fixture
+def nocodb_http(monkeypatch):
+    """Configure the NocoDB webhook secret and stub the client that patches NocoDB"""
+    monkeypatch.setattr(settings, 'NOCODB_WEBHOOK_SECRET', _NOCODB_SECRET)
+    with patch('app.api.webhooks.routes.http_client') as mock_http:
+        yield mock_http
+
+
+def test_send_email_webhook_sends_in_background(
+    client,
+    test_application_with_attendee,
+    mock_send_batch,
+):
+    application = test_application_with_attendee
+    payload = _nocodb_payload(
+        [{'id': application.id, 'email': application.email, 'first_name': 'Test'}]
+    )
+
+    response = client.post(
+        '/webhooks/send_email',
+        params={'event': 'application-received', 'fields': 'first_name'},
+        json=payload,
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    mock_send_batch.assert_called_once()
+    [message] = mock_send_batch.call_args.args[0]
+    assert message['To'] == application.email
+    assert message['TemplateModel']['first_name'] == 'Test'
+
+
+def test_send_email_webhook_skips_rows_without_email(
+    client,
+    test_application_with_attendee,
+    mock_send_batch,
+):
+    payload = _nocodb_payload([{'id': test_application_with_attendee.id}])
+
+    response = client.post(
+        '/webhooks/send_email',
+        params={'event': 'application-received', 'fields': 'first_name'},
+        json=payload,
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    mock_send_batch.assert_not_called()
+
+
+def test_send_email_webhook_skips_already_sent(
+    client,
+    db_session,
+    test_application_with_attendee,
+    mock_send_batch,
+):
+    application = test_application_with_attendee
+    db_session.add(
+        EmailLog(
+            receiver_email=application.email,
+            template='application-received',
+            event='application-received',
+            status=EmailStatus.SUCCESS,
+            entity_type='application',
+            entity_id=application.id,
+        )
+    )
+    db_session.commit()
+
+    payload = _nocodb_payload([{'id': application.id, 'email': application.email}])
+    response = client.post(
+        '/webhooks/send_email',
+        params={'event': 'application-received', 'fields': 'first_name'},
+        json=payload,
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    mock_send_batch.assert_not_called()
+
+
+def test_send_email_webhook_logs_scheduled_emails(
+    client,
+    db_session,
+    test_application_with_attendee,
+    mock_send_batch,
+):
+    application = test_application_with_attendee
+    payload = _nocodb_payload([{'id': application.id, 'email': application.email}])
+    response = client.post(
+        '/webhooks/send_email',
+        params={
+            'event': 'application-received',
+            'fields': 'first_name',
+            'delay': 60,
+        },
+        json=payload,
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    mock_send_batch.assert_not_called()
+    log = db_session.query(EmailLog).filter(EmailLog.entity_id == application.id).one()
+    assert log.status == EmailStatus.SCHEDULED
+    assert log.send_at is not None
+
+
+def test_webhook_cache_expires_old_fingerprints():
+    cache = WebhookCache(expiry=timedelta(seconds=2))
+    start = current_time()
+    with patch('app.core.cache.current_time', return_value=start):
+        assert cache.add('first')
+        assert not cache.add('first')
+    with patch(
+        'app.core.cache.current_time', return_value=start + timedelta(seconds=1)
+    ):
+        assert cache.add('second')
+    with patch(
+        'app.core.cache.current_time', return_value=start + timedelta(seconds=3)
+    ):
+        assert not cache.exists('first')
+        assert cache.exists('second')
+        assert cache.add('first')
+        cache.discard('second')
+        assert cache.add('second')
+
+
+def test_update_status_webhook_patches_nocodb_once(
+    client,
+    nocodb_http,
+    test_application_with_attendee,
+):
+    application = test_application_with_attendee
+    payload = _nocodb_payload(
+        [
+            {'id': application.id, 'status': 'draft', 'calculated_status': 'accepted'},
+            {'id': 999, 'status': 'draft', 'calculated_status': 'accepted'},
+        ]
+    )
+
+    response = client.post(
+        '/webhooks/update_status',
+        json=payload,
+        headers={'secret': _NOCODB_SECRET},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    nocodb_http.patch.assert_called_once()
+    updates = nocodb_http.patch.call_args.kwargs['json']
+    assert [u['id'] for u in updates] == [application.id]
+    assert updates[0]['status'] == 'accepted'
+
+
+def test_update_status_webhook_cancels_scheduled_emails(
+    client,
+    db_session,
+    nocodb_http,
+    test_application_with_attendee,
+):
+    application = test_application_with_attendee
+    scheduled = EmailLog(
+        receiver_email=application.email,
+        template='application-approved',
+        event='application-approved',
+        status=EmailStatus.SCHEDULED,
+        entity_type='application',
+        entity_id=application.id,
+    )
+    db_session.add(scheduled)
+    db_session.commit()
+    payload = _nocodb_payload(
+        [{'id': application.id, 'status': 'draft', 'calculated_status': 'accepted'}]
+    )
+
+    response = client.post(
+        '/webhooks/update_status',
+        json=payload,
+        headers={'secret': _NOCODB_SECRET},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    db_session.refresh(scheduled)
+    assert scheduled.status == EmailStatus.CANCELLED
+
+
+def test_update_status_webhook_skips_unchanged_group_applications(
+    client,
+    db_session,
+    nocodb_http,
+    test_application_with_attendee,
+    test_group,
+):
+    application = test_application_with_attendee
+    application.group_id = test_group.id
+    db_session.commit()
+    payload = _nocodb_payload(
+        [{'id': application.id, 'status': 'accepted', 'calculated_status': 'draft'}]
+    )
+
+    response = client.post(
+        '/webhooks/update_status',
+        json=payload,
+        headers={'secret': _NOCODB_SECRET},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    nocodb_http.patch.assert_not_called()
+
+
+def test_simplefi_webhook_rejects_malformed_payment(client):
+    response = client.post(
+        '/webhooks/simplefi', json={'event_type': 'new_payment', 'id': 'x'}
+    )
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_send_email_webhook_rejects_malformed_payload(client):
+    response = client.post(
+        '/webhooks/send_email',
+        params={'event': 'application-received', 'fields': 'first_name'},
+        json={'type': 'records.after.update', 'id': 'x', 'data': {'rows': []}},
+    )
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_update_status_webhook_rejects_invalid_secret(client, nocodb_http):
+    response = client.post(
+        '/webhooks/update_status',
+        json=_nocodb_payload([{'id': 1}]),
+        headers={'secret': 'wrong-secret'},
+    )
+
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_purge_processed_webhooks_keeps_recent_claims(db_session):
+    now = current_time()
+    db_session.add_all(
+        [
+            ProcessedWebhook(
+                fingerprint='simplefi:old',
+                processed_at=now - PROCESSED_WEBHOOK_RETENTION - timedelta(days=1),
+            ),
+            ProcessedWebhook(fingerprint='simplefi:recent', processed_at=now),
+        ]
+    )
+    db_session.commit()
+
+    assert purge_processed_webhooks(db_session) == 1
+    remaining = db_session.query(ProcessedWebhook.fingerprint).all()
+    assert [f for (f,) in remaining] == ['simplefi:recent']